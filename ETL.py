@@ -1,11 +1,19 @@
+import argparse
+import hashlib
+import json
+import os
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
 
 
-# Loading the data
-
-df = pd.read_csv('CSV_files/Dataset_maternal_mental_health_infant_sleep.csv', encoding='ISO-8859-1')
+RAW_PATH = 'CSV_files/Dataset_maternal_mental_health_infant_sleep.csv'
+PARTICIPANT_PATH = 'CSV_files/participant.csv'
+MENTAL_HEALTH_PATH = 'CSV_files/mental_health.csv'
+PARTICIPANT_PARQUET = 'CSV_files/participant.parquet'
+MENTAL_HEALTH_PARQUET = 'CSV_files/mental_health.parquet'
 
 # Cleaning the data
 
@@ -17,7 +25,7 @@ def clean_columns(df):
         s = s.strip().lower()
         s = re.sub(r'\s+', ' ', s)
         return s
-    
+
     if isinstance(df.columns, pd.MultiIndex):
         flat = ['_'.join(_clean(str(p)) for p in tup if str(p) != 'None') for tup in df.columns]
         df.columns = flat
@@ -25,11 +33,9 @@ def clean_columns(df):
         df.columns = df.columns.map(lambda c: _clean(str(c)))
     return df
 
-df = clean_columns(df)
+drop_columns = ['birth_1mth_m_inclusion', 'birth_12mth_m_inclusion', 'child_survey_participation']
 
-df.drop(['birth_1mth_m_inclusion', 'birth_12mth_m_inclusion', 'child_survey_participation'], axis=1, inplace=True)
-
-df.rename(columns={
+rename_columns = {
     'type_parents': 'mother_or_partner',
     'marital_status_autre': 'marital_status_other',
     'gestationnal_age': 'infant_gestational_age',
@@ -39,23 +45,20 @@ df.rename(columns={
     'sleep_night_duration_bb1': 'infant_nightly_sleep_duration',
     'night_awakening_number_bb1': 'infant_wakes_per_night',
     'how_falling_asleep_bb1': 'infant_sleeping_method'
-}, inplace=True)
+}
 
 # Splitting the dataframe into two separate dataframes to make the analysis more manageable
 
-participant_info = ['participant_number', 'mother_or_partner', 'age', 'marital_status', 'marital_status_other', 'marital_status_edit', 
+participant_info = ['participant_number', 'mother_or_partner', 'age', 'marital_status', 'marital_status_other', 'marital_status_edit',
                      'education', 'infant_gestational_age', 'pregnancy_type', 'infant_sex', 'infant_age_category', 'infant_nightly_sleep_duration',
                      'infant_wakes_per_night', 'infant_sleeping_method']
-mental_health_info = ['participant_number', 'cbts_m_3', 'cbts_m_4', 'cbts_m_5', 'cbts_m_6', 'cbts_m_7', 'cbts_m_8', 'cbts_m_9', 'cbts_m_10', 
-                      'cbts_m_11', 'cbts_m_12', 'cbts_13', 'cbts_14', 'cbts_15', 'cbts_16', 'cbts_17', 'cbts_18', 'cbts_19', 'cbts_20', 'cbts_21', 
-                      'cbts_22', 'epds_1', 'epds_2', 'epds_3', 'epds_4', 'epds_5', 'epds_6', 'epds_7', 'epds_8', 'epds_9', 'epds_10', 'hads_1', 
-                      'hads_3', 'hads_5', 'hads_7', 'hads_9', 'hads_11', 'hads_13', 'ibq_r_vsf_3_bb1', 'ibq_r_vsf_4_bb1', 'ibq_r_vsf_9_bb1', 
-                      'ibq_r_vsf_10_bb1', 'ibq_r_vsf_16_bb1', 'ibq_r_vsf_17_bb1', 'ibq_r_vsf_28_bb1', 'ibq_r_vsf_29_bb1', 'ibq_r_vsf_32_bb1', 
+mental_health_info = ['participant_number', 'cbts_m_3', 'cbts_m_4', 'cbts_m_5', 'cbts_m_6', 'cbts_m_7', 'cbts_m_8', 'cbts_m_9', 'cbts_m_10',
+                      'cbts_m_11', 'cbts_m_12', 'cbts_13', 'cbts_14', 'cbts_15', 'cbts_16', 'cbts_17', 'cbts_18', 'cbts_19', 'cbts_20', 'cbts_21',
+                      'cbts_22', 'epds_1', 'epds_2', 'epds_3', 'epds_4', 'epds_5', 'epds_6', 'epds_7', 'epds_8', 'epds_9', 'epds_10', 'hads_1',
+                      'hads_3', 'hads_5', 'hads_7', 'hads_9', 'hads_11', 'hads_13', 'ibq_r_vsf_3_bb1', 'ibq_r_vsf_4_bb1', 'ibq_r_vsf_9_bb1',
+                      'ibq_r_vsf_10_bb1', 'ibq_r_vsf_16_bb1', 'ibq_r_vsf_17_bb1', 'ibq_r_vsf_28_bb1', 'ibq_r_vsf_29_bb1', 'ibq_r_vsf_32_bb1',
                       'ibq_r_vsf_33_bb1']
 
-participant_df = df[participant_info].copy()
-mental_health_df = df[mental_health_info].copy()
-
 # Cleaning the mental health evaluation columns
 
 def clean_psych_columns(df):
@@ -65,29 +68,18 @@ def clean_psych_columns(df):
 
         if col.startswith('cbts'):
             return re.sub(r'_m_', '_', col)
-        
+
         elif col.startswith('ibq'):
             col = re.sub(r'_r_vsf', '', col)
             col = re.sub(r'_bb1', '', col)
             return col
-        
+
         else:
             return col
-    
+
     df.columns = [clean_name(c) for c in df.columns]
     return df
 
-mental_health_df = clean_psych_columns(mental_health_df)
-
-# Dropping the unnecessary marital status columns and creating a final marital status column
-
-participant_df.drop(['mother_or_partner', 'marital_status', 'marital_status_other'], axis=1, inplace=True)
-participant_df.rename(columns={
-    'marital_status_edit': 'marital_status'
-}, inplace=True)
-
-
-
 # Decoding the participant dataframe
 
 decode_marital_status = {
@@ -96,8 +88,6 @@ decode_marital_status = {
     3: 'Separated, divorced or widowed'
 }
 
-participant_df['marital_status'] = participant_df['marital_status'].map(decode_marital_status)
-
 #---------------------
 
 decode_education = {
@@ -108,8 +98,6 @@ decode_education = {
     5: "Bachelor's degree or above"
 }
 
-participant_df['education'] = participant_df['education'].map(decode_education)
-
 #---------------------
 
 decode_pregnancy_type = {
@@ -117,8 +105,6 @@ decode_pregnancy_type = {
     2: 'Twin pregnancy'
 }
 
-participant_df['pregnancy_type'] = participant_df['pregnancy_type'].map(decode_pregnancy_type)
-
 #---------------------
 
 decode_infant_sex = {
@@ -126,8 +112,6 @@ decode_infant_sex = {
     2: 'Male'
 }
 
-participant_df['infant_sex'] = participant_df['infant_sex'].map(decode_infant_sex)
-
 #---------------------
 
 decode_infant_age_category = {
@@ -136,8 +120,6 @@ decode_infant_age_category = {
     3: '9-12 months'
 }
 
-participant_df['infant_age_category'] = participant_df['infant_age_category'].map(decode_infant_age_category)
-
 #---------------------
 
 decode_infant_sleeping_method = {
@@ -148,7 +130,14 @@ decode_infant_sleeping_method = {
     5: 'In the crib with parental presence'
 }
 
-participant_df['infant_sleeping_method'] = participant_df['infant_sleeping_method'].map(decode_infant_sleeping_method)
+decode_maps = {
+    'marital_status': decode_marital_status,
+    'education': decode_education,
+    'pregnancy_type': decode_pregnancy_type,
+    'infant_sex': decode_infant_sex,
+    'infant_age_category': decode_infant_age_category,
+    'infant_sleeping_method': decode_infant_sleeping_method
+}
 
 # Converting the hours column
 
@@ -159,24 +148,326 @@ def convert_to_hours(t):
     except:
         return np.nan
 
-participant_df['infant_nightly_sleep_duration'] = participant_df['infant_nightly_sleep_duration'].apply(convert_to_hours)
+# Vectorized versions of the decoding and hour conversion (same results, no per-row Python calls)
+
+def parse_hours(s):
+    '''Array version of convert_to_hours: HH:MM strings to decimal hours, NaN where the value does not parse.
+
+    Durations repeat a lot (10:00, 10:30, ...), so the column is factorized first and the string parsing
+    only runs over the distinct values before being broadcast back with the codes.'''
+    codes, uniques = pd.factorize(s)
+    parts = pd.Series(uniques, dtype=object).astype(str).str.extract(r'^\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*$')
+    hours = (parts[0].astype(float) + parts[1].astype(float) / 60).to_numpy()
+    hours = np.append(hours, np.nan)  # code -1 (missing) picks up the trailing NaN
+    return pd.Series(hours[codes], index=s.index, name=s.name)
+
+
+def decode_columns(df, maps=None):
+    '''Decode every coded column in one pass into pd.Categorical, using the decode_* tables.
+
+    The codes of all columns are looked up together in a single (column, code) table, and each
+    column is then wrapped with Categorical.from_codes so no string objects are created per row.
+    Codes that are missing or not in the table become NaN, as with Series.map.'''
+    maps = decode_maps if maps is None else maps
+    cols = list(maps)
+
+    width = int(max(max(codes) for codes in maps.values())) + 1
+    lookup = np.full((len(cols), width + 1), -1, dtype=np.int16)  # last slot catches invalid codes
+    for i, codes in enumerate(maps.values()):
+        for j, code in enumerate(codes):
+            lookup[i, code] = j
+
+    values = np.column_stack([pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=float) for c in cols])
+    with np.errstate(invalid='ignore'):
+        idx = values.astype(np.intp)
+    valid = (idx == values) & (idx >= 0) & (idx < width)
+    idx[~valid] = width
+    cat_codes = lookup[np.arange(len(cols)), idx]
+
+    out = df.copy(deep=False)
+    for i, (col, codes) in enumerate(maps.items()):
+        out[col] = pd.Categorical.from_codes(cat_codes[:, i], categories=list(codes.values()))
+    return out
+
+
+# Column types of the Parquet outputs: integer IDs, nullable small ints for the Likert items,
+# floats for the continuous measures and categoricals for the decoded fields
+
+participant_dtypes = {
+    'participant_number': 'int32',
+    'age': 'float32',
+    'marital_status': pd.CategoricalDtype(list(decode_marital_status.values())),
+    'education': pd.CategoricalDtype(list(decode_education.values())),
+    'infant_gestational_age': 'float64',
+    'pregnancy_type': pd.CategoricalDtype(list(decode_pregnancy_type.values())),
+    'infant_sex': pd.CategoricalDtype(list(decode_infant_sex.values())),
+    'infant_age_category': pd.CategoricalDtype(list(decode_infant_age_category.values())),
+    'infant_nightly_sleep_duration': 'float64',
+    'infant_wakes_per_night': 'float32',
+    'infant_sleeping_method': pd.CategoricalDtype(list(decode_infant_sleeping_method.values()))
+}
+
+mental_health_dtypes = {
+    col: 'int32' if col == 'participant_number' else 'Int8'
+    for col in clean_psych_columns(pd.DataFrame(columns=mental_health_info)).columns
+}
+
+
+def apply_schema(df, dtypes):
+    '''Cast a consolidated frame to the column types of its Parquet output'''
+    return df[list(dtypes)].astype(dtypes)
+
 
+def arrow_schema(dtypes):
+    '''Arrow schema matching apply_schema, used to append chunks to a single Parquet file'''
+    empty = apply_schema(pd.DataFrame({col: pd.Series(dtype='float64') for col in dtypes}), dtypes)
+    return pa.Schema.from_pandas(empty, preserve_index=False)
 
-participant_df = (
-    participant_df
-    .groupby('participant_number', as_index=False)
-    .first()
-)
 
-mental_health_df = (
-    mental_health_df
-    .groupby('participant_number', as_index=False)
-    .first()
-)
+def split(df):
+    '''Clean the column names of a raw frame and split it into the (still coded) participant and mental health frames'''
 
+    df = clean_columns(df)
+    df = df.drop(drop_columns, axis=1).rename(columns=rename_columns)
 
-participant_df.to_csv('CSV_files/participant.csv', index=False, encoding='utf-8')
-mental_health_df.to_csv('CSV_files/mental_health.csv', index=False, encoding='utf-8')
+    participant_df = df[participant_info].copy()
+    mental_health_df = clean_psych_columns(df[mental_health_info].copy())
+
+    # Dropping the unnecessary marital status columns and creating a final marital status column
+
+    participant_df = participant_df.drop(['mother_or_partner', 'marital_status', 'marital_status_other'], axis=1)
+    participant_df = participant_df.rename(columns={
+        'marital_status_edit': 'marital_status'
+    })
+
+    return participant_df, mental_health_df
+
+
+def decode(participant_df):
+    '''Decode the coded fields of a split participant frame and convert its HH:MM sleep durations to hours'''
+    participant_df = decode_columns(participant_df)
+    participant_df['infant_nightly_sleep_duration'] = parse_hours(participant_df['infant_nightly_sleep_duration'])
+    return participant_df
+
+
+def transform(df):
+    '''Clean, split and decode a raw frame (or one chunk of it) into the participant and mental health frames'''
+    participant_df, mental_health_df = split(df)
+    return decode(participant_df), mental_health_df
+
+
+def consolidate(df):
+    '''Merge duplicate rows into one row per participant, keeping the first non-null value of each column'''
+    return df.groupby('participant_number', as_index=False).first()
+
+
+def run_etl(raw_path=RAW_PATH):
+    df = pd.read_csv(raw_path, encoding='ISO-8859-1')
+
+    participant_df, mental_health_df = transform(df)
+    write_outputs(consolidate(participant_df), consolidate(mental_health_df))
+
+
+def write_outputs(participant_df, mental_health_df):
+    '''Write the consolidated frames to the CSV outputs and, with their typed schema, to the Parquet outputs'''
+    participant_df.to_csv(PARTICIPANT_PATH, index=False, encoding='utf-8')
+    mental_health_df.to_csv(MENTAL_HEALTH_PATH, index=False, encoding='utf-8')
+
+    apply_schema(participant_df, participant_dtypes).to_parquet(PARTICIPANT_PARQUET, index=False)
+    apply_schema(mental_health_df, mental_health_dtypes).to_parquet(MENTAL_HEALTH_PARQUET, index=False)
+
+
+def csv_to_parquet():
+    '''Rebuild the Parquet outputs from existing participant.csv / mental_health.csv, without the raw export'''
+    apply_schema(pd.read_csv(PARTICIPANT_PATH), participant_dtypes).to_parquet(PARTICIPANT_PARQUET, index=False)
+    apply_schema(pd.read_csv(MENTAL_HEALTH_PATH), mental_health_dtypes).to_parquet(MENTAL_HEALTH_PARQUET, index=False)
+
+
+def run_etl_chunked(raw_path=RAW_PATH, chunksize=100_000):
+    '''Streaming version of run_etl for exports too large to load in one go.
+
+    The raw file is read `chunksize` rows at a time and each chunk goes through the same transform as
+    the full run. Duplicate rows are folded into one row per participant as they arrive, and a participant
+    is appended to the output files as soon as a later participant number shows up, so only the last
+    participant of a chunk is carried over to the next one. This relies on the export being ordered by
+    participant_number (rows of the same participant may still be in any order within a chunk).'''
+
+    paths = [PARTICIPANT_PATH, MENTAL_HEALTH_PATH]
+    dtypes = [participant_dtypes, mental_health_dtypes]
+    schemas = [arrow_schema(d) for d in dtypes]
+    writers = [pq.ParquetWriter(PARTICIPANT_PARQUET, schemas[0]), pq.ParquetWriter(MENTAL_HEALTH_PARQUET, schemas[1])]
+    pending = [None, None]
+    started = [False, False]
+    carried_id = -np.inf
+
+    def write(frame, i):
+        frame.to_csv(paths[i], mode='a' if started[i] else 'w', header=not started[i], index=False, encoding='utf-8')
+        started[i] = True
+        if len(frame):
+            typed = apply_schema(frame, dtypes[i])
+            writers[i].write_table(pa.Table.from_pandas(typed, schema=schemas[i], preserve_index=False))
+
+    try:
+        for chunk in pd.read_csv(raw_path, encoding='ISO-8859-1', chunksize=chunksize):
+            frames = transform(chunk)
+
+            chunk_ids = frames[0]['participant_number'].dropna()
+            if chunk_ids.empty:
+                continue
+            if chunk_ids.min() < carried_id:
+                raise ValueError(
+                    f'Participant {chunk_ids.min()} appears after participant {carried_id}; '
+                    'chunked mode needs the raw export sorted by participant_number'
+                )
+            carried_id = chunk_ids.max()
+
+            for i, frame in enumerate(frames):
+                if pending[i] is not None:
+                    frame = pd.concat([pending[i], frame], ignore_index=True)
+                folded = consolidate(frame)
+                done = folded['participant_number'] < carried_id
+                write(folded[done], i)
+                pending[i] = folded[~done]
+
+        for i in range(2):
+            if pending[i] is not None:
+                write(pending[i], i)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+# Incremental runs: one fingerprint per participant of the raw rows it was built from, so a new export
+# only goes through transform/consolidate for the participants whose rows were added, amended or removed
+
+INDEX_PATH = 'CSV_files/etl_index.parquet'
+output_paths = [PARTICIPANT_PATH, MENTAL_HEALTH_PATH, PARTICIPANT_PARQUET, MENTAL_HEALTH_PARQUET]
+
+
+def participant_fingerprints(raw):
+    '''uint64 hash of each participant's raw rows (values and row order), indexed by participant_number.
+    Integer columns are hashed as floats, so a blank appearing elsewhere in a column changes nothing.'''
+    raw = raw[raw['participant_number'].notna()]
+    raw = raw.astype({c: 'float64' for c in raw.columns if raw[c].dtype.kind in 'iub'})
+    ids = raw['participant_number'].to_numpy(dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    row_hash = pd.util.hash_pandas_object(raw, index=False).to_numpy()[order]
+
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    position = np.arange(len(ids)) - np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+    mixed = pd.util.hash_array(row_hash ^ position.astype(np.uint64))
+    return pd.Series(np.add.reduceat(mixed, starts) if len(ids) else mixed, index=ids[starts], name='fingerprint')
+
+
+def _index_key():
+    '''The ETL code and the state of the outputs an index was written with'''
+    with open(__file__, 'rb') as f:
+        code = hashlib.sha1(f.read()).hexdigest()
+    outputs = {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] if os.path.exists(path) else None
+               for path in output_paths}
+    return json.dumps({'etl': code, 'outputs': outputs}, sort_keys=True)
+
+
+def read_index():
+    '''Fingerprints of the last incremental run, or None when they no longer describe the outputs
+    (missing index or outputs, outputs rewritten by another mode, or ETL.py changed since)'''
+    if not os.path.exists(INDEX_PATH):
+        return None
+    table = pq.read_table(INDEX_PATH)
+    if (table.schema.metadata or {}).get(b'etl_key', b'').decode() != _index_key():
+        return None
+    index = table.to_pandas()
+    return pd.Series(index['fingerprint'].to_numpy(), index=index['participant_number'].to_numpy(), name='fingerprint')
+
+
+def write_index(fingerprints):
+    table = pa.table({'participant_number': fingerprints.index.to_numpy(), 'fingerprint': fingerprints.to_numpy()})
+    pq.write_table(table.replace_schema_metadata({b'etl_key': _index_key().encode()}), INDEX_PATH)
+
+
+def _splice(old, new, replaced):
+    '''`old` without the `replaced` participants, plus the rows of `new`, in participant order'''
+    kept = old[~old['participant_number'].isin(replaced)]
+    return pd.concat([kept, new], ignore_index=True).sort_values('participant_number', kind='stable', ignore_index=True)
+
+
+def _splice_csv(path, new, replaced):
+    '''_splice on a CSV output at the line level: unchanged lines are copied as they are and only the rows
+    of `new` are formatted. participant_number is the first field of every line.'''
+    with open(path, encoding='utf-8', newline='') as f:
+        header, *lines = f.readlines()
+    # IDs may have been written as floats (1.0) when the raw export had blank rows
+    ids = pd.to_numeric(pd.Series([line[:line.index(',')] for line in lines], dtype=object)).to_numpy().astype(np.int64)
+    kept = ~np.isin(ids, np.asarray(replaced, dtype=np.int64))
+
+    new_lines = new.to_csv(index=False, header=False).splitlines(keepends=True) if len(new) else []
+    lines = [line for line, keep in zip(lines, kept) if keep] + new_lines
+    ids = np.concatenate([ids[kept], new['participant_number'].to_numpy(dtype=np.int64)])
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(header)
+        f.writelines(lines[i] for i in np.argsort(ids, kind='stable'))
+
+
+def run_etl_incremental(raw_path=RAW_PATH):
+    '''Update the outputs for the participants whose raw rows changed since the last incremental run.
+
+    The export is read and fingerprinted per participant (see participant_fingerprints). Only new or
+    changed participants are transformed and consolidated, and their rows (and those of participants no
+    longer in the export) are replaced in the existing outputs: unchanged CSV lines are copied as they are
+    and the Parquet tables are read back with their schema, so nothing else is re-decoded or re-formatted. The first run, or any run whose index no longer matches the outputs,
+    does a full rebuild. Returns the numbers of (changed, removed) participants.'''
+    raw = clean_columns(pd.read_csv(raw_path, encoding='ISO-8859-1'))
+    fingerprints = participant_fingerprints(raw)
+    previous = read_index()
+
+    if previous is None:
+        participant_df, mental_health_df = transform(raw)
+        write_outputs(consolidate(participant_df), consolidate(mental_health_df))
+        write_index(fingerprints)
+        return len(fingerprints), 0
+
+    position = previous.index.get_indexer(fingerprints.index)
+    unchanged = (position >= 0) & (previous.to_numpy()[position] == fingerprints.to_numpy())
+    changed = fingerprints.index[~unchanged]
+    removed = previous.index.difference(fingerprints.index)
+    if len(changed) == 0 and len(removed) == 0:
+        return 0, 0
+
+    frames = transform(raw[raw['participant_number'].isin(changed)])
+    frames = [consolidate(frame) for frame in frames]
+    replaced = changed.append(removed)
+
+    csv_paths = [PARTICIPANT_PATH, MENTAL_HEALTH_PATH]
+    parquet_paths = [PARTICIPANT_PARQUET, MENTAL_HEALTH_PARQUET]
+    for frame, csv_path, parquet_path, dtypes in zip(frames, csv_paths, parquet_paths, [participant_dtypes, mental_health_dtypes]):
+        _splice_csv(csv_path, frame, replaced)
+        _splice(pd.read_parquet(parquet_path), apply_schema(frame, dtypes), replaced).to_parquet(parquet_path, index=False)
+
+    write_index(fingerprints)
+    return len(changed), len(removed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean the raw survey export into participant.csv and mental_health.csv')
+    parser.add_argument('--raw', default=RAW_PATH, help='path to the raw survey export')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the raw export in chunks of this many rows instead of loading it whole')
+    parser.add_argument('--from-csv', action='store_true',
+                        help='only rebuild the Parquet files from the existing CSV outputs')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only reprocess participants whose raw rows changed since the last incremental run')
+    args = parser.parse_args()
+
+    if args.from_csv:
+        csv_to_parquet()
+    elif args.incremental:
+        changed, removed = run_etl_incremental(args.raw)
+        print(f'{changed} participants added or changed, {removed} removed')
+    elif args.chunksize:
+        run_etl_chunked(args.raw, chunksize=args.chunksize)
+    else:
+        run_etl(args.raw)
 
 
 
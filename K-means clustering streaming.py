@@ -0,0 +1,66 @@
+import argparse
+import pandas as pd
+import numpy as np
+
+from loader import load_dyads
+from clustering import fit_streaming, assign_chunks, streaming_cluster_summary, frame_chunks, parquet_chunks
+
+# Out-of-core version of 'K-means clustering.py' for cohorts that do not fit in memory.
+# The scaler, mini-batch K-means and incremental PCA are fitted chunk by chunk; labels, PCA coordinates
+# and the cluster summary are then produced per chunk, so the full feature matrix is never built.
+
+parser = argparse.ArgumentParser(description='Streaming sleep–temperament clustering')
+parser.add_argument('--parquet', help='Parquet file holding the feature columns (default: the dyads from loader)')
+parser.add_argument('--chunksize', type=int, default=100000, help='rows per chunk')
+args = parser.parse_args()
+
+# Loading the data
+
+ibq_cols = ['ibq_3', 'ibq_4', 'ibq_9', 'ibq_10', 'ibq_16', 'ibq_17', 'ibq_28', 'ibq_29', 'ibq_32', 'ibq_33']
+feature_cols = ['infant_nightly_sleep_duration', 'infant_wakes_per_night'] + ibq_cols
+
+if args.parquet:
+    chunks = parquet_chunks(args.parquet, feature_cols, args.chunksize)
+else:
+    chunks = frame_chunks(load_dyads(feature_cols), args.chunksize)
+
+# Fitting scaler, mini-batch k-Means and PCA incrementally (k chosen with the elbow/silhouette sweep)
+
+optimal_k = 3
+model = fit_streaming(chunks, feature_cols, optimal_k)
+
+# Labelling, projecting and summarising chunk by chunk
+
+cluster_aggregations = {
+    'infant_nightly_sleep_duration': ['mean', 'std'],
+    'infant_wakes_per_night': ['mean', 'std'],
+    **{col: ['mean'] for col in ibq_cols}
+}
+
+import matplotlib.pyplot as plt
+
+plt.figure(figsize=(8, 6))
+colours = plt.get_cmap('viridis', optimal_k)
+
+def plotted(labelled_chunks):
+    for chunk in labelled_chunks:
+        plt.scatter(chunk['pca1'], chunk['pca2'], c=colours(chunk['cluster'].to_numpy()), alpha=0.7, s=40)
+        yield chunk
+
+cluster_summary = streaming_cluster_summary(plotted(assign_chunks(model, chunks)), cluster_aggregations, optimal_k)
+
+# Visualising the clusters
+
+handles = [plt.Line2D([], [], marker='o', linestyle='', color=colours(k), label=k) for k in range(optimal_k)]
+plt.legend(handles=handles, title='cluster')
+plt.title('Infant Sleep-Temperament Clusters (PCA Projection)')
+plt.xlabel('Principal component 1: Sleep related variance')
+plt.ylabel('Principal component 2: Temperament related variance')
+plt.tight_layout()
+plt.show()
+
+# Cluster summary
+
+pd.set_option('display.max_columns', None)
+print("\nCluster Summary (means ± stds):")
+print(cluster_summary.round(2))
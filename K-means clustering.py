@@ -1,49 +1,31 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
-from sklearn.metrics import silhouette_score
-
-# Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+from loader import load_dyads
+from clustering import kmeans_sweep
 
-# Can we identify distinct infant ‘sleep–temperament profiles’ (e.g., long sleepers with low distress vs short sleepers with high reactivity)?
+# Loading the data
 
 ibq_cols = ['ibq_3', 'ibq_4', 'ibq_9', 'ibq_10', 'ibq_16', 'ibq_17', 'ibq_28', 'ibq_29', 'ibq_32', 'ibq_33']
+dyads = load_dyads(['infant_nightly_sleep_duration', 'infant_wakes_per_night', *ibq_cols])
 
-features = participant_df[['participant_number', 'infant_nightly_sleep_duration', 'infant_wakes_per_night']].merge(
-    mental_health_df[['participant_number', *ibq_cols]],
-    on='participant_number',
-    how='inner'
-)
-
-features = features.dropna(subset=['infant_nightly_sleep_duration', 'infant_wakes_per_night'] + ibq_cols)
-
-for col in ['infant_nightly_sleep_duration', 'infant_wakes_per_night'] + ibq_cols:
-    features[col] = pd.to_numeric(features[col], errors='coerce')
-
-features = features[features['infant_nightly_sleep_duration'] != 100.65]
+# Can we identify distinct infant ‘sleep–temperament profiles’ (e.g., long sleepers with low distress vs short sleepers with high reactivity)?
 
-features = features.dropna()
+features = dyads.dropna().copy()
 
 scaler = StandardScaler()
 X_scaled = scaler.fit_transform(features[['infant_nightly_sleep_duration', 'infant_wakes_per_night'] + ibq_cols])
 
-# k-Means to find sleep–emotion types
+# k-Means to find sleep–emotion types (all k fitted in parallel, the fits are kept for the final model)
 
-inertias, sils = [], []
 K_range = range(2, 6)
+sweep = kmeans_sweep(X_scaled, K_range, seeds=[42], n_init=20)
+inertias, sils = sweep.scores['inertia'].tolist(), sweep.scores['silhouette'].tolist()
 
-for k in K_range:
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=20)
-    kmeans.fit(X_scaled)
-    inertias.append(kmeans.inertia_)
-    sils.append(silhouette_score(X_scaled, kmeans.labels_))
+import matplotlib.pyplot as plt
+import seaborn as sns
 
 fig, ax = plt.subplots(1, 2, figsize=(12, 5))
 ax[0].plot(K_range, inertias, marker='o')
@@ -61,8 +43,8 @@ plt.show()
 # Fitting the final KMeans based on the elbow/silhouette methods
 
 optimal_k = 3
-kmeans = KMeans(n_clusters=optimal_k, random_state=42, n_init=20)
-features['cluster'] = kmeans.fit_predict(X_scaled)
+kmeans = sweep.models[optimal_k]
+features['cluster'] = kmeans.labels_
 
 # Principal component analysis
 
@@ -1,20 +1,21 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
+
+from loader import load_dyads
+import stats_cache
+from bootstrap import epsilon_squared_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+dyads = load_dyads(['infant_wakes_per_night', 'infant_sleeping_method'])
 
 
 # Is there a correlation between infants' number of wakes per night and their method of sleeping?
 
-sleep_df = participant_df[['infant_wakes_per_night', 'infant_sleeping_method']].dropna()
-sleep_df['infant_wakes_per_night'] = pd.to_numeric(sleep_df['infant_wakes_per_night'], errors='coerce')
+sleep_df = dyads[['infant_wakes_per_night', 'infant_sleeping_method']].dropna()
+
+import matplotlib.pyplot as plt
+import seaborn as sns
 
 plt.figure(figsize=(8, 5))
 sns.boxplot(data=sleep_df,
@@ -36,8 +37,7 @@ plt.show()
 
 # Conducting a Kruskal-Wallis test (non-parametric one-way ANOVA)
 
-sleep_df = participant_df[['infant_sleeping_method', 'infant_wakes_per_night']].copy()
-sleep_df['infant_wakes_per_night'] = pd.to_numeric(sleep_df['infant_wakes_per_night'], errors='coerce')
+sleep_df = dyads[['infant_sleeping_method', 'infant_wakes_per_night']].copy()
 
 sleep_order = [
     'Alone in the crib',
@@ -49,21 +49,22 @@ sleep_order = [
 
 sleep_df['infant_sleeping_method'] = pd.Categorical(sleep_df['infant_sleeping_method'], categories=sleep_order, ordered=True)
 
-sleep_groups = [g['infant_wakes_per_night'].values for _, g in sleep_df.groupby('infant_sleeping_method', observed=True)]
-sleep_H, sleep_p_kw = stats.kruskal(*sleep_groups)
+sleep_groups = [g['infant_wakes_per_night'] for _, g in sleep_df.groupby('infant_sleeping_method', observed=True)]
+sleep_H, sleep_p_kw = stats_cache.kruskal(*sleep_groups)
 
 sleep_k = sleep_df['infant_sleeping_method'].nunique()
 sleep_n = len(sleep_df)
 sleep_eps2 = (sleep_H - sleep_k + 1) / (sleep_n - sleep_k)
 
 print(f"Kruskal-Wallis: H={sleep_H:.3f}, p={sleep_p_kw:.4g}, epsilon^2={sleep_eps2:.6f}")
+sleep_eps2_ci = epsilon_squared_ci(sleep_df['infant_wakes_per_night'], sleep_df['infant_sleeping_method'])
+print(f"epsilon^2 95% bootstrap CI: [{sleep_eps2_ci.low:.3f}, {sleep_eps2_ci.high:.3f}]")
 # Rule of thumb: ~0.01 small, ~0.06 medium, ~0.14 large
 
-sleep_posthoc = pg.pairwise_tests(
+sleep_posthoc = stats_cache.pairwise_rank_tests(
     data=sleep_df,
     dv='infant_wakes_per_night',
     between='infant_sleeping_method',
-    parametric=False,
     padjust='holm',
     effsize='hedges'
 )
@@ -1,28 +1,17 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
+
+from loader import load_dyads
+from correlation import spearman_matrix
+from multitest import adjust
+from bootstrap import spearman_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+dyads = load_dyads(['infant_wakes_per_night', 'cbts_total', 'epds_total', 'hads_total'])
 
 # Do mothers whose infants wake more frequently at night report higher CBTS, HADS, or EPDS scores?
 
-cbts_cols = [c for c in mental_health_df.columns if c.startswith('cbts_')]
-epds_cols = [c for c in mental_health_df.columns if c.startswith('epds_')]
-hads_cols = [c for c in mental_health_df.columns if c.startswith('hads_')]
-
-nw_df = participant_df[['participant_number', 'infant_wakes_per_night']].merge(
-    mental_health_df[['participant_number', *cbts_cols, *epds_cols, *hads_cols]],
-    on='participant_number',
-    how='left'
-)
-
-nw_df['cbts_total'] = nw_df[cbts_cols].sum(axis=1, skipna=True)
-nw_df['epds_total'] = nw_df[epds_cols].sum(axis=1, skipna=True)
-nw_df['hads_total'] = nw_df[hads_cols].sum(axis=1, skipna=True)
+nw_df = dyads
 
 # Visualising by nightly wakes
 
@@ -33,6 +22,9 @@ nw_long = nw_df.melt(
     value_name='score'
 )
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 sns.lmplot(
     data=nw_long,
     x='infant_wakes_per_night', y='score',
@@ -52,15 +44,19 @@ plt.show()
 # Conducting a Spearman Correlation Coefficient
 
 scales = ['cbts_total', 'epds_total', 'hads_total']
-for s in scales:
-    valid = nw_df[['infant_wakes_per_night', s]].dropna()
-    rho, p = stats.spearmanr(valid['infant_wakes_per_night'], valid[s])
-    print(f"Spearman: nightly wakes vs {s.upper()} -> ρ={rho:.3f}, p={p:.5f}")
+nw_corr = spearman_matrix(nw_df[['infant_wakes_per_night']], nw_df[scales])
+nw_p_holm = adjust(nw_corr.p.loc['infant_wakes_per_night', scales], 'holm')
+for s, p_holm in zip(scales, nw_p_holm):
+    rho, p = nw_corr.rho.at['infant_wakes_per_night', s], nw_corr.p.at['infant_wakes_per_night', s]
+    print(f"Spearman: nightly wakes vs {s.upper()} -> ρ={rho:.3f}, p={p:.5f}, Holm p={p_holm:.5f}")
+    ci = spearman_ci(nw_df['infant_wakes_per_night'], nw_df[s])
+    print(f"    95% bootstrap CI: [{ci.low:.3f}, {ci.high:.3f}]")
     
 
 '''A Spearman rank correlation showed a small, statistically significant positive relationship 
 between infant nightly wakes and maternal depression (EPDS) scores (ρ = 0.11, p = 0.031). No significant 
 correlations were observed for postpartum trauma (CBTS) or anxiety (HADS) measures. This suggests that while frequent 
 infant waking may contribute modestly to maternal depressive symptoms, its impact on broader mental 
-health appears limited in this sample.'''
+health appears limited in this sample. After Holm correction across the three scales the EPDS association is no longer 
+significant (p = 0.094), so it should be read as exploratory.'''
 
@@ -1,30 +1,24 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
+
+from loader import load_dyads
+from correlation import spearman_matrix
+from multitest import adjust
+from bootstrap import spearman_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+dyads = load_dyads(['cbts_total', 'epds_total', 'ibq_mean'])
 
 # Is there a correlation between mothers with PPD symptoms and distressed/restless infants (high CBTS/EPDS vs high IBQ-R scores)?
 
-cbts_cols = [c for c in mental_health_df.columns if c.startswith('cbts_')]
-epds_cols = [c for c in mental_health_df.columns if c.startswith('epds_')]
-ibq_cols = [c for c in mental_health_df.columns if c.startswith('ibq_')]
-
-mh_df = mental_health_df[['participant_number', *cbts_cols, *epds_cols, *ibq_cols]].copy()
-
-mh_df['cbts_total'] = mh_df[cbts_cols].sum(axis=1, skipna=True)
-mh_df['epds_total'] = mh_df[epds_cols].sum(axis=1, skipna=True)
-mh_df['ibq_mean'] = mh_df[ibq_cols].mean(axis=1, skipna=True)
-mh_df = mh_df.dropna(subset=['cbts_total', 'epds_total', 'ibq_mean'])
+mh_df = dyads.dropna(subset=['cbts_total', 'epds_total', 'ibq_mean'])
 
 # Visualisation
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 fig, axes = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
 
 sns.regplot(data=mh_df, x='cbts_total', y='ibq_mean', ax=axes[0],
@@ -45,11 +39,17 @@ plt.show()
 
 # Statistical analysis using Spearman's rank correlation
 
-rho_cbts, p_cbts = stats.spearmanr(mh_df['cbts_total'], mh_df['ibq_mean'])
-rho_epds, p_epds = stats.spearmanr(mh_df['epds_total'], mh_df['ibq_mean'])
+mh_corr = spearman_matrix(mh_df[['cbts_total', 'epds_total']], mh_df[['ibq_mean']])
+rho_cbts, p_cbts = mh_corr.rho.at['cbts_total', 'ibq_mean'], mh_corr.p.at['cbts_total', 'ibq_mean']
+rho_epds, p_epds = mh_corr.rho.at['epds_total', 'ibq_mean'], mh_corr.p.at['epds_total', 'ibq_mean']
+
+p_holm_cbts, p_holm_epds = adjust([p_cbts, p_epds], 'holm')
 
-print(f"Spearman: CBTS vs IBQ-R mean -> ρ={rho_cbts:.3f}, p={p_cbts:.5f}")
-print(f"Spearman: EPDS vs IBQ-R mean -> ρ={rho_epds:.3f}, p={p_epds:.5f}")
+print(f"Spearman: CBTS vs IBQ-R mean -> ρ={rho_cbts:.3f}, p={p_cbts:.5f}, Holm p={p_holm_cbts:.5f}")
+print(f"Spearman: EPDS vs IBQ-R mean -> ρ={rho_epds:.3f}, p={p_epds:.5f}, Holm p={p_holm_epds:.5f}")
+for s in ['cbts_total', 'epds_total']:
+    ci = spearman_ci(mh_df[s], mh_df['ibq_mean'])
+    print(f"ρ({s.split('_')[0].upper()}, IBQ-R mean) 95% bootstrap CI: [{ci.low:.3f}, {ci.high:.3f}]")
 
 
 '''Spearman rank correlations revealed that higher maternal postpartum trauma and depressive symptoms were associated with greater 
@@ -1,23 +1,23 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
+
+from query import scan
+import stats_cache
+from permutation import kruskal_permutation
+from bootstrap import epsilon_squared_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+age_df = scan(['infant_age_category', 'infant_wakes_per_night'], dropna=True)
 
 
 # Is there a correlation between infants' age group and the number of times they wake up at night?
 
-age_df = participant_df[['infant_age_category', 'infant_wakes_per_night']].dropna()
-age_df['infant_wakes_per_night'] = pd.to_numeric(age_df['infant_wakes_per_night'], errors='coerce')
-
 # Visual exploration
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 plt.figure(figsize=(8, 5))
 sns.barplot(
     data=age_df,
@@ -35,14 +35,18 @@ plt.show()
 
 # Conducting a Kruskal-Wallis test
 
-age_groups = [g['infant_wakes_per_night'].values for _, g in age_df.groupby('infant_age_category', observed=True)]
-age_H, age_p_kw = stats.kruskal(*age_groups)
+age_groups = [g['infant_wakes_per_night'] for _, g in age_df.groupby('infant_age_category', observed=True)]
+age_H, age_p_kw = stats_cache.kruskal(*age_groups)
 
 age_k = len(age_groups)
 age_n = len(age_df)
 age_eps2 = (age_H - age_k +1) / (age_n - age_k)
 
 print(f"Kruskal-Wallis: H={age_H:.3f}, p={age_p_kw:.4g}, epsilon^2={age_eps2:.6f}")
+age_perm = kruskal_permutation(*age_groups)
+print(f"Permutation p={age_perm.pvalue:.4g} ({age_perm.n_permutations} permutations)")
+age_eps2_ci = epsilon_squared_ci(age_df['infant_wakes_per_night'], age_df['infant_age_category'])
+print(f"epsilon^2 95% bootstrap CI: [{age_eps2_ci.low:.3f}, {age_eps2_ci.high:.3f}]")
 
 '''A Kruskal–Wallis test found no significant difference in the number of nightly wakes across infant age groups 
 (H = 0.67, p = 0.716, ε² ≈ 0.00). This suggests that, within the 3–12 month range, age was not significantly related to 
@@ -1,24 +1,26 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
+
+from loader import load_dyads
+import stats_cache
+from bootstrap import epsilon_squared_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+dyads = load_dyads(['infant_nightly_sleep_duration', 'infant_sleeping_method'])
 
 
 # Is there a correlation between an infant's sleep duration and their method of sleeping?
 
-sleepdur_df = participant_df[['infant_nightly_sleep_duration', 'infant_sleeping_method']].copy()
-sleepdur_df = sleepdur_df[sleepdur_df['infant_nightly_sleep_duration'] != 100.65]
+sleepdur_df = dyads[['infant_nightly_sleep_duration', 'infant_sleeping_method']].dropna()
+sleepdur_df['infant_sleeping_method'] = sleepdur_df['infant_sleeping_method'].astype(str)  # alphabetical pairs in the post-hoc table
 
 
 # Visualising
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 plt.figure(figsize=(9, 5))
 sns.violinplot(
     data=sleepdur_df,
@@ -47,18 +49,19 @@ plt.show()
 
 # Kruskal-Wallis test
 
-sleepdur_groups = [g['infant_nightly_sleep_duration'].values for _, g in sleepdur_df.groupby('infant_sleeping_method', observed=True)]
-sleepdur_H, sleepdur_p_kw = stats.kruskal(*sleepdur_groups)
+sleepdur_groups = [g['infant_nightly_sleep_duration'] for _, g in sleepdur_df.groupby('infant_sleeping_method', observed=True)]
+sleepdur_H, sleepdur_p_kw = stats_cache.kruskal(*sleepdur_groups)
 sleepdur_k = len(sleepdur_groups)
 sleepdur_n = len(sleepdur_df)
 sleepdur_eps2 = (sleepdur_H - sleepdur_k + 1) / (sleepdur_n - sleepdur_k)
 print(f"Kruskal-Wallis: H={sleepdur_H:.3f}, p={sleepdur_p_kw:.4g}, epsilon^2={max(sleepdur_eps2, 0):.6f}")
+sleepdur_eps2_ci = epsilon_squared_ci(sleepdur_df['infant_nightly_sleep_duration'], sleepdur_df['infant_sleeping_method'])
+print(f"epsilon^2 95% bootstrap CI: [{sleepdur_eps2_ci.low:.3f}, {sleepdur_eps2_ci.high:.3f}]")
 
-sleepdur_posthoc = pg.pairwise_tests(
+sleepdur_posthoc = stats_cache.pairwise_rank_tests(
     data=sleepdur_df,
     dv='infant_nightly_sleep_duration',
     between='infant_sleeping_method',
-    parametric=False,
     padjust='holm',
     effsize='hedges'
 )
@@ -1,53 +1,36 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
-from scipy import stats
 
-# Loading the data
+from loader import load_dyads
+from correlation import spearman_matrix
+from multitest import adjust
+from bootstrap import spearman_columns_ci
 
-participant_df = pd.read_csv(
-    'CSV_files/participant.csv',
-    usecols=['participant_number', 'infant_gestational_age']
-)
+# Loading the data
 
 ibq_cols = ['ibq_3','ibq_4','ibq_9','ibq_10','ibq_16','ibq_17','ibq_28','ibq_29','ibq_32','ibq_33']
-mental_health_df = pd.read_csv(
-    'CSV_files/mental_health.csv',
-    usecols=['participant_number', *ibq_cols]
-)
+dyads = load_dyads(['infant_gestational_age', *ibq_cols, 'ibq_mean'])
 
 # Is there a correlation between an infant's gestational age at birth and their IBQ-R scores?
 
-ibq_df = participant_df[['participant_number', 'infant_gestational_age']].merge(
-    mental_health_df[['participant_number', *ibq_cols]],
-    on='participant_number', how='inner')
-
-ibq_df['infant_gestational_age'] = pd.to_numeric(ibq_df['infant_gestational_age'], errors='coerce')
-ibq_df[ibq_cols] = ibq_df[ibq_cols].apply(pd.to_numeric, errors='coerce')
-
-ibq_df = ibq_df.dropna(subset=['infant_gestational_age'])
-
-ibq_df['ibq_mean'] = ibq_df[ibq_cols].mean(axis=1)
+ibq_df = dyads.dropna(subset=['infant_gestational_age'])
 
 # Correlation analysis using Spearman's rank correlation
 
-gi_correlations = []
-for col in ibq_cols:
-    x = ibq_df['infant_gestational_age']
-    y = ibq_df[col]
-
-    # Drop any pairwise NaNs before correlation
-    valid = (~x.isna()) & (~y.isna())
-    if valid.sum() > 1:   # need at least 2 valid pairs
-        gi_rho, gi_p = stats.spearmanr(x[valid], y[valid])
-    else:
-        gi_rho, gi_p = (np.nan, np.nan)
-
-    gi_correlations.append({'item': col, 'rho': gi_rho, 'p': gi_p})
-
-gi_corr_df = pd.DataFrame(gi_correlations)
-gi_corr_df['significant'] = gi_corr_df['p'] < 0.05
+# All items in one call; pairwise NaNs are dropped per item
+gi_corr = spearman_matrix(ibq_df[['infant_gestational_age']], ibq_df[ibq_cols])
+
+gi_corr_df = pd.DataFrame({
+    'item': ibq_cols,
+    'rho': gi_corr.rho.loc['infant_gestational_age'].values,
+    'p': gi_corr.p.loc['infant_gestational_age'].values
+})
+# Holm correction across the ten items
+gi_corr_df['p_holm'] = adjust(gi_corr_df['p'], 'holm')
+gi_corr_df['significant'] = gi_corr_df['p_holm'] < 0.05
+gi_ci = spearman_columns_ci(ibq_df['infant_gestational_age'], ibq_df[ibq_cols])
+gi_corr_df['ci_low'] = gi_ci.low
+gi_corr_df['ci_high'] = gi_ci.high
 print(gi_corr_df.sort_values('rho'))
 
 
@@ -60,6 +43,9 @@ at 3–12 months in this sample.'''
 print(gi_corr_df.set_index('item')[['rho']].T)
 
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 plt.figure(figsize=(6, 1.5))
 sns.heatmap(
     gi_corr_df.set_index('item')[['rho']].T,  # <-- fixed
@@ -1,25 +1,25 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
-from scipy.stats import chi2_contingency
+
+from query import scan
+import stats_cache
+from permutation import chi2_permutation
+from bootstrap import cramers_v_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+edusleep_df = scan(['education', 'infant_sleeping_method'], dropna=True)
 
 
 # Is there a relationship between mothers' education level and the method they use to put their babies to sleep?
 
-edusleep_df = participant_df[['education', 'infant_sleeping_method']].dropna()
-
 # Visualising with a 100% stacked horizontal bar chart
 
-grouped = edusleep_df.groupby('education')['infant_sleeping_method'].value_counts(normalize=True).unstack('infant_sleeping_method')
+grouped = edusleep_df.groupby('education', observed=True)['infant_sleeping_method'].value_counts(normalize=True).unstack('infant_sleeping_method')
+
+import matplotlib.pyplot as plt
+from matplotlib import cm
+import seaborn as sns
 
 fig, ax = plt.subplots(1, 1, figsize=[12, 6])
 grouped.plot.barh(stacked=True, cmap=cm.get_cmap('viridis'), ax=ax)
@@ -41,15 +41,20 @@ plt.show()
 
 contingency = pd.crosstab(edusleep_df['education'], edusleep_df['infant_sleeping_method'])
 
-chi2, p, dof, expected = chi2_contingency(contingency)
+chi2, p, dof, expected = stats_cache.chi2_contingency(contingency)
 
 print(f"Chi-square test: χ²={chi2:.3f}, df={dof}, p={p:.4g}")
+# several expected counts are below 5, so also test against the permutation distribution
+chi2_perm = chi2_permutation(contingency)
+print(f"Permutation p={chi2_perm.pvalue:.4g} ({chi2_perm.n_permutations} permutations)")
 
 # Cramer's V
 
 n = contingency.to_numpy().sum()
 cramers_v = np.sqrt(chi2 / (n * (min(contingency.shape)-1)))
 print(f"Cramer's V = {cramers_v:.3f}")
+cramers_v_boot = cramers_v_ci(edusleep_df['education'], edusleep_df['infant_sleeping_method'])
+print(f"Cramer's V 95% bootstrap CI: [{cramers_v_boot.low:.3f}, {cramers_v_boot.high:.3f}]")
 
 '''A chi-square test of independence found no significant relationship between mothers’ education level and the method they use 
 to put their babies to sleep, χ²(16) = 14.40, p = .57. The effect size (Cramér’s V = 0.09) indicates only a weak association, 
@@ -1,20 +1,18 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
+
+from query import scan
+import stats_cache
+from permutation import mannwhitneyu_permutation
+from bootstrap import mwu_r_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+ss_df = scan(['infant_sex', 'infant_nightly_sleep_duration'], dropna=True)
 
 
 # Is there a correlation between babies' sex and their sleep durations?
 
-ss_df = participant_df[['infant_sex', 'infant_nightly_sleep_duration']].dropna()
-ss_df = ss_df[ss_df['infant_nightly_sleep_duration'] != 100.65]
-
 female_summary = ss_df[ss_df['infant_sex'] == 'Female'].describe()
 #print(female_summary)
 
@@ -24,6 +22,9 @@ male_summary = ss_df[ss_df['infant_sex'] == 'Male'].describe()
 
 # Visualisation with a box plot
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 plt.figure(figsize=(6, 8))
 sns.boxplot(data=ss_df, x='infant_sex', y='infant_nightly_sleep_duration', palette='mako')
 sns.stripplot(data=ss_df, x='infant_sex', y='infant_nightly_sleep_duration', color='black', alpha=0.5, size=2)
@@ -35,13 +36,19 @@ plt.show()
 
 # Mann-Whitney U test
 
+from scipy import stats
+
 female = ss_df.loc[ss_df['infant_sex'] == 'Female', 'infant_nightly_sleep_duration']
 male = ss_df.loc[ss_df['infant_sex'] == 'Male', 'infant_nightly_sleep_duration']
 
-U, p = stats.mannwhitneyu(female, male, alternative='two-sided')
+U, p = stats_cache.mannwhitneyu(female, male, alternative='two-sided')
 r = abs(stats.norm.ppf(p/2)) / (len(ss_df)**0.5)
 
 print(f"Mann-Whitney U: U={U:.2f}, p={p:.5f}, r={r:.3f}")
+perm = mannwhitneyu_permutation(female, male)
+print(f"Permutation p={perm.pvalue:.4g} ({perm.n_permutations} permutations)")
+r_ci = mwu_r_ci(female, male)
+print(f"r 95% bootstrap CI: [{r_ci.low:.3f}, {r_ci.high:.3f}]")
 
 '''A Mann-Whitney U test comparing infants' sexes and their nightly sleep durations found that biological sex is not a counfounding factor on 
 how long babies sleep at night. Both males and females sleep roughly similar durations.'''
@@ -1,53 +1,48 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pingouin as pg
-from scipy import stats
+
+from loader import load_dyads
+from correlation import spearman_matrix
+from multitest import adjust
+from bootstrap import spearman_columns_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+ibq_cols = ['ibq_3','ibq_4','ibq_9','ibq_10','ibq_16','ibq_17','ibq_28','ibq_29','ibq_32','ibq_33']
+dyads = load_dyads(['infant_wakes_per_night', *ibq_cols, 'ibq_mean'])
 
 
 # Is there a correlation between babies' sleep fragmentation (nightly wakes) and poorer scores on their IBQ-R results?
 
-ibq_cols = ['ibq_3','ibq_4','ibq_9','ibq_10','ibq_16','ibq_17','ibq_28','ibq_29','ibq_32','ibq_33']
-
-ibq_df = participant_df[['participant_number', 'infant_wakes_per_night']].merge(
-    mental_health_df[['participant_number', *ibq_cols]],
-    on='participant_number', how='inner')
+ibq_df = dyads
 
 # Using Spearman's rank correlation
 
-correlations = []
-
-for col in ibq_cols:
-    x = ibq_df['infant_wakes_per_night']
-    y = ibq_df[col]
-
-    valid = (~x.isna()) & (~y.isna())
-    if valid.sum() > 1:
-        rho, p = stats.spearmanr(x[valid], y[valid])
-    else:
-        rho, p = (np.nan, np.nan)
-    
-    correlations.append({'item': col, 'rho': rho, 'p': p})
+correlations = spearman_matrix(ibq_df[['infant_wakes_per_night']], ibq_df[ibq_cols])
 
-corr_df = pd.DataFrame(correlations)
-corr_df['significant'] = corr_df['p'] < 0.05
-print(corr_df.sort_values('rho'))
+corr_df = pd.DataFrame({
+    'item': ibq_cols,
+    'rho': correlations.rho.loc['infant_wakes_per_night'].values,
+    'p': correlations.p.loc['infant_wakes_per_night'].values
+})
+# Holm correction across the ten items
+corr_df['p_holm'] = adjust(corr_df['p'], 'holm')
+corr_df['significant'] = corr_df['p_holm'] < 0.05
+corr_ci = spearman_columns_ci(ibq_df['infant_wakes_per_night'], ibq_df[ibq_cols])
+corr_df['ci_low'] = corr_ci.low
+corr_df['ci_high'] = corr_ci.high
+print(corr_df.sort_values('rho').to_string())
 
 
 '''A Spearman’s rank correlation analysis found significant positive associations between the number of infant nightly 
-awakenings and several IBQ-R items related to distress and emotional reactivity (ρ = 0.18–0.35, all p < .05). Infants who woke 
+awakenings and several IBQ-R items related to distress and emotional reactivity (ρ = 0.18–0.35, all Holm-adjusted p < .05). Infants who woke 
 more frequently at night tended to show higher levels of crying, anger, and clinginess, suggesting that poorer sleep continuity 
 may be associated with greater negative affectivity in infancy.'''
 
 # Visualisation
 
-ibq_df['ibq_mean'] = ibq_df[ibq_cols].mean(axis=1)
+import matplotlib.pyplot as plt
+import seaborn as sns
 
 plt.figure(figsize=(8, 5))
 sns.regplot(
@@ -1,27 +1,18 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
+
+from loader import load_dyads
+from correlation import spearman_matrix
+from multitest import adjust
+from bootstrap import spearman_ci
 
 # Loading the data
 
-participant_df = pd.read_csv('CSV_files/participant.csv')
-mental_health_df = pd.read_csv('CSV_files/mental_health.csv')
+dyads = load_dyads(['age', 'cbts_total', 'epds_total'])
 
 
 # Are younger mothers more likely to experience postpartum trauma or depression (higher CBTS & EPDS scores)?
 
-cbts_cols = [c for c in mental_health_df.columns if c.startswith('cbts_')]
-epds_cols = [c for c in mental_health_df.columns if c.startswith('epds_')]
-
-agepp_df = participant_df[['participant_number', 'age']].merge(
-    mental_health_df[['participant_number', *cbts_cols, *epds_cols]],
-    on='participant_number',
-    how='left'
-)
-
-agepp_df['cbts_total'] = agepp_df[cbts_cols].sum(axis=1, skipna=True)
-agepp_df['epds_total'] = agepp_df[epds_cols].sum(axis=1, skipna=True)
+agepp_df = dyads.dropna()
 
 
 # Visualising by age
@@ -33,6 +24,9 @@ agepp_long = agepp_df.melt(
     value_name='score'
 )
 
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 sns.lmplot(
     data=agepp_long,
     x='age', y='score', hue='scale',
@@ -48,11 +42,17 @@ plt.show()
 
 # Statistical analysis using Spearman's rank correlation
 
-rho_cbts, p_cbts = stats.spearmanr(agepp_df['age'], agepp_df['cbts_total'])
-rho_epds, p_epds = stats.spearmanr(agepp_df['age'], agepp_df['epds_total'])
+agepp_corr = spearman_matrix(agepp_df[['age']], agepp_df[['cbts_total', 'epds_total']])
+rho_cbts, p_cbts = agepp_corr.rho.at['age', 'cbts_total'], agepp_corr.p.at['age', 'cbts_total']
+rho_epds, p_epds = agepp_corr.rho.at['age', 'epds_total'], agepp_corr.p.at['age', 'epds_total']
+
+p_holm_cbts, p_holm_epds = adjust([p_cbts, p_epds], 'holm')
 
-print(f"Spearman: age vs CBTS -> ρ={rho_cbts:.3f}, p={p_cbts:.4g}")
-print(f"Spearman: age vs EPDS -> ρ={rho_epds:.3f}, p={p_epds:.4g}")
+print(f"Spearman: age vs CBTS -> ρ={rho_cbts:.3f}, p={p_cbts:.4g}, Holm p={p_holm_cbts:.4g}")
+print(f"Spearman: age vs EPDS -> ρ={rho_epds:.3f}, p={p_epds:.4g}, Holm p={p_holm_epds:.4g}")
+for s in ['cbts_total', 'epds_total']:
+    ci = spearman_ci(agepp_df['age'], agepp_df[s])
+    print(f"ρ(age, {s.split('_')[0].upper()}) 95% bootstrap CI: [{ci.low:.3f}, {ci.high:.3f}]")
 
 
 '''Both correlation coefficients are negative and small, meaning older mothers show slightly lower trauma 
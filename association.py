@@ -0,0 +1,135 @@
+from itertools import combinations
+import pandas as pd
+import numpy as np
+
+from multitest import adjust
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Chi-square / Cramer's V screen over every pair of categorical fields (Q6 generalised).
+# Each column is integer-coded once; every pair's contingency table (per cohort, when `by` is given)
+# is then one slice of a single bincount over combined (cohort, pair, row code, column code) keys, and
+# chi-square, dof, p, V and the FDR q-values are computed for all tables together.
+
+categorical_fields = ['marital_status', 'education', 'pregnancy_type', 'infant_sex', 'infant_age_category', 'infant_sleeping_method']
+
+
+def binned(values, bins=3, labels=None):
+    '''Scale score as an ordered categorical: quantile bins (bins=int) or explicit edges (bins=list)'''
+    if isinstance(bins, int):
+        if labels is None and bins == 3:
+            labels = ['low', 'mid', 'high']
+        return pd.qcut(values, bins, labels=labels)
+    return pd.cut(values, bins, labels=labels, include_lowest=True)
+
+
+def encode(df, columns):
+    '''(n x m) int64 codes (-1 = missing) and the level labels of each column'''
+    codes = np.empty((len(df), len(columns)), dtype=np.int64)
+    levels = []
+    for j, col in enumerate(columns):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories()
+            codes[:, j], labels = values.cat.codes.to_numpy(), list(values.cat.categories)
+        else:
+            codes[:, j], labels = pd.factorize(values, sort=True)
+            labels = list(labels)
+        levels.append(labels)
+    return codes, levels
+
+
+def contingency_tables(codes, pairs, width, groups=None, n_groups=1, chunksize=1_000_000):
+    '''All pairwise tables at once: (n_groups, n_pairs, width, width) counts from a single bincount per row chunk.
+    Rows missing either field of a pair (or their group) are left out of that pair's table.'''
+    i, j = np.array(pairs).T
+    cells = n_groups * len(pairs) * width * width
+    counts = np.zeros(cells, dtype=np.int64)
+    pair_offset = np.arange(len(pairs)) * width * width
+    for lo in range(0, len(codes), chunksize):
+        block = codes[lo:lo + chunksize]
+        a, b = block[:, i], block[:, j]
+        g = np.zeros(len(block), dtype=np.int64) if groups is None else groups[lo:lo + chunksize]
+        keys = (g[:, None] * len(pairs) * width * width) + pair_offset + a * width + b
+        valid = (a >= 0) & (b >= 0) & (g[:, None] >= 0)
+        counts += np.bincount(keys[valid], minlength=cells)
+    return counts.reshape(n_groups, len(pairs), width, width)
+
+
+def chi2_tables(tables, correction=True):
+    '''chi-square, dof, p, Cramer's V and n for a stack of tables (..., r, c), like scipy.stats.chi2_contingency.
+    Empty rows/columns are ignored; Yates' correction is applied to tables with one degree of freedom.'''
+    observed = tables.astype(np.float64)
+    rows, cols = observed.sum(axis=-1), observed.sum(axis=-2)
+    n = rows.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = rows[..., :, None] * cols[..., None, :] / n[..., None, None]
+    r, c = (rows > 0).sum(axis=-1), (cols > 0).sum(axis=-1)
+    dof = np.maximum(r - 1, 0) * np.maximum(c - 1, 0)
+
+    diff = np.abs(observed - expected)
+    if correction:
+        yates = (dof == 1)[..., None, None]
+        diff = np.where(yates, np.maximum(diff - 0.5, 0), diff)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(expected > 0, diff ** 2 / expected, 0).sum(axis=(-2, -1))
+        p = np.where(dof > 0, stats.chi2.sf(chi2, np.maximum(dof, 1)), np.nan)
+        v = np.sqrt(chi2 / (n * (np.minimum(r, c) - 1)))
+    return chi2, dof, p, np.where(dof > 0, v, np.nan), n
+
+
+def association_scan(df, columns=None, by=None, correction=True, chunksize=1_000_000):
+    '''Chi-square test of independence for every pair of `columns` (default: categorical_fields).
+
+    With `by`, the scan runs separately within each of its values (e.g. cohort or site) and q-values
+    (Benjamini-Hochberg) are computed within each of them. Returns one row per (by, x, y) with n,
+    chi2, dof, p, cramers_v and q.'''
+    columns = list(columns or categorical_fields)
+    codes, levels = encode(df, columns)
+    width = max(len(labels) for labels in levels) or 1
+    pairs = list(combinations(range(len(columns)), 2))
+
+    if by is None:
+        groups, group_labels = None, [None]
+    else:
+        groups, group_labels = pd.factorize(df[by], sort=True)
+    tables = contingency_tables(codes, pairs, width, groups, len(group_labels), chunksize)
+    chi2, dof, p, v, n = chi2_tables(tables, correction)
+
+    frames = []
+    for g, label in enumerate(group_labels):
+        frame = pd.DataFrame({
+            'x': [columns[i] for i, _ in pairs],
+            'y': [columns[j] for _, j in pairs],
+            'n': n[g].astype(np.int64),
+            'chi2': chi2[g],
+            'dof': dof[g],
+            'p': p[g],
+            'cramers_v': v[g],
+            'q': adjust(p[g], 'fdr_bh')
+        })
+        if by is not None:
+            frame.insert(0, by, label)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+    from loader import load_dyads
+
+    parser = argparse.ArgumentParser(description="Chi-square / Cramer's V scan over all pairs of categorical fields")
+    parser.add_argument('--scores', nargs='*', default=['cbts_total', 'epds_total', 'hads_total', 'ibq_mean'],
+                        help='scale scores to include as low/mid/high tertiles')
+    parser.add_argument('--by', help='column to scan within (e.g. a cohort or site field)')
+    args = parser.parse_args()
+
+    dyads = load_dyads([*categorical_fields, *args.scores, *([args.by] if args.by else [])])
+    for score in args.scores:
+        dyads[f'{score}_bin'] = binned(dyads[score])
+    scan = association_scan(dyads, categorical_fields + [f'{s}_bin' for s in args.scores], by=args.by)
+
+    pd.set_option('display.width', 200)
+    print(scan.sort_values('p').round(4).to_string(index=False))
@@ -0,0 +1,251 @@
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+import numpy as np
+from scipy import stats
+from sklearn.preprocessing import StandardScaler
+
+import ETL
+import loader
+import scoring
+from correlation import spearman_matrix
+from posthoc import pairwise_rank_tests
+from association import association_scan
+from bootstrap import spearman_ci
+from permutation import kruskal_permutation
+from clustering import kmeans_sweep
+from benchmarks.synthetic import write_raw_export
+
+
+# Time and memory of every pipeline stage on synthetic exports of growing size
+# Run from the project root: python -m benchmarks.pipeline --sizes 100000 1000000 10000000
+#
+# Each size runs in a scratch directory: a synthetic raw export is written, then read, cleaned, decoded,
+# deduplicated and written out by the ETL steps, loaded and scored, and put through each test the question
+# scripts run, the clustering sweep and the figure rendering. Wall time is the best of `repeat` runs; the
+# memory peak comes from one more run under tracemalloc (allocations made during the stage, which numpy
+# and pandas report). One JSON line per (size, stage) is appended to the output file together with the
+# commit and library versions, so runs can be compared over time.
+
+RESULTS_PATH = 'benchmarks/pipeline_results.jsonl'
+
+ibq_cols = ['ibq_3', 'ibq_4', 'ibq_9', 'ibq_10', 'ibq_16', 'ibq_17', 'ibq_28', 'ibq_29', 'ibq_32', 'ibq_33']
+cluster_cols = ['infant_nightly_sleep_duration', 'infant_wakes_per_night', *ibq_cols]
+
+
+def measure(func, *args, repeat=1, memory=True):
+    '''(best wall time in seconds, peak traced MB or None, result) of func(*args)'''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return best, peak, result
+
+
+# ETL and loading stages
+
+def load(raw_path):
+    return pd.read_csv(raw_path, encoding='ISO-8859-1')
+
+
+def clean(raw):
+    return ETL.split(raw.copy(deep=False))
+
+
+def dedupe(participant_df, mental_health_df):
+    return ETL.consolidate(participant_df), ETL.consolidate(mental_health_df)
+
+
+def write(participant_df, mental_health_df):
+    ETL.apply_schema(participant_df, ETL.participant_dtypes).to_parquet(ETL.PARTICIPANT_PARQUET, index=False)
+    ETL.apply_schema(mental_health_df, ETL.mental_health_dtypes).to_parquet(ETL.MENTAL_HEALTH_PARQUET, index=False)
+
+
+def merge():
+    loader._cache.clear()
+    return loader.load_dyads()
+
+
+def score(dyads):
+    return pd.concat([dyads, scoring.score_items(dyads)], axis=1)
+
+
+# The tests of the question scripts, on the scored dyads
+
+def kruskal(dyads):
+    df = dyads[['infant_wakes_per_night', 'infant_sleeping_method']].dropna()
+    return stats.kruskal(*[g.to_numpy() for _, g in df.groupby('infant_sleeping_method', observed=True)['infant_wakes_per_night']])
+
+
+def mannwhitneyu(dyads):
+    df = dyads[['infant_sex', 'infant_nightly_sleep_duration']].dropna()
+    female = df.loc[df['infant_sex'] == 'Female', 'infant_nightly_sleep_duration']
+    male = df.loc[df['infant_sex'] == 'Male', 'infant_nightly_sleep_duration']
+    return stats.mannwhitneyu(female, male, alternative='two-sided')
+
+
+def chi2_contingency(dyads):
+    return stats.chi2_contingency(pd.crosstab(dyads['education'], dyads['infant_sleeping_method']))
+
+
+def spearman(dyads):
+    return spearman_matrix(dyads[['infant_wakes_per_night', 'epds_total', 'cbts_total']], dyads[[*ibq_cols, 'ibq_mean']])
+
+
+def posthoc(dyads):
+    return pairwise_rank_tests(dyads, 'infant_wakes_per_night', 'infant_sleeping_method')
+
+
+def association(dyads):
+    return association_scan(dyads)
+
+
+def bootstrap(sample, n_boot):
+    return spearman_ci(sample['infant_wakes_per_night'], sample['ibq_mean'], n_boot=n_boot)
+
+
+def permutation(sample):
+    df = sample[['infant_wakes_per_night', 'infant_age_category']].dropna()
+    groups = [g.to_numpy() for _, g in df.groupby('infant_age_category', observed=True)['infant_wakes_per_night']]
+    return kruskal_permutation(*groups)
+
+
+def clustering(dyads, n_init):
+    features = dyads[cluster_cols].dropna()
+    X = StandardScaler().fit_transform(features)
+    return kmeans_sweep(X, range(2, 6), seeds=[42], n_init=n_init)
+
+
+def render(dyads):
+    '''The Q1 box/strip plot and the Q8 regression plot, drawn headless to an in-memory PNG'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sleep_df = dyads[['infant_wakes_per_night', 'infant_sleeping_method']].dropna()
+    fig, ax = plt.subplots(1, 2, figsize=(14, 5))
+    sns.boxplot(data=sleep_df, x='infant_sleeping_method', y='infant_wakes_per_night', ax=ax[0])
+    sns.stripplot(data=sleep_df, x='infant_sleeping_method', y='infant_wakes_per_night', color='black', size=3, alpha=0.5, ax=ax[0])
+    sns.regplot(data=dyads, x='infant_wakes_per_night', y='ibq_mean', scatter_kws={'alpha': 0.6, 's': 40}, ax=ax[1])
+    fig.savefig(io.BytesIO(), format='png', dpi=100)
+    plt.close(fig)
+
+
+def run_size(n, repeat=1, memory=True, resample_rows=10_000, n_boot=1000, n_init=20, seed=0):
+    '''Run every stage on a synthetic export of `n` participants, in the current directory. Returns one dict per stage.'''
+    os.makedirs('CSV_files', exist_ok=True)
+    raw_path = 'synthetic_export.csv'
+    records = []
+
+    def stage(name, rows, func, *args):
+        seconds, peak, result = measure(func, *args, repeat=repeat, memory=memory)
+        records.append({'stage': name, 'rows': int(rows), 'seconds': seconds, 'peak_mb': peak})
+        print(f'{n:>10,} {name:<18} {seconds:>9.3f} s' + (f' {peak:>9.1f} MB' if peak is not None else ''))
+        return result
+
+    raw_rows = stage('generate', n, write_raw_export, raw_path, n, seed)
+    raw = stage('load', raw_rows, load, raw_path)
+    participant_df, mental_health_df = stage('clean', raw_rows, clean, raw)
+    participant_df = stage('decode', raw_rows, ETL.decode, participant_df)
+    participant_df, mental_health_df = stage('dedupe', raw_rows, dedupe, participant_df, mental_health_df)
+    del raw
+    stage('write', n, write, participant_df, mental_health_df)
+    dyads = stage('merge', n, merge)
+    dyads = stage('scoring', n, score, dyads)
+
+    for name, func in [('kruskal', kruskal), ('mannwhitneyu', mannwhitneyu), ('chi2_contingency', chi2_contingency),
+                       ('spearman', spearman), ('posthoc', posthoc), ('association_scan', association)]:
+        stage(name, n, func, dyads)
+
+    # resampling tests run on a fixed-size sample, whatever the cohort size
+    sample = dyads.sample(min(resample_rows, n), random_state=seed)
+    stage('bootstrap', len(sample), bootstrap, sample, n_boot)
+    stage('permutation', len(sample), permutation, sample)
+
+    stage('clustering', n, clustering, dyads, n_init)
+    stage('rendering', n, render, dyads)
+
+    for record in records:
+        record['participants'] = n
+        record['raw_rows'] = int(raw_rows)
+    return records
+
+
+def environment():
+    '''Commit, versions and machine of this run, stored with every record'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import sklearn
+    import scipy
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+
+def run(sizes, output=RESULTS_PATH, workdir=None, **kwargs):
+    '''Benchmark every size in a scratch directory and append the records to `output` (JSON lines)'''
+    env = environment()
+    output = os.path.abspath(output)
+    cwd = os.getcwd()
+    rows = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory(dir=workdir) as scratch:
+            os.chdir(scratch)
+            try:
+                records = run_size(n, **kwargs)
+            finally:
+                os.chdir(cwd)
+        with open(output, 'a') as f:
+            for record in records:
+                f.write(json.dumps({**env, **record}) + '\n')
+        rows += records
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and memory-profile every pipeline stage on synthetic cohorts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**5, 10**6, 10**7], help='participants per run')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run of each stage')
+    parser.add_argument('--resample-rows', type=int, default=10_000, help='sample size for the bootstrap and permutation stages')
+    parser.add_argument('--n-boot', type=int, default=1000)
+    parser.add_argument('--n-init', type=int, default=20, help='KMeans restarts per k in the clustering stage')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--workdir', default=None, help='where to create the scratch directories (default: system temp)')
+    args = parser.parse_args()
+
+    results = run(args.sizes, output=args.output, workdir=args.workdir, repeat=args.repeat, memory=not args.no_memory,
+                  resample_rows=args.resample_rows, n_boot=args.n_boot, n_init=args.n_init)
+    pd.set_option('display.width', 200)
+    print(results.pivot(index='stage', columns='participants', values='seconds').loc[results['stage'].unique()].round(3).to_string())
@@ -0,0 +1,160 @@
+import argparse
+import pandas as pd
+import numpy as np
+
+
+# Synthetic raw survey exports with the column layout, coding and quirks of the real one, for running
+# the ETL and the analyses at sizes the real cohort does not reach.
+# Run from the project root: python -m benchmarks.synthetic --participants 1000000 --out raw.csv
+#
+# Each participant gets one mother row. Part of them also get a partner row (Type_parents = 2) that only
+# repeats the infant fields, and a few mother rows are submitted twice; all rows of a participant are
+# adjacent but in random order, so the export is sorted by participant number as the chunked ETL needs.
+# Categoricals are the numeric codes of ETL.decode_maps, sleep durations are HH:MM strings ('99:99' for
+# "don't know", blank when skipped) and the Likert items have item-level missingness. Marginal frequencies
+# follow the real cohort, and a few effects are built in (sleeping method -> wakes and duration, maternal
+# distress and nightly wakes -> infant reactivity) so the tests have something to find.
+
+cbts_columns = [f'CBTS_M_{i}' for i in range(3, 13)] + [f'CBTS_{i}' for i in range(13, 23)]
+epds_columns = [f'EPDS_{i}' for i in range(1, 11)]
+hads_columns = [f'HADS_{i}' for i in range(1, 14, 2)]
+ibq_columns = [f'IBQ_R_VSF_{i}_bb1' for i in (3, 4, 9, 10, 16, 17, 28, 29, 32, 33)]
+
+raw_columns = ['Participant_number', 'Type_parents', 'Birth_1mth_M_inclusion', 'Birth_12mth_M_inclusion', 'Age',
+               'Marital_status', 'Marital_status_Autre', 'Marital_status_edit', 'Education', 'Gestationnal_age',
+               'Type_pregnancy', 'sex_baby1', *cbts_columns, *epds_columns, *hads_columns, 'Child_survey_participation',
+               'Age_bb', *ibq_columns, 'Sleep_night_duration_bb1', 'night_awakening_number_bb1', 'how_falling_asleep_bb1']
+
+# Columns a partner row repeats from the mother row; everything else is left blank
+infant_columns = ['Age_bb', 'sex_baby1', 'Sleep_night_duration_bb1', 'night_awakening_number_bb1', 'how_falling_asleep_bb1']
+
+# Code frequencies of the real cohort, in the order of the ETL.decode_* tables
+code_frequencies = {
+    'Marital_status_edit': [0.034, 0.949, 0.017],
+    'Education': [0.005, 0.061, 0.251, 0.215, 0.468],
+    'Type_pregnancy': [0.988, 0.012],
+    'sex_baby1': [0.517, 0.483],
+    'Age_bb': [0.359, 0.324, 0.317],
+    'how_falling_asleep_bb1': [0.22, 0.18, 0.054, 0.432, 0.114]
+}
+
+# Free-text answers behind the "other" marital status code (4), recoded by hand in Marital_status_edit
+other_marital_status = ['Pacsée', 'Fiancée', 'Mariée religieusement', 'Séparée']
+
+# (item columns, lowest code, highest code, mean item score) per scale
+likert_scales = {
+    'cbts': (cbts_columns, 0, 3, 0.6),
+    'epds': (epds_columns, 0, 3, 0.9),
+    'hads': (hads_columns, 0, 3, 1.1),
+    'ibq': (ibq_columns, 1, 7, 3.5)
+}
+
+# Mean nightly wakes and sleep hours per how_falling_asleep_bb1 code (fed, rocked, held, alone, parent present)
+method_wakes = np.array([2.0, 1.8, 2.2, 0.9, 1.5])
+method_hours = np.array([10.0, 10.1, 9.8, 10.9, 10.3])
+
+# HH:MM strings on a quarter-hour grid, indexed by the number of quarter hours
+quarter_hours = np.array([f'{q // 4}:{q % 4 * 15:02d}' for q in range(4 * 16 + 1)], dtype=object)
+
+
+def _codes(rng, frequencies, n):
+    p = np.asarray(frequencies, dtype=np.float64)
+    return rng.choice(len(p), size=n, p=p / p.sum()) + 1
+
+
+def _likert(rng, latent, items, low, high, mean, missing_rate):
+    '''(n x items) Likert codes driven by a shared latent score, NaN at random with missing_rate'''
+    noise = rng.normal(size=(len(latent), items))
+    spread = (high - low) / 3
+    values = np.clip(np.rint(mean + spread * (0.6 * latent[:, None] + 0.8 * noise)), low, high)
+    values[rng.random(values.shape) < missing_rate] = np.nan
+    return values
+
+
+def make_participants(n, rng, start=1, missing_rate=0.03):
+    '''One mother row per participant, numbered from `start`, as a frame with the raw export's columns'''
+    df = {'Participant_number': np.arange(start, start + n), 'Type_parents': np.ones(n, dtype=np.int64)}
+    df['Birth_1mth_M_inclusion'] = np.ones(n, dtype=np.int64)
+    df['Birth_12mth_M_inclusion'] = np.ones(n, dtype=np.int64)
+    df['Age'] = np.clip(np.rint(rng.normal(30.2, 4.4, n)), 18, 48)
+
+    for col, frequencies in code_frequencies.items():
+        df[col] = _codes(rng, frequencies, n)
+    marital = df['Marital_status_edit'].astype(np.float64)
+    other = rng.random(n) < 0.01
+    marital[other] = 4
+    df['Marital_status'] = marital
+    df['Marital_status_Autre'] = np.where(other, rng.choice(np.array(other_marital_status, dtype=object), n), None)
+    df['Gestationnal_age'] = np.round(np.clip(rng.normal(39.1, 1.9, n), 26, 43), 1)
+
+    method = df['how_falling_asleep_bb1'] - 1
+    wakes = np.minimum(rng.poisson(method_wakes[method]), 10)
+    hours = np.clip(rng.normal(method_hours[method] - 0.2 * (wakes - 1.4), 1.2), 4, 16)
+    durations = quarter_hours[np.rint(hours * 2).astype(np.int64) * 2]
+    durations[rng.random(n) < 0.003] = '99:99'
+    durations[rng.random(n) < 0.01] = None
+    df['Sleep_night_duration_bb1'] = durations
+    df['night_awakening_number_bb1'] = wakes.astype(np.float64)
+    df['Child_survey_participation'] = np.ones(n, dtype=np.int64)
+
+    distress = rng.normal(size=n)
+    reactivity = 0.3 * distress + 0.35 * (wakes - 1.4) / 1.4 + rng.normal(size=n)
+    for scale, (columns, low, high, mean) in likert_scales.items():
+        latent = reactivity if scale == 'ibq' else distress
+        values = _likert(rng, latent, len(columns), low, high, mean, missing_rate)
+        for j, col in enumerate(columns):
+            df[col] = values[:, j]
+
+    frame = pd.DataFrame(df)
+    for col in ['Age', 'Gestationnal_age', 'night_awakening_number_bb1']:
+        frame.loc[rng.random(n) < missing_rate / 3, col] = np.nan
+    return frame[raw_columns]
+
+
+def add_duplicates(participants, rng, partner_rate=0.3, resubmit_rate=0.01):
+    '''Add partner rows (infant fields only) and repeated mother rows, grouped and sorted by participant'''
+    partners = participants.sample(frac=partner_rate, random_state=rng)
+    blank = [c for c in raw_columns if c not in ('Participant_number', 'Type_parents', *infant_columns)]
+    partners = partners.assign(Type_parents=2, **{col: np.nan for col in blank})
+    resubmitted = participants.sample(frac=resubmit_rate, random_state=rng)
+
+    rows = pd.concat([participants, partners, resubmitted], ignore_index=True)
+    order = np.lexsort((rng.random(len(rows)), rows['Participant_number'].to_numpy()))
+    return rows.iloc[order].reset_index(drop=True)
+
+
+def make_raw_export(n, seed=0, start=1, missing_rate=0.03, partner_rate=0.3, resubmit_rate=0.01):
+    '''Raw export frame for `n` participants (about n * (1 + partner_rate + resubmit_rate) rows)'''
+    rng = np.random.default_rng(seed)
+    participants = make_participants(n, rng, start=start, missing_rate=missing_rate)
+    return add_duplicates(participants, rng, partner_rate, resubmit_rate)
+
+
+def write_raw_export(path, n, seed=0, start=1, chunksize=100_000, **kwargs):
+    '''Write a synthetic export for `n` participants to `path`, generated `chunksize` participants at a time.
+
+    Each chunk has its own child seed, so the file only depends on `seed` and `chunksize`.
+    Participants are numbered from `start`; other keyword arguments go to make_raw_export.
+    Returns the number of rows written.'''
+    sizes = [min(chunksize, n - lo) for lo in range(0, n, chunksize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    rows = 0
+    for i, (size, child) in enumerate(zip(sizes, seeds)):
+        chunk = make_raw_export(size, seed=child, start=start + i * chunksize, **kwargs)
+        chunk.to_csv(path, mode='a' if i else 'w', header=not i, index=False, encoding='ISO-8859-1')
+        rows += len(chunk)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic raw survey export in the layout ETL.py reads')
+    parser.add_argument('--participants', type=int, default=10**5)
+    parser.add_argument('--out', default='CSV_files/synthetic_export.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-rate', type=float, default=0.03, help='share of blank Likert items')
+    parser.add_argument('--partner-rate', type=float, default=0.3, help='share of participants with a partner row')
+    args = parser.parse_args()
+
+    rows = write_raw_export(args.out, args.participants, seed=args.seed, missing_rate=args.missing_rate,
+                            partner_rate=args.partner_rate)
+    print(f'{rows:,} rows for {args.participants:,} participants written to {args.out}')
@@ -0,0 +1,91 @@
+import argparse
+import time
+import pandas as pd
+import numpy as np
+
+import ETL
+
+
+# Benchmark of the vectorized ETL transforms against the original per-row versions
+# Run from the project root: python -m benchmarks.transforms --sizes 100000 1000000 10000000
+
+def make_raw_columns(n, seed=0):
+    '''Coded participant columns and an HH:MM duration column shaped like the raw export'''
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({
+        col: rng.integers(1, len(codes) + 1, n).astype(float)
+        for col, codes in ETL.decode_maps.items()
+    })
+    minutes = rng.choice([0, 15, 30, 45], n)
+    hours = rng.integers(5, 14, n)
+    durations = pd.Series([f'{h}:{m:02d}' for h, m in zip(hours, minutes)], dtype=object)
+    durations[rng.random(n) < 0.01] = '99:99'
+    durations[rng.random(n) < 0.01] = np.nan
+    df['infant_nightly_sleep_duration'] = durations
+
+    for col in ETL.decode_maps:
+        df.loc[rng.random(n) < 0.02, col] = np.nan
+    return df
+
+
+def original_transform(df):
+    out = df.copy()
+    for col, codes in ETL.decode_maps.items():
+        out[col] = out[col].map(codes)
+    out['infant_nightly_sleep_duration'] = out['infant_nightly_sleep_duration'].apply(ETL.convert_to_hours)
+    return out
+
+
+def vectorized_transform(df):
+    out = ETL.decode_columns(df)
+    out['infant_nightly_sleep_duration'] = ETL.parse_hours(out['infant_nightly_sleep_duration'])
+    return out
+
+
+def timed(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(sizes, repeat=3):
+    rows = []
+    for n in sizes:
+        df = make_raw_columns(n)
+
+        t_hours_old, hours_old = timed(lambda s: s.apply(ETL.convert_to_hours), df['infant_nightly_sleep_duration'], repeat=repeat)
+        t_hours_new, hours_new = timed(ETL.parse_hours, df['infant_nightly_sleep_duration'], repeat=repeat)
+        assert np.allclose(hours_old, hours_new, equal_nan=True)
+
+        t_all_old, old = timed(original_transform, df, repeat=repeat)
+        t_all_new, new = timed(vectorized_transform, df, repeat=repeat)
+        for col in ETL.decode_maps:
+            assert (old[col].fillna('').astype(str) == new[col].astype(object).fillna('').astype(str)).all()
+
+        rows.append({
+            'rows': n,
+            'hours_original_s': t_hours_old,
+            'hours_vectorized_s': t_hours_new,
+            'hours_speedup': t_hours_old / t_hours_new,
+            'transform_original_s': t_all_old,
+            'transform_vectorized_s': t_all_new,
+            'transform_speedup': t_all_old / t_all_new
+        })
+        print(f'{n:>10,} rows: hours x{t_hours_old / t_hours_new:.1f}, decode + hours x{t_all_old / t_all_new:.1f}')
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized ETL transforms')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**5, 10**6, 10**7])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.sizes, repeat=args.repeat)
+    pd.set_option('display.width', 200)
+    print(results.round(4).to_string(index=False))
@@ -0,0 +1,255 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import os
+import pandas as pd
+import numpy as np
+
+from correlation import sort_index
+from posthoc import _mwu_p
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Bootstrap confidence intervals for the effect sizes reported by the question scripts.
+# Resamples are drawn as one (replicates x n) index matrix per chunk and each statistic is a kernel that
+# works on all replicates of a chunk at once (row-wise ranks, bincount group sums, batched contingency
+# tables). Chunks run in a process pool; each chunk has its own child seed of one SeedSequence, so the
+# replicates depend only on `seed` and `chunk_size`, not on the number of processes.
+
+BootstrapResult = namedtuple('BootstrapResult', ['estimate', 'low', 'high', 'se', 'replicates'])
+
+
+def resample_indices(n, n_boot, rng, strata=None):
+    '''(n_boot x n) matrix of row indices drawn with replacement, within each stratum when given'''
+    if strata is None:
+        return rng.integers(0, n, size=(n_boot, n), dtype=np.int32)
+    idx = np.empty((n_boot, n), dtype=np.int32)
+    for value in np.unique(strata):
+        members = np.flatnonzero(strata == value).astype(np.int32)
+        idx[:, members] = members[rng.integers(0, len(members), size=(n_boot, len(members)))]
+    return idx
+
+
+def row_ranks(values):
+    '''Average ranks within each row of a (replicates x n) array, and each row's tie term sum(t^3 - t)'''
+    order, start, end = sort_index(values)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (start + end + 1) / 2, axis=1)
+    # a tie group of size t contributes t^2 - 1 at each of its t positions, i.e. t^3 - t in total
+    ties = end - start
+    return ranks, (ties.astype(np.float64) ** 2 - 1).sum(axis=1)
+
+
+def _group_sums(values, groups, k):
+    '''Per-row sums of `values` by group code: (replicates x k)'''
+    rows = np.arange(values.shape[0])[:, None] * k
+    return np.bincount((rows + groups).ravel(), weights=values.ravel(), minlength=values.shape[0] * k).reshape(-1, k)
+
+
+# Kernels: each takes a dict of resampled (replicates x n) arrays and returns one value per replicate
+
+def epsilon_squared_kernel(sample, k):
+    '''Kruskal-Wallis epsilon^2 = (H - k + 1) / (n - k), with tie-corrected H'''
+    ranks, tie_term = row_ranks(sample['x'])
+    n = ranks.shape[1]
+    counts = _group_sums(np.ones_like(ranks), sample['group'], k)
+    rank_sums = _group_sums(ranks, sample['group'], k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H = 12 / (n * (n + 1)) * np.nansum(rank_sums ** 2 / counts, axis=1) - 3 * (n + 1)
+        H /= 1 - tie_term / (n ** 3 - n)
+    return (H - k + 1) / (n - k)
+
+
+def _mwu_u(sample):
+    ranks, tie_term = row_ranks(sample['x'])
+    first = sample['group'] == 0
+    n1 = first.sum(axis=1).astype(np.float64)
+    n2 = ranks.shape[1] - n1
+    U1 = (ranks * first).sum(axis=1) - n1 * (n1 + 1) / 2
+    return U1, n1, n2, tie_term
+
+
+def mwu_r_kernel(sample):
+    '''The scripts' r = |z| / sqrt(n), with z recovered from the two-sided asymptotic p-value'''
+    U1, n1, n2, tie_term = _mwu_u(sample)
+    p = _mwu_p(U1, n1, n2, tie_term, 'two-sided')
+    return np.abs(stats.norm.ppf(p / 2)) / np.sqrt(n1 + n2)
+
+
+def rank_biserial_kernel(sample):
+    '''Rank-biserial correlation 1 - 2U / (n1 n2), U being the first sample's statistic'''
+    U1, n1, n2, _ = _mwu_u(sample)
+    return 1 - 2 * U1 / (n1 * n2)
+
+
+def cramers_v_kernel(sample, shape, correction=True):
+    '''Cramer's V from the chi-square of each replicate's contingency table'''
+    r, c = shape
+    B = sample['a'].shape[0]
+    cells = np.arange(B)[:, None] * (r * c) + sample['a'] * c + sample['b']
+    observed = np.bincount(cells.ravel(), minlength=B * r * c).reshape(B, r, c).astype(np.float64)
+    n = observed.sum(axis=(1, 2))
+    expected = observed.sum(axis=2, keepdims=True) * observed.sum(axis=1, keepdims=True) / n[:, None, None]
+    diff = np.abs(observed - expected)
+    if correction and (r - 1) * (c - 1) == 1:
+        # Yates' correction, as scipy.stats.chi2_contingency applies it for one degree of freedom
+        diff = np.maximum(diff - 0.5, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(expected > 0, diff ** 2 / expected, 0).sum(axis=(1, 2))
+    return np.sqrt(chi2 / (n * (min(r, c) - 1)))
+
+
+def spearman_kernel(sample):
+    '''Spearman rho of each replicate: Pearson correlation of the row-wise ranks'''
+    rx, _ = row_ranks(sample['x'])
+    ry, _ = row_ranks(sample['y'])
+    rx -= rx.mean(axis=1, keepdims=True)
+    ry -= ry.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (rx * ry).sum(axis=1) / np.sqrt((rx ** 2).sum(axis=1) * (ry ** 2).sum(axis=1))
+
+
+def code_ranks(codes, mask, levels):
+    '''Average ranks within each row of the masked entries of a (rows x n) array of dense value codes
+    (0 .. levels - 1 in value order), from per-row counts of each code instead of a sort (0 outside the mask)'''
+    cells = codes.shape[0] * levels
+    keys = np.arange(0, cells, levels)[:, None] + codes
+    keys[~mask] = cells  # masked entries go to one extra bin
+    counts = np.bincount(keys.ravel(), minlength=cells + 1)[:cells].reshape(-1, levels)
+    midranks = np.cumsum(counts, axis=1) - (counts - 1) / 2
+    return np.append(midranks.ravel(), 0)[keys]
+
+
+def spearman_columns_kernel(sample, levels):
+    '''Spearman rho of x against every column of Y for each replicate, on each pair's complete rows:
+    (replicates x columns). Values come as dense codes (-1 = missing), `levels` the number of codes.'''
+    x, Y = sample['x'], sample['Y']
+    replicates, n, m = Y.shape
+    Y = Y.transpose(0, 2, 1).reshape(replicates * m, n)
+    X = np.repeat(x, m, axis=0)
+    mask = (Y >= 0) & (X >= 0)
+    rx, ry = code_ranks(X, mask, levels), code_ranks(Y, mask, levels)
+
+    count = mask.sum(axis=1)
+    mean = (count + 1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = np.einsum('ij,ij->i', rx, ry) / count - mean ** 2
+        var_x = np.einsum('ij,ij->i', rx, rx) / count - mean ** 2
+        var_y = np.einsum('ij,ij->i', ry, ry) / count - mean ** 2
+        return (cov / np.sqrt(var_x * var_y)).reshape(replicates, m)
+
+
+def _run_chunk(kernel, data, strata, n_boot, seed):
+    rng = np.random.default_rng(seed)
+    n = len(next(iter(data.values())))
+    idx = resample_indices(n, n_boot, rng, strata)
+    return kernel({name: values[idx] for name, values in data.items()})
+
+
+def bootstrap(kernel, data, n_boot=10000, confidence=0.95, seed=0, strata=None, processes=None, chunk_size=1000):
+    '''Percentile bootstrap CI of kernel over resampled rows of `data` (dict of arrays with the same number of rows).
+
+    `kernel` must be picklable (a module-level function or a functools.partial of one). `strata`
+    resamples within each of its values, keeping group sizes fixed. Returns a BootstrapResult with the
+    estimate on the original data, the CI bounds, the bootstrap standard error and all replicates
+    (one array per field when the kernel returns several statistics per replicate).'''
+    data = {name: np.asarray(values) for name, values in data.items()}
+    n = len(next(iter(data.values())))
+    estimate = kernel({name: values[None, :] for name, values in data.items()})[0]
+
+    sizes = [min(chunk_size, n_boot - lo) for lo in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(kernel, data, strata, size, child) for size, child in zip(sizes, seeds)]
+
+    processes = min(processes or os.cpu_count() or 1, len(jobs))
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+            parts = list(pool.map(_run_chunk, *zip(*jobs)))
+    else:
+        parts = [_run_chunk(*job) for job in jobs]
+
+    replicates = np.concatenate(parts)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+    return BootstrapResult(estimate, low, high, np.nanstd(replicates, ddof=1, axis=0), replicates)
+
+
+# One function per effect size reported by the scripts
+
+def epsilon_squared_ci(values, groups, **kwargs):
+    '''Kruskal-Wallis epsilon^2 of `values` across `groups` (Q1, Q3, Q4), resampling within groups'''
+    values, groups = _complete(values, groups)
+    codes, labels = _codes(groups)
+    data = {'x': values.astype(np.float64), 'group': codes}
+    return bootstrap(partial(epsilon_squared_kernel, k=len(labels)), data, strata=codes, **kwargs)
+
+
+def mwu_r_ci(x, y, **kwargs):
+    '''The |z| / sqrt(n) effect size of a Mann-Whitney test between x and y (Q2, Q7)'''
+    data = _two_samples(x, y)
+    return bootstrap(mwu_r_kernel, data, strata=data['group'], **kwargs)
+
+
+def rank_biserial_ci(x, y, **kwargs):
+    '''Rank-biserial correlation 1 - 2U / (n1 n2) between x and y (Q11)'''
+    data = _two_samples(x, y)
+    return bootstrap(rank_biserial_kernel, data, strata=data['group'], **kwargs)
+
+
+def cramers_v_ci(a, b, correction=True, **kwargs):
+    '''Cramer's V of the contingency table of two categorical columns (Q6), resampling dyads'''
+    a, b = _complete(a, b)
+    a_codes, a_labels = _codes(a)
+    b_codes, b_labels = _codes(b)
+    kernel = partial(cramers_v_kernel, shape=(len(a_labels), len(b_labels)), correction=correction)
+    return bootstrap(kernel, {'a': a_codes, 'b': b_codes}, **kwargs)
+
+
+def spearman_ci(x, y, **kwargs):
+    '''Spearman rho between x and y on their complete pairs (Q9, Q10, Q12), resampling pairs'''
+    x, y = _complete(x, y)
+    return bootstrap(spearman_kernel, {'x': x.astype(np.float64), 'y': y.astype(np.float64)}, **kwargs)
+
+
+def spearman_columns_ci(x, Y, **kwargs):
+    '''Spearman rho between x and every column of the frame Y (Q5, Q8), each on its complete pairs.
+    Rows are resampled once per replicate for all columns; the BootstrapResult fields are arrays in
+    column order.'''
+    x, Y = np.asarray(x, dtype=np.float64), Y.to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = ~np.isnan(x) & ~np.isnan(Y).all(axis=1)
+    x, Y = _dense_codes(x[keep]), _dense_codes(Y[keep])
+    levels = int(max(x.max(), Y.max())) + 1
+    return bootstrap(partial(spearman_columns_kernel, levels=levels), {'x': x, 'Y': Y}, **kwargs)
+
+
+def _dense_codes(values):
+    '''Rank of each value among the distinct values of its column (-1 for NaN)'''
+    codes = np.full(values.shape, -1, dtype=np.int64)
+    columns = values.reshape(len(values), -1)
+    out = codes.reshape(len(values), -1)
+    for j in range(columns.shape[1]):
+        present = ~np.isnan(columns[:, j])
+        out[present, j] = np.unique(columns[present, j], return_inverse=True)[1]
+    return codes
+
+
+def _complete(*columns):
+    '''The rows of equal-length columns where none of them is missing (NaN, None or pd.NA)'''
+    columns = [np.asarray(col, dtype=object) for col in columns]
+    keep = ~np.logical_or.reduce([pd.isna(col) for col in columns])
+    return [col[keep] for col in columns]
+
+
+def _codes(values):
+    labels, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int64), labels
+
+
+def _two_samples(x, y):
+    '''Pooled values of x and y (missing values dropped) and their group codes'''
+    (x,), (y,) = _complete(x), _complete(y)
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    return {'x': np.concatenate([x, y]), 'group': np.repeat([0, 1], [len(x), len(y)])}
@@ -0,0 +1,261 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.metrics import pairwise_distances
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+import loader
+
+
+# Model selection for the sleep–temperament clustering.
+# The (k, seed) grid is fitted across a process pool and the best fit per k is kept, so the final
+# labels come straight from the sweep instead of a refit. Silhouettes are computed from one shared
+# distance matrix (small cohorts) or from a stratified sample of points with a standard error.
+
+SweepResult = namedtuple('SweepResult', ['scores', 'models'])
+
+# sampled points whose distances to all n points are held in memory at once
+CHUNK_ROWS = 256
+
+_worker_X = None
+
+
+def _init_worker(X):
+    global _worker_X
+    _worker_X = X
+    # one BLAS/OpenMP thread per worker, the pool provides the parallelism
+    threadpool_limits(1)
+
+
+def _fit(job):
+    k, seed, n_init = job
+    model = KMeans(n_clusters=k, random_state=seed, n_init=n_init).fit(_worker_X)
+    return k, seed, model
+
+
+def _silhouette_values(D_blocks, rows, labels, k):
+    '''Silhouette of the points `rows`, given their distances to every point as consecutive row blocks
+    (D_blocks), of which only the per-cluster sums are kept'''
+    counts = np.bincount(labels, minlength=k)
+    onehot = np.zeros((len(labels), k))
+    onehot[np.arange(len(labels)), labels] = 1.0
+    sums = np.concatenate([block @ onehot for block in D_blocks])
+
+    own = labels[rows]
+    idx = np.arange(len(rows))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = sums[idx, own] / (counts[own] - 1)
+        means = sums / counts
+    means[idx, own] = np.inf
+    b = means.min(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (b - a) / np.maximum(a, b)
+    s[counts[own] == 1] = 0.0  # same convention as sklearn for singleton clusters
+    return np.nan_to_num(s)
+
+
+def silhouette_exact(D, labels, k):
+    '''Mean silhouette from a precomputed (n x n) distance matrix shared across all k'''
+    return _silhouette_values([D], np.arange(len(labels)), labels, k).mean()
+
+
+def silhouette_sampled(X, labels, k, sample_size, rng):
+    '''Silhouette estimated from a sample stratified by cluster.
+
+    Each sampled point gets its exact silhouette (distances to all n points, CHUNK_ROWS points at a
+    time), and the cluster strata are combined with proportional weights. Returns (estimate, standard error).'''
+    n = len(labels)
+    counts = np.bincount(labels, minlength=k)
+    weights = counts / n
+    take = np.maximum(np.minimum(np.round(weights * sample_size).astype(int), counts), np.minimum(counts, 2))
+
+    estimate, variance = 0.0, 0.0
+    for cluster in range(k):
+        if counts[cluster] == 0:
+            continue
+        rows = rng.choice(np.flatnonzero(labels == cluster), size=take[cluster], replace=False)
+        blocks = (pairwise_distances(X[rows[i:i + CHUNK_ROWS]], X) for i in range(0, len(rows), CHUNK_ROWS))
+        values = _silhouette_values(blocks, rows, labels, k)
+        estimate += weights[cluster] * values.mean()
+        if take[cluster] > 1:
+            fpc = 1 - take[cluster] / counts[cluster]
+            variance += weights[cluster] ** 2 * values.var(ddof=1) / take[cluster] * fpc
+    return estimate, np.sqrt(variance)
+
+
+def kmeans_sweep(X, k_values=range(2, 6), seeds=(42,), n_init=20, processes=None,
+                 exact_max=5000, sample_size=2000, random_state=0):
+    '''Fit KMeans for every (k, seed) pair in parallel and score each k.
+
+    Each job is KMeans(n_clusters=k, random_state=seed, n_init=n_init), so the default grid reproduces
+    the clustering script's fits exactly. Extra seeds add independent restarts; the lowest-inertia fit
+    per k is kept. Silhouettes are exact (one shared distance matrix) when there are at most `exact_max`
+    rows, otherwise estimated from `sample_size` points stratified by cluster, with `silhouette_se`
+    reporting the standard error (0 when exact).
+
+    Returns a SweepResult: `scores` (DataFrame indexed by k) and `models` (best fitted KMeans per k).'''
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    jobs = [(k, seed, n_init) for k in k_values for seed in seeds]
+    processes = min(processes or os.cpu_count() or 1, len(jobs))
+
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # fork so that the workers do not re-import the calling script
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker, initargs=(X,)) as pool:
+            fits = list(pool.map(_fit, jobs))
+    else:
+        _init_worker(X)
+        fits = [_fit(job) for job in jobs]
+
+    models = {}
+    for k, seed, model in fits:
+        if k not in models or model.inertia_ < models[k][1].inertia_:
+            models[k] = (seed, model)
+
+    D = pairwise_distances(X) if len(X) <= exact_max else None
+    rng = np.random.default_rng(random_state)
+    rows = []
+    for k in k_values:
+        seed, model = models[k]
+        if D is not None:
+            sil, se = silhouette_exact(D, model.labels_, k), 0.0
+        else:
+            sil, se = silhouette_sampled(X, model.labels_, k, sample_size, rng)
+        rows.append({'k': k, 'seed': seed, 'inertia': model.inertia_, 'silhouette': sil, 'silhouette_se': se})
+
+    scores = pd.DataFrame(rows).set_index('k')
+    return SweepResult(scores, {k: model for k, (_, model) in models.items()})
+
+
+# Streaming mode: the scaler, K-means and PCA are fitted chunk by chunk (StandardScaler.partial_fit,
+# MiniBatchKMeans, IncrementalPCA), and labels, PCA coordinates and the per-cluster summary are produced
+# per chunk from running moments. Only one chunk of features is in memory at a time.
+
+StreamingModel = namedtuple('StreamingModel', ['columns', 'scaler', 'kmeans', 'pca'])
+
+
+def frame_chunks(df, chunksize):
+    '''Chunk source over an in-memory frame, for use with the streaming functions'''
+    return lambda: (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+
+
+def parquet_chunks(path, columns, chunksize):
+    '''Chunk source reading only `columns` of a Parquet file, `chunksize` rows at a time, with the
+    missing sleep duration code set to NaN as load_dyads does'''
+    def read():
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            chunk = batch.to_pandas()
+            if 'infant_nightly_sleep_duration' in chunk:
+                chunk['infant_nightly_sleep_duration'] = chunk['infant_nightly_sleep_duration'].replace(loader.MISSING_SLEEP_DURATION, np.nan)
+            yield chunk
+    return read
+
+
+def _feature_chunks(chunks, columns):
+    '''Complete rows of `columns` from each chunk (the streaming equivalent of dropna)'''
+    for chunk in chunks():
+        chunk = chunk.dropna(subset=columns)
+        if len(chunk):
+            yield chunk
+
+
+def _rebatch(arrays, min_rows):
+    '''Merge consecutive arrays until each has at least min_rows (the last one may be shorter)'''
+    pending = []
+    for array in arrays:
+        pending.append(array)
+        if sum(len(a) for a in pending) >= min_rows:
+            yield np.concatenate(pending)
+            pending = []
+    if pending:
+        yield np.concatenate(pending)
+
+
+def fit_streaming(chunks, columns, n_clusters, n_components=2, n_epochs=3, batch_size=1024, random_state=42):
+    '''Fit scaler, MiniBatchKMeans and IncrementalPCA over a chunk source (a callable returning an iterator
+    of DataFrames, e.g. frame_chunks or parquet_chunks). Rows with missing features are skipped.
+
+    One pass fits the scaler, then `n_epochs` passes feed the scaled chunks to K-means, the first of which
+    also fits the PCA. Returns a StreamingModel for assign_chunks.'''
+    scaler = StandardScaler()
+    for chunk in _feature_chunks(chunks, columns):
+        scaler.partial_fit(chunk[columns].to_numpy(dtype=np.float64))
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state, n_init=3)
+    pca = IncrementalPCA(n_components=n_components)
+    min_rows = max(n_clusters * 3, n_components, 1)
+
+    for epoch in range(n_epochs):
+        scaled = (scaler.transform(c[columns].to_numpy(dtype=np.float64)) for c in _feature_chunks(chunks, columns))
+        for X in _rebatch(scaled, min_rows):
+            # a short tail batch can update an initialised K-means but not start one
+            if len(X) >= min_rows or hasattr(kmeans, 'cluster_centers_'):
+                kmeans.partial_fit(X)
+            if epoch == 0 and len(X) >= n_components:
+                pca.partial_fit(X)
+
+    return StreamingModel(list(columns), scaler, kmeans, pca)
+
+
+def assign_chunks(model, chunks):
+    '''Yield each chunk's complete rows with `cluster` and `pca1`, `pca2`, ... columns added'''
+    for chunk in _feature_chunks(chunks, model.columns):
+        X = model.scaler.transform(chunk[model.columns].to_numpy(dtype=np.float64))
+        coords = model.pca.transform(X)
+        chunk = chunk.assign(cluster=model.kmeans.predict(X))
+        for i in range(coords.shape[1]):
+            chunk[f'pca{i + 1}'] = coords[:, i]
+        yield chunk
+
+
+def _chunk_moments(labels, values, k):
+    '''(count, mean, sum of squared deviations) per cluster for one chunk'''
+    onehot = np.zeros((len(labels), k))
+    onehot[np.arange(len(labels)), labels] = 1.0
+    n = onehot.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nan_to_num((onehot.T @ values) / n[:, None])
+    m2 = onehot.T @ (values - mean[labels]) ** 2
+    return n, mean, m2
+
+
+def _merge_moments(a, b):
+    '''Combine two (count, mean, M2) triples (Chan et al. parallel variance update)'''
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.nan_to_num(n_b / n)[:, None]
+    delta = mean_b - mean_a
+    mean = mean_a + delta * weight
+    m2 = m2_a + m2_b + delta ** 2 * (n_a[:, None] * weight)
+    return n, mean, m2
+
+
+def streaming_cluster_summary(labelled_chunks, aggregations, n_clusters):
+    '''Per-cluster aggregates over labelled chunks, from running moments.
+
+    `aggregations` is a groupby().agg style dict of column -> ['mean'] / ['mean', 'std'] (std with
+    ddof=1, as pandas). Returns a frame laid out like features.groupby('cluster').agg(aggregations).'''
+    columns = list(aggregations)
+    moments = (np.zeros(n_clusters), np.zeros((n_clusters, len(columns))), np.zeros((n_clusters, len(columns))))
+    for chunk in labelled_chunks:
+        values = chunk[columns].to_numpy(dtype=np.float64)
+        moments = _merge_moments(moments, _chunk_moments(chunk['cluster'].to_numpy(), values, n_clusters))
+
+    n, mean, m2 = moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(m2 / (n - 1)[:, None])
+    stats_by_name = {'mean': mean, 'std': std}
+
+    present = n > 0
+    summary = {(col, agg): stats_by_name[agg][present, j] for j, col in enumerate(columns) for agg in aggregations[col]}
+    return pd.DataFrame(summary, index=pd.Index(np.flatnonzero(present), name='cluster'))
@@ -0,0 +1,147 @@
+from collections import namedtuple
+import pandas as pd
+import numpy as np
+
+import multitest
+import rank_index
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Batched Spearman correlations for screening many variables against many items/scale totals.
+# Each column is sorted once (or its order taken from rank_index for columns of the dyad data); its rank
+# under any pairwise-complete subset is then a gather plus a cumulative count over that sort order, done
+# for a whole block of partner columns at a time.
+
+SpearmanResult = namedtuple('SpearmanResult', ['rho', 'p', 'n'])
+
+
+def sort_index(values):
+    '''Argsort (NaNs last) of each row of a (variables x observations) array and, for each sorted
+    position, the start and end (exclusive) of its tie group'''
+    k, n = values.shape
+    order = np.argsort(values, axis=1, kind='stable').astype(np.int32)
+    sorted_vals = np.take_along_axis(values, order, axis=1)
+
+    new_group = np.ones((k, n), dtype=bool)
+    new_group[:, 1:] = sorted_vals[:, 1:] != sorted_vals[:, :-1]
+    positions = np.arange(n, dtype=np.int32)
+    start = np.maximum.accumulate(np.where(new_group, positions, 0), axis=1)
+    # end of a group = the next group's start, found by a running minimum from the right
+    next_start = np.full((k, n), n, dtype=np.int32)
+    next_start[:, :-1] = np.where(new_group[:, 1:], positions[1:], n)
+    end = np.minimum.accumulate(next_start[:, ::-1], axis=1)[:, ::-1]
+    return order, start, np.ascontiguousarray(end)
+
+
+def masked_ranks(order, start, end, mask):
+    '''Average ranks of each row within the observations selected by `mask` (0 outside the mask).
+
+    order/start/end come from sort_index, with one row per mask row or a single row shared by all of them.'''
+    in_sorted = np.take_along_axis(mask, order, axis=1)
+    counts = np.zeros((mask.shape[0], mask.shape[1] + 1), dtype=np.int32)
+    np.cumsum(in_sorted, axis=1, out=counts[:, 1:])
+    less = np.take_along_axis(counts, start, axis=1)
+    ties = np.take_along_axis(counts, end, axis=1) - less
+    ranks_sorted = (less + (ties + 1) / 2) * in_sorted
+
+    ranks = np.empty_like(ranks_sorted)
+    np.put_along_axis(ranks, np.broadcast_to(order, ranks.shape), ranks_sorted, axis=1)
+    return ranks
+
+
+def _p_values(rho, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof = n - 2
+        t = rho * np.sqrt(dof / ((1 - rho) * (1 + rho)))
+        p = 2 * stats.t.sf(np.abs(t), dof)
+    p = np.where(np.abs(rho) >= 1, 0.0, p)
+    return np.where((n > 2) & ~np.isnan(rho), p, np.nan)
+
+
+def index_ranks(order, start, end):
+    '''Average ranks of each row from its sort_index'''
+    ranks = np.empty(order.shape)
+    np.put_along_axis(ranks, order, (start + end + 1) / 2, axis=1)
+    return ranks
+
+
+def _rho_complete(x, y, x_index=None, y_index=None):
+    '''Spearman for columns without missing values: one rank pass (none with sort indexes) and one matrix product'''
+    rx = stats.rankdata(x, axis=1) if x_index is None else index_ranks(*x_index)
+    ry = stats.rankdata(y, axis=1) if y_index is None else index_ranks(*y_index)
+    rx -= rx.mean(axis=1, keepdims=True)
+    ry -= ry.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (rx @ ry.T) / np.outer(np.sqrt((rx ** 2).sum(axis=1)), np.sqrt((ry ** 2).sum(axis=1)))
+
+
+def _rho_pairwise(x, y, x_index, y_index):
+    '''Spearman on pairwise-complete rows: for each x variable, re-rank it (and every y variable)
+    under the joint masks of the whole y block at once'''
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x_order, x_start, x_end = x_index
+    y_order, y_start, y_end = y_index
+
+    rho = np.empty((x.shape[0], y.shape[0]))
+    count = np.empty((x.shape[0], y.shape[0]))
+    for i in range(x.shape[0]):
+        joint = my & mx[i]
+        n = joint.sum(axis=1).astype(np.float64)
+        rx = masked_ranks(x_order[[i]], x_start[[i]], x_end[[i]], joint)
+        ry = masked_ranks(y_order, y_start, y_end, joint)
+
+        mean = (n + 1) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = np.einsum('ij,ij->i', rx, ry) / n - mean ** 2
+            var_x = np.einsum('ij,ij->i', rx, rx) / n - mean ** 2
+            var_y = np.einsum('ij,ij->i', ry, ry) / n - mean ** 2
+            rho[i] = cov / np.sqrt(var_x * var_y)
+        count[i] = n
+    return rho, count
+
+
+def spearman_matrix(x, y=None, block_size=None):
+    '''Spearman rho, p-value and n for every column of `x` against every column of `y`.
+
+    `y` defaults to `x` (the full correlation matrix). Missing values are handled pairwise, as if each
+    pair had been passed to scipy.stats.spearmanr after dropping its incomplete rows. With
+    `block_size`, the y columns are processed that many at a time to bound memory on wide inputs.
+    Returns a SpearmanResult of three DataFrames indexed by x columns and with y columns.'''
+    y = x if y is None else y
+    # one contiguous row per variable
+    X = np.ascontiguousarray(x.to_numpy(dtype=np.float64).T)
+    Y = np.ascontiguousarray(y.to_numpy(dtype=np.float64).T)
+    x_complete = not np.isnan(X).any()
+    x_index = rank_index.frame_sort_index(x)
+    if x_index is None and not x_complete:
+        x_index = sort_index(X)
+
+    block_size = block_size or Y.shape[0] or 1
+    rho = np.empty((X.shape[0], Y.shape[0]))
+    count = np.empty((X.shape[0], Y.shape[0]))
+
+    for lo in range(0, Y.shape[0], block_size):
+        block = Y[lo:lo + block_size]
+        block_index = rank_index.frame_sort_index(y.iloc[:, lo:lo + block_size])
+        if x_complete and not np.isnan(block).any():
+            rho[:, lo:lo + block_size] = _rho_complete(X, block, x_index, block_index)
+            count[:, lo:lo + block_size] = X.shape[1]
+        else:
+            x_index = x_index or sort_index(X)
+            block_index = block_index or sort_index(block)
+            rho[:, lo:lo + block_size], count[:, lo:lo + block_size] = _rho_pairwise(X, block, x_index, block_index)
+
+    rho = np.clip(rho, -1, 1)
+    p = _p_values(rho, count)
+    frame = lambda a: pd.DataFrame(a, index=x.columns, columns=y.columns)
+    return SpearmanResult(frame(rho), frame(p), frame(count.astype(np.int64)))
+
+
+def correlation_table(result, method='holm'):
+    '''Long format of a SpearmanResult: one row per (x, y) pair with rho, p, n and the p-value adjusted
+    over all pairs (p_<method>, see multitest.adjust; none for method='none')'''
+    table = pd.concat({'rho': result.rho.stack(), 'p': result.p.stack(), 'n': result.n.stack()}, axis=1)
+    table = table.rename_axis(['x', 'y']).reset_index()
+    return table if method == 'none' else multitest.add_adjusted(table, 'p', method)
@@ -0,0 +1,117 @@
+import argparse
+import ast
+import importlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+
+# Deferred imports for the heavy libraries and a report of what each script pays for its imports.
+# lazy_import registers a module whose code only runs on its first attribute access, so helper modules
+# can name scipy.stats at the top without every importer paying for it. LAZY_IMPORTS=0 in the
+# environment makes lazy_import import eagerly, e.g. to see import errors at startup.
+# Run from the project root: python lazy_imports.py (every question script) or python lazy_imports.py Q1.py loader
+
+enabled = os.environ.get('LAZY_IMPORTS', '1') != '0'
+
+
+def lazy_import(name):
+    '''Module `name`, loaded on first attribute access instead of now (importlib.util.LazyLoader).
+    A module that is already imported is returned as it is.'''
+    if name in sys.modules:
+        return sys.modules[name]
+    if not enabled:
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def preload(names):
+    '''Import `names` now (loading lazy modules too), e.g. before forking workers that all need them'''
+    for name in names:
+        module = importlib.import_module(name)
+        getattr(module, '__file__', None)  # any attribute access runs a lazy module's code
+
+
+# Import cost report
+
+def import_statements(target):
+    '''Python code importing what `target` imports: the top-level import lines of a script, or the module itself'''
+    if not target.endswith('.py'):
+        return f'import {target}'
+    with open(target, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=target)
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(code):
+    '''(module, self seconds, cumulative seconds, depth) for every module `code` imports, in a fresh interpreter'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_part, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_part.split(':')[1]) / 1e6, int(cumulative) / 1e6, depth))
+    return rows
+
+
+def import_cost(target, repeat=3):
+    '''Total import time of `target` and its breakdown by top-level package (best of `repeat` fresh runs)'''
+    code = import_statements(target)
+    best = None
+    for _ in range(repeat):
+        rows = import_times(code)
+        total = sum(row[1] for row in rows)
+        if best is None or total < best[0]:
+            best = (total, rows)
+
+    total, rows = best
+    packages = {}
+    for name, self_time, _, _ in rows:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + self_time
+    packages = dict(sorted(packages.items(), key=lambda item: -item[1]))
+    return {'target': target, 'seconds': total, 'modules': len(rows), 'packages': packages}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of each analysis script (or module), by top-level package')
+    parser.add_argument('targets', nargs='*', help='scripts (*.py) or module names; default: every question script')
+    parser.add_argument('--top', type=int, default=6, help='packages to list per target')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='also write the full report to this file')
+    args = parser.parse_args()
+
+    if args.targets:
+        targets = args.targets
+    else:
+        from run_analysis import questions
+        targets = [script for script, _, _ in questions.values()]
+
+    report = [import_cost(target, repeat=args.repeat) for target in targets]
+    width = max(len(target) for target in targets)
+    for entry in sorted(report, key=lambda entry: -entry['seconds']):
+        heaviest = ', '.join(f'{name} {seconds:.3f}' for name, seconds in list(entry['packages'].items())[:args.top])
+        print(f'{entry["target"]:<{width}}  {entry["seconds"]:6.3f} s  {entry["modules"]:4d} modules  {heaviest}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import pandas as pd
+import numpy as np
+
+import ETL
+
+
+# Shared loading of the ETL outputs for the analysis scripts.
+# The two tables are parsed once per process, merged into one dyad frame and kept in memory;
+# every call checks the files' mtime (and content hash when the mtime moves) before reusing it.
+# The cached frame keeps the compact column types of the Parquet files (categoricals, Int8 items with
+# a missing-value mask, int32 IDs, float32 age and wakes; sleep duration and gestational age stay float64,
+# as their fractional values are not exact in float32) and only the columns a caller selects are widened
+# to float64. Run from the project root: python loader.py prints the memory report of each table.
+
+# '99:99' is how the survey codes a missing sleep duration, which the ETL turns into 99 + 99/60 hours
+MISSING_SLEEP_DURATION = 100.65
+
+item_ranges = {
+    'cbts_': (0, 3),
+    'epds_': (0, 3),
+    'hads_': (0, 3),
+    'ibq_': (1, 7)
+}
+
+tables = {
+    'participant': (ETL.PARTICIPANT_PARQUET, ETL.PARTICIPANT_PATH, ETL.participant_dtypes),
+    'mental_health': (ETL.MENTAL_HEALTH_PARQUET, ETL.MENTAL_HEALTH_PATH, ETL.mental_health_dtypes)
+}
+
+_files = {}
+_cache = {}
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
+
+
+def file_fingerprint(path):
+    '''Content hash of a file, only recomputed when its mtime or size changes'''
+    stat = os.stat(path)
+    known = _files.get(path)
+    if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+        known = (stat.st_mtime_ns, stat.st_size, _file_hash(path))
+        _files[path] = known
+    return known[2]
+
+
+def _source(name):
+    parquet_path, csv_path, _ = tables[name]
+    return parquet_path if os.path.exists(parquet_path) else csv_path
+
+
+def read_table(name):
+    '''Read one ETL output with its typed schema (the Parquet file when present, else the CSV)'''
+    path = _source(name)
+    dtypes = tables[name][2]
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return ETL.apply_schema(pd.read_csv(path), dtypes)
+
+
+def validate(participant_df, mental_health_df):
+    '''Check the invariants every analysis relies on; raise ValueError when one does not hold'''
+    for name, df in [('participant', participant_df), ('mental_health', mental_health_df)]:
+        duplicated = df['participant_number'].duplicated()
+        if duplicated.any():
+            raise ValueError(f'{name} has duplicate participant numbers: {df.loc[duplicated, "participant_number"].tolist()[:10]}')
+
+    for prefix, (low, high) in item_ranges.items():
+        cols = [c for c in mental_health_df.columns if c.startswith(prefix)]
+        values = mental_health_df[cols].astype('float64')
+        outside = (values < low) | (values > high)
+        if outside.any().any():
+            bad = outside.any()[outside.any()].index.tolist()
+            raise ValueError(f'{prefix}* items outside {low}-{high} in columns {bad}')
+
+
+def merge_tables(participant_df, mental_health_df):
+    '''One row per dyad from the typed participant and mental health tables, missing sleep duration code as NaN'''
+    dyads = participant_df.merge(mental_health_df, on='participant_number', how='left')
+    dyads['infant_nightly_sleep_duration'] = dyads['infant_nightly_sleep_duration'].replace(MISSING_SLEEP_DURATION, np.nan)
+    return dyads
+
+
+def _build_dyads():
+    participant_df = read_table('participant')
+    mental_health_df = read_table('mental_health')
+    validate(participant_df, mental_health_df)
+    return merge_tables(participant_df, mental_health_df)
+
+
+def widen(df):
+    '''Numeric columns (except participant_number) as float64 with NaN for missing, which is what scipy/seaborn expect'''
+    numeric = [c for c in df.columns if c != 'participant_number' and not isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if numeric:
+        df[numeric] = df[numeric].astype('float64')
+    return df
+
+
+def load_dyads(columns=None, compact=False):
+    '''Merged participant + mental health frame, one row per dyad.
+
+    Decoded fields are categoricals, scale items and measures are float64, and the missing sleep
+    duration code (100.65) is already NaN. `columns` selects a subset (participant_number is always
+    included) and may also name scale scores from scoring.score_columns(), e.g. 'epds_total'.
+    With `compact` the items stay Int8 (pd.NA for missing) and the measures keep their Parquet
+    types, as in the cache, instead of being widened to float64.
+    The merged frame is built once per process and reused until one of the files changes;
+    callers get their own copy, so adding or overwriting columns does not leak into the cache.'''
+    key = tuple(file_fingerprint(_source(name)) for name in tables)
+    if _cache.get('key') != key:
+        _cache['dyads'] = _build_dyads()
+        _cache['key'] = key
+
+    dyads = _cache['dyads']
+    finish = (lambda df: df) if compact else widen
+    if columns is None:
+        return finish(dyads.copy())
+    columns = ['participant_number', *[c for c in columns if c != 'participant_number']]
+
+    score_cols = [c for c in columns if c not in dyads.columns]
+    if score_cols:
+        import scoring
+        scores = scoring.load_scores()
+        unknown = [c for c in score_cols if c not in scores.columns]
+        if unknown:
+            raise KeyError(f'Unknown columns: {unknown}')
+        base = [c for c in columns if c in dyads.columns]
+        merged = finish(dyads[base].copy()).merge(scores[['participant_number', *score_cols]], on='participant_number', how='left')
+        return merged[columns]
+
+    return finish(dyads[columns].copy())
+
+
+# Memory report
+
+def plain(df):
+    '''`df` as pd.read_csv would hold it: decoded fields as Python strings, numbers as float64 (int64 IDs)'''
+    out = pd.DataFrame(index=df.index)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            out[col] = df[col].astype(object)
+        elif col == 'participant_number':
+            out[col] = df[col].astype('int64')
+        else:
+            out[col] = df[col].astype('float64')
+    return out
+
+
+def memory_report():
+    '''Rows, columns and bytes of each table (participant, mental_health, dyads) in the compact
+    layout and as plain object / float64 columns, with the reduction factor'''
+    frames = {name: read_table(name) for name in tables}
+    load_dyads(['participant_number'])
+    frames['dyads'] = _cache['dyads']
+
+    rows = []
+    for name, df in frames.items():
+        compact_bytes = df.memory_usage(deep=True, index=False).sum()
+        plain_bytes = plain(df).memory_usage(deep=True, index=False).sum()
+        rows.append({'table': name, 'rows': len(df), 'columns': df.shape[1],
+                     'compact_kb': compact_bytes / 1024, 'plain_kb': plain_bytes / 1024,
+                     'bytes_per_row': compact_bytes / max(len(df), 1), 'reduction': plain_bytes / max(compact_bytes, 1)})
+    return pd.DataFrame(rows).set_index('table')
+
+
+if __name__ == '__main__':
+    print(memory_report().round(2).to_string())
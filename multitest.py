@@ -0,0 +1,107 @@
+import pandas as pd
+import numpy as np
+
+
+# Multiple-testing corrections for p-value vectors of any length, optionally per family of tests.
+# The p-values are sorted once (by family, then p) and every method is an elementwise scaling of the
+# sorted values followed by a running maximum (step-down: Holm) or a running minimum from the largest
+# p-value down (step-up: Hochberg, Benjamini-Hochberg, Benjamini-Yekutieli, Storey). With families
+# the running min/max restarts at each family, via pandas' grouped cummax/cummin. NaN p-values stay
+# NaN and are not counted in m.
+
+methods = ['none', 'bonf', 'holm', 'hochberg', 'fdr_bh', 'fdr_by', 'qvalue']
+
+
+def _running(values, codes, kind, reverse):
+    '''Cumulative max/min of `values` within each run of equal `codes` (codes sorted), optionally from the end of each run'''
+    if reverse:
+        values, codes = values[::-1], codes[::-1]
+    if codes[0] == codes[-1]:
+        out = (np.maximum if kind == 'max' else np.minimum).accumulate(values)
+    else:
+        series = pd.Series(values).groupby(codes, sort=False)
+        out = (series.cummax() if kind == 'max' else series.cummin()).to_numpy()
+    return out[::-1] if reverse else out
+
+
+def family_codes(p, groups=None):
+    '''Integer family code of every p-value (all 0 without `groups`); a missing label is a family of its own'''
+    if groups is None:
+        return np.zeros(np.shape(p), dtype=np.int64)
+    values = groups if isinstance(groups, pd.MultiIndex) else np.asarray(groups)
+    return pd.factorize(values, use_na_sentinel=False)[0].astype(np.int64)
+
+
+def _pi0(p, codes, k, lam):
+    valid = ~np.isnan(p)
+    m = np.bincount(codes[valid], minlength=k)
+    above = np.bincount(codes[valid], weights=p[valid] > lam, minlength=k)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.minimum(above / (m * (1 - lam)), 1)
+
+
+def pi0(p, lam=0.5, groups=None):
+    '''Storey's estimate of the share of true null hypotheses, #{p > lam} / (m (1 - lam)) capped at 1,
+    for the whole vector or per family (in order of first appearance, as pd.factorize numbers them)'''
+    p = np.asarray(p, dtype=np.float64)
+    codes = family_codes(p, groups)
+    estimate = _pi0(p, codes, codes.max() + 1 if len(codes) else 1, lam)
+    return estimate if groups is not None else estimate[0]
+
+
+def adjust(p, method='holm', groups=None, lam=0.5):
+    '''Adjusted p-values (q-values for the FDR methods) of `p`, within each family given by `groups`.
+
+    method: 'none', 'bonf' (Bonferroni), 'holm', 'hochberg', 'fdr_bh' (Benjamini-Hochberg),
+    'fdr_by' (Benjamini-Yekutieli) or 'qvalue' (Storey's q-values, pi0 estimated at `lam`).
+    `groups` is one label per p-value (e.g. the outcome or the cohort of each test); without it all
+    p-values form one family. Returns an array aligned with `p`.'''
+    if method not in methods:
+        raise ValueError(f'method must be one of {methods}, got {method!r}')
+    p = np.asarray(p, dtype=np.float64)
+    if method == 'none':
+        return p.copy()
+
+    codes = family_codes(p, groups)
+    valid = ~np.isnan(p)
+    if not valid.any():
+        return np.full(p.shape, np.nan)
+    order = np.flatnonzero(valid)[np.lexsort((p[valid], codes[valid]))]
+    ranked, ranked_codes = p[order], codes[order]
+
+    # m of each test's family and its rank i (1..m) within it
+    k = ranked_codes.max() + 1
+    m = np.bincount(ranked_codes, minlength=k)
+    first = np.cumsum(m) - m
+    i = np.arange(1, len(order) + 1) - first[ranked_codes]
+    m_test = m[ranked_codes].astype(np.float64)
+
+    if method == 'bonf':
+        adjusted = ranked * m_test
+    elif method == 'holm':
+        adjusted = _running(ranked * (m_test - i + 1), ranked_codes, 'max', reverse=False)
+    elif method == 'hochberg':
+        adjusted = _running(ranked * (m_test - i + 1), ranked_codes, 'min', reverse=True)
+    else:
+        scaled = ranked * m_test / i
+        if method == 'fdr_by':
+            harmonic = np.cumsum(1 / np.arange(1, m.max() + 1))
+            scaled *= harmonic[m[ranked_codes] - 1]
+        adjusted = _running(scaled, ranked_codes, 'min', reverse=True)
+        if method == 'qvalue':
+            adjusted = _pi0(ranked, ranked_codes, k, lam)[ranked_codes] * np.minimum(adjusted, 1)
+
+    out = np.full(p.shape, np.nan)
+    out[order] = np.minimum(adjusted, 1)
+    return out
+
+
+def add_adjusted(table, p='p', method='holm', by=None, column=None, lam=0.5):
+    '''Copy of a result table with the adjusted p-values of column `p` added as `column`
+    (default p_<method>), within each family of the `by` column(s) when given'''
+    table = table.copy()
+    groups = None
+    if by is not None:
+        groups = pd.MultiIndex.from_frame(table[by]) if isinstance(by, list) else table[by]
+    table[column or f'p_{method}'] = adjust(table[p].to_numpy(dtype=np.float64), method, groups, lam)
+    return table
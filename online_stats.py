@@ -0,0 +1,212 @@
+from collections import Counter, namedtuple
+import pandas as pd
+import numpy as np
+
+from posthoc import _mwu_p
+from association import chi2_tables
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Mergeable accumulators for following the question statistics while responses arrive.
+# Moments are (count, mean, M2) per group, updated and combined with the Welford / Chan formulas.
+# Everything rank-based works from a Counter of distinct (group, value) or (x, y) keys: the wakes, the
+# scale totals and the sleep durations are all discrete, so the ranks of every observation (ties
+# included) follow from the counts per distinct value and Kruskal-Wallis, Mann-Whitney U and Spearman
+# come out exactly as scipy computes them on the raw rows. Adding a dyad is one Counter increment,
+# shards processed separately are merged by adding their Counters, and a statistic costs
+# O(d log d) in the number of distinct values d. For continuous measures, `sketch` rounds values
+# to a fixed resolution first (a histogram sketch, approximate ranks).
+
+OnlineResult = namedtuple('OnlineResult', ['statistic', 'pvalue', 'n'])
+
+
+def sketch(values, resolution):
+    '''Values rounded to multiples of `resolution`, to bound the number of distinct keys'''
+    return np.round(np.asarray(values, dtype=np.float64) / resolution) * resolution
+
+
+def counts(*columns):
+    '''Counter of the distinct tuples of `columns` (equal-length arrays); rows missing any value are skipped'''
+    frame = pd.DataFrame({i: np.asarray(col) for i, col in enumerate(columns)}).dropna()
+    tallies = frame.value_counts(sort=False)
+    return Counter(dict(zip(tallies.index, tallies.to_numpy().tolist())))
+
+
+def moments(values, groups=None):
+    '''{group: (count, mean, M2)} of `values` (one group, None, when `groups` is not given); NaNs are skipped'''
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.full(len(values), None, dtype=object) if groups is None else np.asarray(groups, dtype=object)
+    keep = ~np.isnan(values) & pd.notna(groups)
+    codes, labels = pd.factorize(groups[keep])
+    values = values[keep]
+    n = np.bincount(codes, minlength=len(labels)).astype(np.float64)
+    mean = np.bincount(codes, weights=values, minlength=len(labels)) / np.maximum(n, 1)
+    m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=len(labels))
+    return {label: (n[i], mean[i], m2[i]) for i, label in enumerate(labels)}
+
+
+def merge_moments(a, b):
+    '''Combine two {group: (count, mean, M2)} dicts (Chan et al. parallel update)'''
+    merged = dict(a)
+    for group, (n_b, mean_b, m2_b) in b.items():
+        if group not in merged:
+            merged[group] = (n_b, mean_b, m2_b)
+            continue
+        n_a, mean_a, m2_a = merged[group]
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        merged[group] = (n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n)
+    return merged
+
+
+def describe(moments):
+    '''n, mean, var and std (ddof=1) per group, in group order'''
+    groups = sorted(moments, key=str)
+    n, mean, m2 = (np.array([moments[g][i] for g in groups]) for i in range(3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = m2 / (n - 1)
+    return pd.DataFrame({'n': n.astype(np.int64), 'mean': mean, 'var': var, 'std': np.sqrt(var)}, index=groups)
+
+
+def table(counter):
+    '''(sorted row keys, sorted column keys, count matrix) of a Counter of two-key tuples'''
+    rows = sorted({key[0] for key in counter})
+    cols = sorted({key[1] for key in counter})
+    row_index = {key: i for i, key in enumerate(rows)}
+    col_index = {key: j for j, key in enumerate(cols)}
+    matrix = np.zeros((len(rows), len(cols)))
+    for (a, b), n in counter.items():
+        matrix[row_index[a], col_index[b]] += n
+    return rows, cols, matrix
+
+
+def _midranks(totals):
+    '''Average rank of each distinct value, given the number of observations at each (in sorted order)'''
+    return np.cumsum(totals) - totals + (totals + 1) / 2
+
+
+def kruskal(counter):
+    '''Kruskal-Wallis H across groups from a Counter of (group, value), as scipy.stats.kruskal'''
+    _, _, T = table(counter)
+    if len(T) < 2:
+        return OnlineResult(np.nan, np.nan, int(T.sum()))
+    T = T.T  # distinct values x groups
+    totals = T.sum(axis=1)
+    N, n = totals.sum(), T.sum(axis=0)
+    rank_sums = (T * _midranks(totals)[:, None]).sum(axis=0)
+    H = 12 / (N * (N + 1)) * (rank_sums ** 2 / n).sum() - 3 * (N + 1)
+    H /= 1 - (totals ** 3 - totals).sum() / (N ** 3 - N)
+    return OnlineResult(float(H), float(stats.chi2.sf(H, len(n) - 1)), int(N))
+
+
+def mannwhitneyu(counter, x, y, alternative='two-sided'):
+    '''Mann-Whitney U of group `x` against group `y` from a Counter of (group, value), as
+    scipy.stats.mannwhitneyu with the asymptotic p-value (tie and continuity corrected)'''
+    groups, _, T = table(counter)
+    if x not in groups or y not in groups:
+        # one of the groups has no observations yet (e.g. early in a live stream)
+        n = sum(T[groups.index(g)].sum() for g in (x, y) if g in groups)
+        return OnlineResult(np.nan, np.nan, int(n))
+    a, b = T[groups.index(x)], T[groups.index(y)]
+    U = (a * (np.cumsum(b) - b + 0.5 * b)).sum()
+    pooled = a + b
+    p = _mwu_p(U, a.sum(), b.sum(), (pooled ** 3 - pooled).sum(), alternative)
+    return OnlineResult(float(U), float(p), int(pooled.sum()))
+
+
+def spearman(counter):
+    '''Spearman rho and its two-sided p-value from a Counter of (x, y), as scipy.stats.spearmanr'''
+    _, _, M = table(counter)
+    N = M.sum()
+    rx = _midranks(M.sum(axis=1)) - (N + 1) / 2
+    ry = _midranks(M.sum(axis=0)) - (N + 1) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = (rx @ M @ ry) / np.sqrt((M.sum(axis=1) @ rx ** 2) * (M.sum(axis=0) @ ry ** 2))
+    dof = N - 2
+    with np.errstate(divide='ignore'):
+        t = rho * np.sqrt(max(dof / ((rho + 1) * (1 - rho)), 0))
+    return OnlineResult(float(rho), float(2 * stats.t.sf(abs(t), dof)), int(N))
+
+
+def chi2(counter, correction=True):
+    '''Chi-square test of independence from a Counter of (row, column), as scipy.stats.chi2_contingency'''
+    _, _, M = table(counter)
+    statistic, dof, p, v, n = chi2_tables(M, correction)
+    return OnlineResult(float(statistic), float(p), int(n))
+
+
+# Live dashboard of the question statistics: the state is a dict of Counters and moments, so shards
+# merge with merge_states and a single new dyad is a one-row update
+
+marital_groups = {'Single': 'Unpartnered', 'Separated, divorced or widowed': 'Unpartnered', 'In a relationship': 'Partnered'}
+
+
+def empty_state():
+    return {'wakes_by_method': Counter(), 'wakes_moments': {}, 'epds_wakes': Counter(),
+            'cbts_by_marital': Counter(), 'education_by_method': Counter()}
+
+
+def update(state, dyads):
+    '''Add a batch of dyads (one row or many) to the state. Scale totals are scored from the items
+    when the batch does not carry them.'''
+    if 'epds_total' not in dyads or 'cbts_total' not in dyads:
+        import scoring
+        items = dyads.reindex(columns=[c for spec in scoring.scales.values() for c in spec['items']])
+        dyads = pd.concat([dyads, scoring.score_items(items)[['epds_total', 'cbts_total']]], axis=1)
+    method, wakes = dyads['infant_sleeping_method'], dyads['infant_wakes_per_night']
+    marital = dyads['marital_status'].astype(object).map(marital_groups)
+
+    state['wakes_by_method'] += counts(method, wakes)
+    state['wakes_moments'] = merge_moments(state['wakes_moments'], moments(wakes, method))
+    state['epds_wakes'] += counts(wakes, dyads['epds_total'])
+    state['cbts_by_marital'] += counts(marital, dyads['cbts_total'])
+    state['education_by_method'] += counts(dyads['education'], method)
+    return state
+
+
+def merge_states(a, b):
+    '''State of the union of two shards'''
+    return {name: merge_moments(a[name], b[name]) if name == 'wakes_moments' else a[name] + b[name] for name in a}
+
+
+def dashboard(state):
+    '''Current value of every monitored statistic'''
+    return {
+        'wakes_by_method': kruskal(state['wakes_by_method']),
+        'wakes_by_method_moments': describe(state['wakes_moments']),
+        'epds_vs_wakes': spearman(state['epds_wakes']),
+        'cbts_by_marital': mannwhitneyu(state['cbts_by_marital'], 'Partnered', 'Unpartnered'),
+        'education_by_method': chi2(state['education_by_method'])
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    from loader import load_dyads
+
+    parser = argparse.ArgumentParser(description='Replay the cohort as a stream of arriving dyads and follow the live statistics')
+    parser.add_argument('--batch-size', type=int, default=25, help='dyads per arriving batch')
+    parser.add_argument('--shards', type=int, default=2, help='independent states, merged for each report')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    columns = ['infant_sleeping_method', 'infant_wakes_per_night', 'marital_status', 'education', 'epds_total', 'cbts_total']
+    dyads = load_dyads(columns).sample(frac=1, random_state=args.seed).reset_index(drop=True)
+
+    shards = [empty_state() for _ in range(args.shards)]
+    for i, start in enumerate(range(0, len(dyads), args.batch_size)):
+        shard = shards[i % args.shards]
+        update(shard, dyads.iloc[start:start + args.batch_size])
+
+        merged = shards[0]
+        for other in shards[1:]:
+            merged = merge_states(merged, other)
+        live = dashboard(merged)
+        kw, rho, mwu = live['wakes_by_method'], live['epds_vs_wakes'], live['cbts_by_marital']
+        print(f'{min(start + args.batch_size, len(dyads)):>5} dyads: wakes~method H={kw.statistic:.3f} p={kw.pvalue:.3g} | '
+              f'EPDS~wakes rho={rho.statistic:.3f} p={rho.pvalue:.3g} | CBTS~marital U={mwu.statistic:.1f} p={mwu.pvalue:.3g}')
+
+    print(live['wakes_by_method_moments'].round(3))
+    print(live['education_by_method'])
@@ -0,0 +1,130 @@
+from collections import namedtuple
+from itertools import combinations
+from math import comb
+import numpy as np
+
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Permutation versions of the group comparisons, for groups too small for the asymptotic p-values.
+# The data are ranked (or coded) once; each batch permutes the group labels as a (permutations x n)
+# array and recomputes every permutation's rank sums or contingency table with a single bincount.
+# Monte-Carlo runs stop early once a Clopper-Pearson interval on the p-value lies entirely on one side
+# of alpha; two-sample tests small enough to enumerate are computed exactly.
+
+PermutationResult = namedtuple('PermutationResult', ['statistic', 'pvalue', 'n_permutations', 'exact'])
+
+
+def _batched_sums(weights, labels, k):
+    '''Per-permutation sums of `weights` by label: labels (B x n) -> (B x k)'''
+    B = labels.shape[0]
+    keys = (np.arange(B)[:, None] * k + labels).ravel()
+    return np.bincount(keys, weights=np.broadcast_to(weights, labels.shape).ravel(), minlength=B * k).reshape(B, k)
+
+
+def monte_carlo(statistic, labels, observed, alpha=0.05, max_permutations=100000, batch_size=2000,
+                confidence=0.999, seed=0):
+    '''Monte-Carlo permutation p-value of statistic(permuted labels) >= observed.
+
+    `statistic` maps a (B x n) array of permuted labels to B values. Batches are drawn until
+    max_permutations, or until the (confidence) Clopper-Pearson interval of the exceedance probability
+    excludes alpha. The p-value is (1 + exceedances) / (1 + permutations).'''
+    rng = np.random.default_rng(seed)
+    tolerance = 1e-12 * max(abs(observed), 1)
+    exceed, done = 0, 0
+    while done < max_permutations:
+        size = min(batch_size, max_permutations - done)
+        permuted = rng.permuted(np.broadcast_to(labels, (size, len(labels))), axis=1)
+        exceed += int((statistic(permuted) >= observed - tolerance).sum())
+        done += size
+
+        delta = 1 - confidence
+        low = stats.beta.ppf(delta / 2, exceed, done - exceed + 1) if exceed else 0.0
+        high = stats.beta.ppf(1 - delta / 2, exceed + 1, done - exceed) if exceed < done else 1.0
+        if high < alpha or low > alpha:
+            break
+    return (1 + exceed) / (1 + done), done
+
+
+def kruskal_permutation(*samples, **kwargs):
+    '''Kruskal-Wallis H with a permutation p-value. Keyword arguments go to monte_carlo.'''
+    values = np.concatenate([np.asarray(s, dtype=np.float64) for s in samples])
+    labels = np.repeat(np.arange(len(samples)), [len(s) for s in samples])
+    ranks = stats.rankdata(values)
+    N, counts = len(values), np.bincount(labels).astype(np.float64)
+    _, ties = np.unique(values, return_counts=True)
+    correction = 1 - (ties ** 3 - ties).sum() / (N ** 3 - N)
+
+    def statistic(permuted):
+        rank_sums = _batched_sums(ranks, permuted, len(samples))
+        return (12 / (N * (N + 1)) * (rank_sums ** 2 / counts).sum(axis=1) - 3 * (N + 1)) / correction
+
+    H = statistic(labels[None, :])[0]
+    p, n = monte_carlo(statistic, labels, H, **kwargs)
+    return PermutationResult(H, p, n, False)
+
+
+def mannwhitneyu_permutation(x, y, alternative='two-sided', max_permutations=100000, **kwargs):
+    '''Mann-Whitney U (of x) with a permutation p-value.
+
+    When the number of ways to choose x's positions is at most max_permutations, all of them are
+    enumerated and the p-value is exact; otherwise it is Monte-Carlo (see monte_carlo).'''
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n1, n2 = len(x), len(y)
+    ranks = stats.rankdata(np.concatenate([x, y]))
+    centre = n1 * n2 / 2
+
+    def oriented(U):
+        if alternative == 'greater':
+            return U
+        if alternative == 'less':
+            return -U
+        return np.abs(U - centre)
+
+    U = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    observed = oriented(U)
+
+    small = min(n1, n2)
+    if comb(n1 + n2, small) <= max_permutations:
+        # every split of the pooled ranks; enumerate the smaller group's positions
+        picks = np.array(list(combinations(range(n1 + n2), small)))
+        picked = ranks[picks].sum(axis=1)
+        total = ranks.sum()
+        rank_sum_x = picked if small == n1 else total - picked
+        null = oriented(rank_sum_x - n1 * (n1 + 1) / 2)
+        p = np.mean(null >= observed - 1e-12 * max(abs(observed), 1))
+        return PermutationResult(U, p, len(picks), True)
+
+    labels = np.repeat([1.0, 0.0], [n1, n2])
+
+    def statistic(permuted):
+        return oriented((permuted * ranks).sum(axis=1) - n1 * (n1 + 1) / 2)
+
+    p, n = monte_carlo(statistic, labels, observed, max_permutations=max_permutations, **kwargs)
+    return PermutationResult(U, p, n, False)
+
+
+def chi2_permutation(observed, **kwargs):
+    '''Pearson chi-square of a contingency table with a permutation p-value (margins held fixed).
+
+    The table is expanded to one (row, column) code pair per observation and the column codes are
+    permuted. No continuity correction is applied. Keyword arguments go to monte_carlo.'''
+    table = np.asarray(observed, dtype=np.int64)
+    r, c = table.shape
+    rows = np.repeat(np.arange(r), table.sum(axis=1))
+    cols = np.concatenate([np.repeat(np.arange(c), row) for row in table])
+    n = table.sum()
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)).ravel() / n
+    keep = expected > 0
+
+    def statistic(permuted):
+        B = permuted.shape[0]
+        keys = (np.arange(B)[:, None] * (r * c) + rows * c + permuted).ravel()
+        counts = np.bincount(keys, minlength=B * r * c).reshape(B, r * c)
+        return (((counts - expected) ** 2)[:, keep] / expected[keep]).sum(axis=1)
+
+    chi2 = statistic(cols[None, :])[0]
+    p, n_perm = monte_carlo(statistic, cols, chi2, **kwargs)
+    return PermutationResult(chi2, p, n_perm, False)
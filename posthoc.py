@@ -0,0 +1,135 @@
+from itertools import combinations
+import pandas as pd
+import numpy as np
+
+import multitest
+import rank_index
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Pairwise rank post-hoc tests for a between-subjects factor.
+# The pooled sample is sorted once and summarised as a (tie group x group) count matrix; every pairwise
+# Mann-Whitney U, the tie corrections of each pair and the Dunn z-scores on the pooled ranks are then
+# matrix products and sums over that table instead of one test (and one ranking) per pair.
+
+padjust_methods = ['none', 'bonf', 'holm', 'fdr_bh', 'fdr_by']
+
+
+def adjust_pvalues(p, method='holm'):
+    '''Multiple-comparison correction of a p-value vector (NaNs are kept and excluded), as pingouin.multicomp'''
+    if method not in padjust_methods:
+        raise ValueError(f'padjust must be one of {padjust_methods}, got {method!r}')
+    return multitest.adjust(p, method)
+
+
+def tie_table(values, codes, k, order=None):
+    '''Counts per (tie group of the pooled sorted values, group), with tie groups in ascending value order.
+    `order` is the argsort of `values` when it is already known (e.g. from rank_index.subset_order).'''
+    order = np.argsort(values, kind='stable') if order is None else order
+    sorted_vals = values[order]
+    tie_id = np.concatenate([[0], np.cumsum(sorted_vals[1:] != sorted_vals[:-1])])
+    n_ties = tie_id[-1] + 1 if len(values) else 0
+    return np.bincount(tie_id * k + codes[order], minlength=n_ties * k).reshape(n_ties, k)
+
+
+def _mwu_p(U1, n1, n2, tie_term, alternative):
+    '''Asymptotic Mann-Whitney p-values with tie and continuity correction, as scipy.stats.mannwhitneyu'''
+    U2 = n1 * n2 - U1
+    if alternative == 'greater':
+        U, factor = U1, 1
+    elif alternative == 'less':
+        U, factor = U2, 1
+    else:
+        U, factor = np.maximum(U1, U2), 2
+    n = n1 + n2
+    s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (U - n1 * n2 / 2 - 0.5) / s
+    return np.clip(stats.norm.sf(z) * factor, 0, 1)
+
+
+def pairwise_rank_tests(data, dv, between, alternative='two-sided', padjust='holm', effsize='hedges', test='mwu'):
+    '''Non-parametric pairwise comparisons between all levels of `between`.
+
+    Returns the same table as pingouin.pairwise_tests(data, dv=dv, between=between, parametric=False,
+    padjust=padjust, effsize=effsize): one row per pair (levels in sorted order), with U-val, p-unc,
+    p-corr and the effect size ('hedges', 'cohen' or 'none'), plus the Dunn z-score of each pair on the
+    pooled ranks. With test='dunn', p-unc (and so p-corr) is the Dunn test p-value instead of the
+    Mann-Whitney one.'''
+    if test not in ('mwu', 'dunn'):
+        raise ValueError(f"test must be 'mwu' or 'dunn', got {test!r}")
+    df = data[[dv, between]].dropna()
+    labels = list(df.groupby(between, sort=True, observed=True).groups.keys())
+    if len(labels) < 2:
+        raise ValueError('Columns must have at least two unique values.')
+    k = len(labels)
+    codes = pd.Categorical(df[between], categories=labels).codes.astype(np.int64)
+    values = df[dv].to_numpy(dtype=np.float64)
+
+    T = tie_table(values, codes, k, rank_index.subset_order(df[dv])).astype(np.float64)
+    below = np.cumsum(T, axis=0) - T
+    counts = T.sum(axis=0)
+
+    # U[a, b] = #(a > b) + #(a == b) / 2 over all cross-group pairs, for every (a, b) at once
+    U = T.T @ (below + 0.5 * T)
+
+    ia, ib = map(np.array, zip(*combinations(range(k), 2)))
+    n1, n2 = counts[ia], counts[ib]
+    pair_ties = T[:, ia] + T[:, ib]
+    tie_term = (pair_ties ** 3 - pair_ties).sum(axis=0)
+    U1 = U[ia, ib]
+    p_mwu = _mwu_p(U1, n1, n2, tie_term, alternative)
+
+    # scipy switches to the exact null distribution for small samples without ties
+    exact = ((n1 <= 8) | (n2 <= 8)) & ~(pair_ties > 1).any(axis=0)
+    for j in np.flatnonzero(exact):
+        p_mwu[j] = stats.mannwhitneyu(values[codes == ia[j]], values[codes == ib[j]], alternative=alternative).pvalue
+
+    # Dunn's test on the pooled average ranks
+    total = T.sum(axis=1)
+    pooled_rank = np.cumsum(total) - total + (total + 1) / 2
+    mean_rank = (T * pooled_rank[:, None]).sum(axis=0) / counts
+    N = counts.sum()
+    pooled_tie_term = (total ** 3 - total).sum()
+    sigma = np.sqrt((N * (N + 1) / 12 - pooled_tie_term / (12 * (N - 1))) * (1 / n1 + 1 / n2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dunn_z = (mean_rank[ia] - mean_rank[ib]) / sigma
+    if alternative == 'greater':
+        p_dunn = stats.norm.sf(dunn_z)
+    elif alternative == 'less':
+        p_dunn = stats.norm.cdf(dunn_z)
+    else:
+        p_dunn = 2 * stats.norm.sf(np.abs(dunn_z))
+
+    p_unc = p_mwu if test == 'mwu' else p_dunn
+    table = pd.DataFrame({
+        'Contrast': between,
+        'A': np.array(labels, dtype=object)[ia],
+        'B': np.array(labels, dtype=object)[ib],
+        'Paired': False,
+        'Parametric': False,
+        'U-val': U1,
+        'alternative': alternative,
+        'p-unc': p_unc
+    })
+    # like pingouin, no correction columns for a single pair or padjust='none'
+    if len(table) > 1 and padjust not in (None, 'none'):
+        table['p-corr'] = adjust_pvalues(p_unc, padjust)
+        table['p-adjust'] = padjust
+
+    if effsize != 'none':
+        sums = np.bincount(codes, weights=values, minlength=k)
+        means = sums / counts
+        variances = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=k) / (counts - 1)
+        dof = n1 + n2 - 2
+        d = (means[ia] - means[ib]) / np.sqrt(((n1 - 1) * variances[ia] + (n2 - 1) * variances[ib]) / dof)
+        if effsize == 'hedges':
+            d = d * (1 - 3 / (4 * (n1 + n2) - 9))
+        elif effsize != 'cohen':
+            raise ValueError(f"effsize must be 'hedges', 'cohen' or 'none', got {effsize!r}")
+        table[effsize] = d
+
+    table['dunn-z'] = dunn_z
+    return table
@@ -0,0 +1,234 @@
+import os
+from collections import namedtuple
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import loader
+import scoring
+
+
+# Declarative reads of the ETL outputs and group-wise aggregation kernels.
+# scan() takes the columns, filters and missing-value rule an analysis needs and reads only those
+# columns of the Parquet files that hold them (participant, mental health, scores), with the predicates
+# pushed down to the Arrow reader: row groups are skipped from their statistics and rows are filtered
+# before any pandas object is built. Tables are only joined when a query spans more than one.
+# The group-by kernels work on integer group codes (the categorical codes, combined for several keys):
+# counts and sums are one bincount, medians one lexsort, rank sums one sort of the values.
+
+GroupCodes = namedtuple('GroupCodes', ['codes', 'labels'])
+RankSums = namedtuple('RankSums', ['rank_sums', 'counts', 'tie_term'])
+
+operators = {
+    '==': pc.equal, '=': pc.equal, '!=': pc.not_equal,
+    '<': pc.less, '<=': pc.less_equal, '>': pc.greater, '>=': pc.greater_equal
+}
+
+
+def _table_of(column):
+    '''Which ETL output holds `column`: 'participant', 'mental_health' or 'scores' '''
+    for name, (_, _, dtypes) in loader.tables.items():
+        if column in dtypes and (column != 'participant_number' or name == 'participant'):
+            return name
+    if column in scoring.score_columns():
+        return 'scores'
+    raise KeyError(f'Unknown column: {column}')
+
+
+def predicate(column, op, value):
+    '''Arrow expression for one (column, op, value) filter; op is a comparison, 'in' or 'not in'.
+    As in Arrow, a row whose value is missing never satisfies a filter on that column.'''
+    field = pc.field(column)
+    if op == 'in':
+        expression = field.isin(list(value))
+    elif op == 'not in':
+        expression = ~field.isin(list(value)) & field.is_valid()
+    elif op in operators:
+        expression = operators[op](field, value)
+    else:
+        raise ValueError(f'Unknown filter operator {op!r}')
+    if column == 'infant_nightly_sleep_duration':
+        # the missing duration code is a value in the files; treat it as missing, as load_dyads does
+        expression &= field != loader.MISSING_SLEEP_DURATION
+    return expression
+
+
+def not_missing(column):
+    '''Arrow expression for rows where `column` has a value'''
+    expression = pc.field(column).is_valid()
+    if column == 'infant_nightly_sleep_duration':
+        expression &= pc.field(column) != loader.MISSING_SLEEP_DURATION
+    return expression
+
+
+def _fresh_scores():
+    '''Path of the scores file, recomputed first when it does not match the current data'''
+    key = scoring._cache_key(None, False)
+    if os.path.exists(scoring.SCORES_PATH):
+        metadata = pq.read_schema(scoring.SCORES_PATH).metadata or {}
+        if metadata.get(b'scores_key', b'').decode() == key:
+            return scoring.SCORES_PATH
+    scoring.load_scores()
+    return scoring.SCORES_PATH
+
+
+def _read(name, columns, expression):
+    '''Projected, filtered Arrow table of one ETL output'''
+    if name == 'scores':
+        return pq.read_table(_fresh_scores(), columns=columns, filters=expression)
+    path = loader._source(name)
+    if path.endswith('.parquet'):
+        return pq.read_table(path, columns=columns, filters=expression)
+    table = pa.Table.from_pandas(loader.read_table(name)[columns], preserve_index=False)
+    return table if expression is None else table.filter(expression)
+
+
+def scan(columns, where=None, dropna=False, compact=False):
+    '''Rows of the dyad data with `columns`, read column- and predicate-wise from the ETL outputs.
+
+    `where` is a list of (column, op, value) filters, all of which must hold (e.g.
+    [('infant_sleeping_method', 'in', ['While being fed', 'While being held']), ('age', '>=', 30)]).
+    `dropna` drops rows missing any of `columns` (True) or of the listed columns. Values come as
+    load_dyads(columns) gives them: categoricals, float64 measures and items (their Parquet types with
+    `compact`), the missing sleep duration code as NaN, rows in participant order and indexed by
+    their row in load_dyads().'''
+    columns = list(columns)
+    where = list(where or [])
+    required = columns if dropna is True else list(dropna or [])
+
+    needed = {'participant': ['participant_number']}
+    for column in columns:
+        projection = needed.setdefault(_table_of(column), ['participant_number'])
+        if column not in projection:
+            projection.append(column)
+
+    expressions = {}
+    conditions = [(column, predicate(column, op, value)) for column, op, value in where]
+    conditions += [(column, not_missing(column)) for column in required]
+    for column, condition in conditions:
+        name = _table_of(column)
+        needed.setdefault(name, ['participant_number'])
+        expressions[name] = condition if name not in expressions else expressions[name] & condition
+
+    frame = None
+    for name in ['participant', 'mental_health', 'scores']:
+        if name not in needed:
+            continue
+        part = _read(name, needed[name], expressions.get(name)).to_pandas()
+        if frame is None:
+            frame = part
+        else:
+            # a filtered table restricts the dyads, an unfiltered one only adds columns
+            frame = frame.merge(part, on='participant_number', how='inner' if name in expressions else 'left')
+
+    # index rows by their position in the dyad frame, as load_dyads(columns) followed by filtering does
+    dyad_ids = _read('participant', ['participant_number'], None).column('participant_number').to_numpy()
+    frame.index = pd.Index(dyad_ids).get_indexer(frame['participant_number'])
+
+    if 'infant_nightly_sleep_duration' in frame:
+        frame['infant_nightly_sleep_duration'] = frame['infant_nightly_sleep_duration'].replace(loader.MISSING_SLEEP_DURATION, np.nan)
+    frame = frame[columns].copy()
+    return frame if compact else loader.widen(frame)
+
+
+# Group-by kernels on integer codes
+
+def group_codes(frame, by, observed=True):
+    '''Integer group code of every row (-1 when a key is missing) and the group labels, for one key
+    column or a list of them. Categorical keys use their codes; other keys are factorized (sorted).'''
+    keys = [by] if isinstance(by, str) else list(by)
+    codes = np.zeros(len(frame), dtype=np.int64)
+    missing = np.zeros(len(frame), dtype=bool)
+    levels = []
+    for key in keys:
+        values = frame[key]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            key_codes, labels = values.cat.codes.to_numpy().astype(np.int64), values.cat.categories
+        else:
+            key_codes, labels = pd.factorize(values, sort=True)
+        missing |= key_codes < 0
+        codes = codes * len(labels) + key_codes
+        levels.append(labels)
+    codes[missing] = -1
+
+    labels = levels[0] if len(keys) == 1 else pd.MultiIndex.from_product(levels, names=keys)
+    if not observed:
+        return GroupCodes(codes, pd.Index(labels, name=keys[0]) if len(keys) == 1 else labels)
+    present = np.flatnonzero(np.bincount(codes[~missing], minlength=len(labels)))
+    remap = np.full(len(labels), -1, dtype=np.int64)
+    remap[present] = np.arange(len(present))
+    codes = np.where(missing, -1, remap[np.maximum(codes, 0)])
+    labels = labels[present]
+    return GroupCodes(codes, pd.Index(labels, name=keys[0]) if len(keys) == 1 else labels)
+
+
+def _valid(codes, values):
+    keep = codes >= 0
+    if values is not None:
+        keep &= ~np.isnan(values)
+    return keep
+
+
+def group_counts(codes, n_groups, values=None):
+    '''Rows per group (non-missing values only when `values` is given)'''
+    keep = _valid(codes, values)
+    return np.bincount(codes[keep], minlength=n_groups)
+
+
+def group_sums(codes, values, n_groups):
+    keep = _valid(codes, values)
+    return np.bincount(codes[keep], weights=values[keep], minlength=n_groups)
+
+
+def group_means(codes, values, n_groups):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return group_sums(codes, values, n_groups) / group_counts(codes, n_groups, values)
+
+
+def group_medians(codes, values, n_groups):
+    '''Median per group from one sort of (group, value); NaN for empty groups'''
+    keep = _valid(codes, values)
+    codes, values = codes[keep], values[keep]
+    order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(n_groups, np.nan)
+    has = counts > 0
+    low = starts[has] + (counts[has] - 1) // 2
+    high = starts[has] + counts[has] // 2
+    medians[has] = (values[low] + values[high]) / 2
+    return medians
+
+
+def group_rank_sums(codes, values, n_groups):
+    '''Sum of the midranks (ranks over all grouped rows, ties averaged) per group, the group sizes
+    and the tie term sum(t^3 - t), which is all Kruskal-Wallis and Mann-Whitney U need'''
+    keep = _valid(codes, values)
+    codes, values = codes[keep], values[keep]
+    _, inverse, ties = np.unique(values, return_inverse=True, return_counts=True)
+    midranks = np.cumsum(ties) - (ties - 1) / 2
+    rank_sums = np.bincount(codes, weights=midranks[inverse], minlength=n_groups)
+    ties = ties.astype(np.float64)
+    return RankSums(rank_sums, np.bincount(codes, minlength=n_groups), float((ties ** 3 - ties).sum()))
+
+
+aggregations = {
+    'count': lambda codes, values, k: group_counts(codes, k, values),
+    'sum': group_sums,
+    'mean': group_means,
+    'median': group_medians,
+    'rank_sum': lambda codes, values, k: group_rank_sums(codes, values, k).rank_sums,
+    'mean_rank': lambda codes, values, k: group_rank_sums(codes, values, k).rank_sums / np.maximum(group_counts(codes, k, values), 1)
+}
+
+
+def aggregate(frame, value, by, aggs=('count', 'median'), observed=True):
+    '''Group-wise aggregates of column `value` by the `by` column(s), one column per entry of `aggs`
+    (count, sum, mean, median, rank_sum, mean_rank), one row per group'''
+    groups = group_codes(frame, by, observed)
+    values = frame[value].to_numpy(dtype=np.float64, na_value=np.nan)
+    k = len(groups.labels)
+    return pd.DataFrame({agg: aggregations[agg](groups.codes, values, k) for agg in aggs}, index=groups.labels)
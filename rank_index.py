@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+import pandas as pd
+import numpy as np
+
+import loader
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Rank index of the numeric dyad columns and scale scores, built once per dataset version.
+# For each column the argsort (NaNs last), the average ranks and the size of each row's tie group are
+# computed once and saved under CACHE_DIR with the version of the data they were built from (the
+# hashes of the ETL outputs and of the scoring rules). A test on a subset of the rows, e.g. one group
+# per level of a factor after dropping missing values, then gets its order by filtering the stored
+# argsort to the rows it uses: a gather instead of a sort, and ranks and tie terms follow in one
+# linear pass. Inputs are recognised as Series taken from load_dyads / query.scan, whose index is the
+# dyad row; anything else (or values that differ from the indexed column) falls back to sorting.
+
+CACHE_DIR = os.path.join('CSV_files', '.rank_index')
+
+ColumnRanks = namedtuple('ColumnRanks', ['values', 'order', 'ranks', 'ties'])
+KruskalResult = namedtuple('KruskalResult', ['statistic', 'pvalue'])
+MannwhitneyuResult = namedtuple('MannwhitneyuResult', ['statistic', 'pvalue'])
+
+_cache = {}
+
+
+def version():
+    '''Hash of the ETL outputs and of the default scoring rules the scores are computed with'''
+    import scoring
+    sources = [loader.file_fingerprint(loader._source(name)) for name in loader.tables]
+    return hashlib.sha1(json.dumps([sources, scoring._cache_key(None, False)]).encode()).hexdigest()
+
+
+def build(values):
+    '''ColumnRanks of one column: argsort with NaNs last, average ranks (NaN for missing values) and
+    the size of every row's tie group (0 for missing values)'''
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind='stable').astype(np.int32)
+    sorted_vals = values[order]
+    n_valid = int((~np.isnan(values)).sum())
+
+    new_group = np.ones(n_valid, dtype=bool)
+    new_group[1:] = sorted_vals[1:n_valid] != sorted_vals[:n_valid - 1]
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, n_valid))
+
+    ranks = np.full(len(values), np.nan)
+    ties = np.zeros(len(values), dtype=np.int32)
+    ranks[order[:n_valid]] = np.repeat(starts + (sizes + 1) / 2, sizes)
+    ties[order[:n_valid]] = np.repeat(sizes, sizes)
+    return ColumnRanks(values, order, ranks, ties)
+
+
+def indexed_columns():
+    '''Columns the index covers: the numeric dyad columns and the scale scores'''
+    import scoring
+    numeric = [c for name in loader.tables for c, t in loader.tables[name][2].items()
+               if c != 'participant_number' and not isinstance(t, pd.CategoricalDtype)]
+    return numeric + scoring.score_columns()
+
+
+def column_ranks(column):
+    '''ColumnRanks of `column` for the current data: from memory, from CACHE_DIR, or built and saved there'''
+    current = version()
+    known = _cache.get(column)
+    if known is not None and known[0] == current:
+        return known[1]
+
+    path = os.path.join(CACHE_DIR, f'{column}.npz')
+    index = None
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if str(stored['version']) == current:
+                index = ColumnRanks(*(stored[name] for name in ColumnRanks._fields))
+    if index is None:
+        index = build(loader.load_dyads([column])[column])
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # unique per process; np.savez keeps the name as is since it already ends with .npz
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp.npz')
+        os.close(fd)
+        np.savez(tmp, version=current, **index._asdict())
+        os.replace(tmp, path)
+    _cache[column] = (current, index)
+    return index
+
+
+def rows(series):
+    '''Dyad rows of a Series taken from the dyad data (its index), or None when the Series cannot be
+    matched to the rank index: another column, a reordered/relabelled index or changed values'''
+    if series.name not in indexed_columns() or not pd.api.types.is_integer_dtype(series.index):
+        return None
+    try:
+        index = column_ranks(series.name)
+    except FileNotFoundError:  # no ETL outputs to index
+        return None
+    positions = series.index.to_numpy()
+    if len(positions) and (positions.min() < 0 or positions.max() >= len(index.values)):
+        return None
+    if not series.index.is_unique:
+        return None
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if not np.array_equal(index.values[positions], values, equal_nan=True):
+        return None
+    return positions
+
+
+def subset_order(series):
+    '''Argsort of the Series' values (NaNs last) from the stored argsort of its column, or None.
+    Equal values keep their dyad-row order, so the result is np.argsort(kind='stable') when the index is sorted.'''
+    positions = rows(series)
+    if positions is None:
+        return None
+    index = column_ranks(series.name)
+    selected = np.zeros(len(index.values), dtype=bool)
+    selected[positions] = True
+    local = np.empty(len(index.values), dtype=np.int64)
+    local[positions] = np.arange(len(positions))
+    return local[index.order[selected[index.order]]]
+
+
+def tie_bounds(sorted_vals):
+    '''For each position of sorted values, the start and end (exclusive) of its tie group'''
+    n = len(sorted_vals)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = sorted_vals[1:] != sorted_vals[:-1]
+    positions = np.arange(n, dtype=np.int32)
+    start = np.maximum.accumulate(np.where(new_group, positions, 0))
+    next_start = np.full(n, n, dtype=np.int32)
+    next_start[:-1] = np.where(new_group[1:], positions[1:], n)
+    end = np.minimum.accumulate(next_start[::-1])[::-1]
+    return start, np.ascontiguousarray(end)
+
+
+def ranks(values, order=None):
+    '''Average ranks of `values` (no missing values) and the tie term sum(t^3 - t), given their argsort
+    (e.g. from subset_order) or sorting them when `order` is None'''
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind='stable') if order is None else order
+    start, end = tie_bounds(values[order])
+    out = np.empty(len(values))
+    out[order] = (start + end + 1) / 2
+    ties = (end - start).astype(np.float64)
+    return out, float((ties ** 2 - 1).sum())  # a tie group of size t has t positions, each adding t^2 - 1
+
+
+def _pooled_ranks(samples):
+    '''Ranks of the concatenated samples and their tie term, from the index when every sample is an
+    indexed Series of the same column over distinct rows; None otherwise'''
+    if not all(isinstance(s, pd.Series) for s in samples) or len({s.name for s in samples}) != 1:
+        return None
+    pooled = pd.concat(samples)
+    if pooled.isna().any():
+        return None
+    order = subset_order(pooled)
+    return None if order is None else ranks(pooled.to_numpy(dtype=np.float64), order)
+
+
+# Tests taking their ranks from the index, with the results (and fallbacks) of scipy's
+
+def kruskal(*samples, **params):
+    '''scipy.stats.kruskal, ranking indexed Series through the rank index'''
+    pooled = None if params else _pooled_ranks(samples)
+    if pooled is None:
+        return stats.kruskal(*samples, **params)
+    rank, tie_term = pooled
+    n = np.array([len(s) for s in samples], dtype=np.float64)
+    if len(n) < 2 or (n == 0).any():
+        return stats.kruskal(*samples)
+    N = n.sum()
+    rank_sums = np.add.reduceat(rank, np.concatenate([[0], np.cumsum(n)[:-1]]).astype(np.intp))
+    H = 12 / (N * (N + 1)) * (rank_sums ** 2 / n).sum() - 3 * (N + 1)
+    H /= 1 - tie_term / (N ** 3 - N)
+    return KruskalResult(H, stats.chi2.sf(H, len(n) - 1))
+
+
+def mannwhitneyu(x, y, alternative='two-sided', **params):
+    '''scipy.stats.mannwhitneyu, ranking indexed Series through the rank index (asymptotic method only;
+    small samples without ties, where scipy uses the exact distribution, go to scipy)'''
+    from posthoc import _mwu_p
+    pooled = None if params else _pooled_ranks([x, y])
+    if pooled is None:
+        return stats.mannwhitneyu(x, y, alternative=alternative, **params)
+    rank, tie_term = pooled
+    n1, n2 = len(x), len(y)
+    if min(n1, n2) <= 8 and tie_term == 0 or min(n1, n2) == 0:
+        return stats.mannwhitneyu(x, y, alternative=alternative)
+    U1 = rank[:n1].sum() - n1 * (n1 + 1) / 2
+    return MannwhitneyuResult(U1, np.float64(_mwu_p(U1, n1, n2, tie_term, alternative)))
+
+
+def frame_sort_index(frame):
+    '''(order, start, end) of every column of `frame` as correlation.sort_index computes them, from the
+    rank index when every column is an indexed dyad column; None otherwise'''
+    orders = [subset_order(frame[c]) for c in frame.columns]
+    if not orders or any(o is None for o in orders):
+        return None
+    values = frame.to_numpy(dtype=np.float64, na_value=np.nan).T
+    bounds = [tie_bounds(v[o]) for v, o in zip(values, orders)]
+    return (np.array(orders, dtype=np.int32), np.array([b[0] for b in bounds], dtype=np.int32),
+            np.array([b[1] for b in bounds], dtype=np.int32))
@@ -0,0 +1,132 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import runpy
+from concurrent.futures import ProcessPoolExecutor
+
+import loader
+import rank_index
+import scoring
+
+
+# Headless regeneration of the figures in Assets/.
+# Each analysis script runs under the Agg backend with plt.show() replaced by a save to the next file
+# name listed for that script below. Scripts run in a process pool, and a script is skipped when its
+# source, the shared helper modules and the input data all hash the same as at its last render.
+
+ASSETS_DIR = 'Assets'
+MANIFEST_PATH = os.path.join(ASSETS_DIR, 'figures.json')
+
+# figure files in the order the script calls plt.show()
+figures = {
+    'Q1.py': ['Q1_figure.png'],
+    'Q2.py': ['Q2_figure1.png', 'Q2_figure2.png'],
+    'Q3.py': ['Q3_figure.png'],
+    'Q4.py': ['Q4_figure.png'],
+    'Q5.py': ['Q5_figure.png'],
+    'Q6.py': ['Q6_figure.png'],
+    'Q7.py': ['Q7_figure.png'],
+    'Q8.py': ['Q8_figure.png'],
+    'Q9.py': ['Q9_figure.png'],
+    'Q10.py': ['Q10_figure.png'],
+    'Q11.py': ['Q11_figure.png'],
+    'Q12.py': ['Q12_figure.png'],
+    'K-means clustering.py': ['Kmeans_clustering_figure1.png', 'Kmeans_clustering_figure2.png']
+}
+
+# modules the scripts import from this repo; a change to any of them re-renders everything
+helper_modules = ['ETL.py', 'loader.py', 'query.py', 'scoring.py', 'correlation.py', 'clustering.py', 'stats_cache.py', 'rank_index.py', 'posthoc.py', 'bootstrap.py', 'permutation.py', 'multitest.py', 'lazy_imports.py']
+
+
+def _sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
+
+
+def figure_key(script):
+    '''Hash of a script's code, the helper modules and the data files it reads'''
+    parts = [_sha1(script), *[_sha1(m) for m in helper_modules]]
+    parts += [loader.file_fingerprint(loader._source(name)) for name in loader.tables]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def render_script(script, dpi=100):
+    '''Run one analysis script headless, saving each figure it shows. Returns the written paths.'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    names = iter(figures[script])
+    written = []
+
+    def save(*args, **kwargs):
+        path = os.path.join(ASSETS_DIR, next(names))
+        plt.gcf().savefig(path, dpi=dpi)
+        plt.close('all')
+        written.append(path)
+
+    plt.show = save
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        runpy.run_path(script, run_name='__main__')
+    plt.close('all')
+
+    if len(written) != len(figures[script]):
+        raise RuntimeError(f'{script} showed {len(written)} figures, expected {len(figures[script])}')
+    return written
+
+
+def _load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    return {}
+
+
+def render_all(scripts=None, force=False, processes=None):
+    '''Render the figures of `scripts` (default: all) in parallel, skipping unchanged ones.
+
+    Returns (rendered, skipped) lists of script names.'''
+    scripts = scripts or list(figures)
+    manifest = _load_manifest()
+    keys = {script: figure_key(script) for script in scripts}
+
+    def up_to_date(script):
+        return (manifest.get(script) == keys[script]
+                and all(os.path.exists(os.path.join(ASSETS_DIR, name)) for name in figures[script]))
+
+    todo = [s for s in scripts if force or not up_to_date(s)]
+    skipped = [s for s in scripts if s not in todo]
+
+    if todo:
+        # fill the shared on-disk caches here first, so the workers only read them
+        scoring.load_scores()
+        for column in rank_index.indexed_columns():
+            rank_index.column_ranks(column)
+
+        # every script is independent, so one task per script; spawn gives each a clean pyplot state
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        try:
+            with ProcessPoolExecutor(min(processes or os.cpu_count() or 1, len(todo)), mp_context=context) as pool:
+                for script, _ in zip(todo, pool.map(render_script, todo)):
+                    manifest[script] = keys[script]
+        finally:
+            # record whatever finished, so a failing script does not force the others to re-render
+            with open(MANIFEST_PATH, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return todo, skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the figures in Assets/ without opening windows')
+    parser.add_argument('scripts', nargs='*', help='scripts to render (default: all)')
+    parser.add_argument('--force', action='store_true', help='render even if nothing changed')
+    parser.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    rendered, skipped = render_all(args.scripts, args.force, args.processes)
+    print(f'Rendered {len(rendered)} script(s): {", ".join(rendered) or "-"}')
+    print(f'Up to date: {len(skipped)} script(s)')
@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import numpy as np
+
+import ETL
+import loader
+import scoring
+import strata
+from correlation import SpearmanResult, correlation_table
+from bootstrap import BootstrapResult
+from permutation import PermutationResult
+from lazy_imports import preload
+
+
+# Single entry point for the whole analysis.
+# ETL -> load -> scoring -> questions is a dependency graph: the shared stages run in this process and
+# keep their frames in memory, then the questions run in a process pool. Workers are forked after the
+# last shared stage, so they start with the loaded dyads and scores instead of re-reading them.
+
+RESULTS_PATH = 'results.json'
+STRATIFIED_RESULTS_PATH = 'results_stratified.json'
+
+# question -> (script, stage it needs, script variables holding its statistics)
+questions = {
+    'Q1': ('Q1.py', 'load', ['sleep_H', 'sleep_p_kw', 'sleep_eps2', 'sleep_eps2_ci', 'sleep_posthoc']),
+    'Q2': ('Q2.py', 'scoring', ['marital_U', 'marital_p', 'marital_r', 'marital_r_ci', 'marital_perm']),
+    'Q3': ('Q3.py', 'load', ['age_H', 'age_p_kw', 'age_eps2', 'age_eps2_ci', 'age_perm']),
+    'Q4': ('Q4.py', 'load', ['sleepdur_H', 'sleepdur_p_kw', 'sleepdur_eps2', 'sleepdur_eps2_ci', 'sleepdur_posthoc']),
+    'Q5': ('Q5.py', 'scoring', ['gi_corr_df']),
+    'Q6': ('Q6.py', 'load', ['chi2', 'p', 'dof', 'cramers_v', 'cramers_v_boot', 'chi2_perm', 'contingency']),
+    'Q7': ('Q7.py', 'load', ['U', 'p', 'r', 'r_ci', 'perm']),
+    'Q8': ('Q8.py', 'scoring', ['corr_df']),
+    'Q9': ('Q9.py', 'scoring', ['agepp_corr']),
+    'Q10': ('Q10.py', 'scoring', ['nw_corr']),
+    'Q11': ('Q11.py', 'scoring', ['U', 'p', 'r_rb', 'r_rb_ci']),
+    'Q12': ('Q12.py', 'scoring', ['mh_corr']),
+    'clustering': ('K-means clustering.py', 'load', ['inertias', 'sils', 'optimal_k', 'cluster_summary'])
+}
+
+
+def run_etl_stage(raw_path):
+    '''Rebuild the ETL outputs when the raw export is present, otherwise use the existing files'''
+    if raw_path and os.path.exists(raw_path):
+        ETL.run_etl(raw_path)
+    elif not os.path.exists(ETL.PARTICIPANT_PATH):
+        raise FileNotFoundError(f'Neither {raw_path} nor {ETL.PARTICIPANT_PATH} exists')
+
+
+def graph(names, raw_path=None):
+    '''name -> (dependencies, callable, runs_in_pool) for the stages and the selected questions'''
+    nodes = {
+        'etl': ([], lambda: run_etl_stage(raw_path), False),
+        'load': (['etl'], lambda: loader.load_dyads(compact=True), False),
+        'scoring': (['load'], scoring.load_scores, False)
+    }
+    for name in names:
+        nodes[name] = ([questions[name][1]], name, True)
+    return nodes
+
+
+def to_json(value):
+    '''Statistics as JSON-ready values: numbers, lists and records'''
+    if isinstance(value, BootstrapResult):
+        return {name: to_json(getattr(value, name)) for name in ['estimate', 'low', 'high', 'se']}
+    if isinstance(value, PermutationResult):
+        return {name: to_json(getattr(value, name)) for name in value._fields}
+    if isinstance(value, SpearmanResult):
+        return to_json(correlation_table(value))
+    if isinstance(value, pd.DataFrame):
+        value = value.copy()
+        if isinstance(value.columns, pd.MultiIndex):
+            value.columns = ['_'.join(map(str, c)) for c in value.columns]
+        if not isinstance(value.index, pd.RangeIndex):
+            value = value.reset_index()
+        return [{str(k): to_json(v) for k, v in row.items()} for row in value.to_dict('records')]
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_json(v) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return str(value)
+
+
+def run_question(name):
+    '''Run one analysis script headless and return its statistics, printed output and run time'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.show = lambda *args, **kwargs: plt.close('all')
+
+    script, _, result_names = questions[name]
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        namespace = runpy.run_path(script, run_name='__main__')
+    plt.close('all')
+
+    return {
+        'script': script,
+        'seconds': round(time.perf_counter() - start, 3),
+        'statistics': {var: to_json(namespace[var]) for var in result_names},
+        'output': output.getvalue()
+    }
+
+
+def run(names=None, processes=None, raw_path=None, results_path=RESULTS_PATH):
+    '''Execute the graph for the selected questions (default: all) and write the results file'''
+    names = names or list(questions)
+    nodes = graph(names, raw_path)
+    start = time.perf_counter()
+    done, running, results, timings = set(), {}, {}, {}
+
+    # fork keeps the frames loaded by the stages; elsewhere workers reload them from the Parquet files
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    if context.get_start_method() == 'fork':
+        # every question plots and tests: import those libraries once here instead of in each worker
+        preload(['matplotlib.pyplot', 'seaborn', 'scipy.stats'])
+
+    with ProcessPoolExecutor(min(processes or os.cpu_count() or 1, len(names)), mp_context=context) as pool:
+        while len(done) < len(nodes):
+            ready = [n for n, (deps, _, _) in nodes.items()
+                     if n not in done and n not in running.values() and all(d in done for d in deps)]
+            stages = [n for n in ready if not nodes[n][2]]
+            if stages:
+                # shared stages run here, before the first submit forks the workers, so every worker
+                # starts with the dyads and the scores in memory
+                stage_start = time.perf_counter()
+                nodes[stages[0]][1]()
+                timings[stages[0]] = round(time.perf_counter() - stage_start, 3)
+                done.add(stages[0])
+                continue
+
+            for name in ready:
+                running[pool.submit(run_question, nodes[name][1])] = name
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = future.result()
+                done.add(name)
+
+    report = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'stages': timings,
+        'questions': {name: results[name] for name in names}
+    }
+    with open(results_path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def run_stratified(names=None, by=strata.default_by, processes=None, raw_path=None, results_path=STRATIFIED_RESULTS_PATH):
+    '''Stratified mode: the tests of the selected questions within every stratum of `by` and combined
+    across strata (strata.analyse), written to the results file'''
+    start = time.perf_counter()
+    run_etl_stage(raw_path)
+    names = names or list(strata.tests)
+    results = strata.run(names, by, processes)
+    report = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'by': list(by),
+        'skipped': [name for name in names if name not in results],
+        'questions': {name: {'strata': to_json(result.strata), 'combined': to_json(result.combined)}
+                      for name, result in results.items()}
+    }
+    with open(results_path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ETL, scoring and every analysis question')
+    parser.add_argument('questions', nargs='*', help=f'questions to run (default: all of {", ".join(questions)})')
+    parser.add_argument('--raw', default=None, help=f'raw export to run the ETL on first (e.g. {ETL.RAW_PATH})')
+    parser.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--results', default=None, help=f'structured results file (default: {RESULTS_PATH}, {STRATIFIED_RESULTS_PATH} with --stratify)')
+    parser.add_argument('--stratify', nargs='*', metavar='COLUMN',
+                        help=f'run the questions per stratum of these columns and combine the strata (default columns: {" ".join(strata.default_by)})')
+    args = parser.parse_args()
+    unknown = [q for q in args.questions if q not in (questions if args.stratify is None else strata.tests)]
+    if unknown:
+        parser.error(f'unknown questions: {unknown}')
+
+    if args.stratify is not None:
+        report = run_stratified(args.questions, args.stratify or strata.default_by, args.processes, args.raw,
+                                args.results or STRATIFIED_RESULTS_PATH)
+        for name in report['skipped']:
+            print(f'{name:<12} skipped, its test uses a stratifier')
+        for name, result in report['questions'].items():
+            print(f'\n{name}')
+            print(pd.DataFrame(result['combined']).to_string(index=False))
+        print(f'Total {report["seconds"]:.2f}s -> {args.results or STRATIFIED_RESULTS_PATH}')
+    else:
+        report = run(args.questions, args.processes, args.raw, args.results or RESULTS_PATH)
+        for name, result in report['questions'].items():
+            print(f'{name:<12} {result["seconds"]:>7.2f}s')
+        print(f'Total {report["seconds"]:.2f}s -> {args.results or RESULTS_PATH}')
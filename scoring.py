@@ -0,0 +1,172 @@
+import hashlib
+import os
+import json
+import tempfile
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import loader
+
+
+SCORES_PATH = 'CSV_files/scores.parquet'
+
+# Scale definitions. Item lists follow the columns kept by the ETL; subscales follow the scoring
+# guides linked at the bottom of ETL.py (CBTS DSM-5 clusters, EPDS-3A anxiety items, HADS anxiety items).
+
+scales = {
+    'cbts': {
+        'items': [f'cbts_{i}' for i in range(3, 23)],
+        'score': 'total',
+        'subscales': {
+            'reexperiencing': [f'cbts_{i}' for i in range(3, 8)],
+            'avoidance': ['cbts_8', 'cbts_9'],
+            'negative_mood': [f'cbts_{i}' for i in range(10, 17)],
+            'hyperarousal': [f'cbts_{i}' for i in range(17, 23)]
+        }
+    },
+    'epds': {
+        'items': [f'epds_{i}' for i in range(1, 11)],
+        'score': 'total',
+        'subscales': {
+            'anxiety': ['epds_3', 'epds_4', 'epds_5']
+        }
+    },
+    'hads': {
+        'items': ['hads_1', 'hads_3', 'hads_5', 'hads_7', 'hads_9', 'hads_11', 'hads_13'],
+        'score': 'total',
+        'subscales': {
+            'anxiety': ['hads_1', 'hads_3', 'hads_5', 'hads_7', 'hads_9', 'hads_11', 'hads_13']
+        }
+    },
+    'ibq': {
+        'items': ['ibq_3', 'ibq_4', 'ibq_9', 'ibq_10', 'ibq_16', 'ibq_17', 'ibq_28', 'ibq_29', 'ibq_32', 'ibq_33'],
+        'score': 'mean',
+        'subscales': {}
+    }
+}
+
+# On the paper EPDS these items are printed from 3 down to 0. The ETL keeps the codes as exported,
+# so only reverse them when the export stores response positions instead of item scores.
+epds_reversed_items = ['epds_3', 'epds_5', 'epds_6', 'epds_7', 'epds_8', 'epds_9', 'epds_10']
+
+# Minimum share of answered items for a score to be computed; below it the score is NaN.
+# The IBQ-R mean is taken over whatever items were answered, as in the analysis scripts.
+default_min_answered = {
+    'cbts': 0.8,
+    'epds': 0.8,
+    'hads': 0.8,
+    'ibq': 0.0
+}
+
+_cache = {}
+_code = {}
+
+
+def score_columns():
+    '''Names of every column score_items produces'''
+    cols = []
+    for scale, spec in scales.items():
+        cols += [f'{scale}_{spec["score"]}', f'{scale}_prorated', f'{scale}_n_answered']
+        cols += [f'{scale}_{sub}' for sub in spec['subscales']]
+    return cols
+
+
+def _outputs():
+    '''(name, scale, items, kind) for every score, scale-level first'''
+    out = []
+    for scale, spec in scales.items():
+        out.append((f'{scale}_{spec["score"]}', scale, spec['items'], spec['score']))
+        out += [(f'{scale}_{sub}', scale, items, spec['score']) for sub, items in spec['subscales'].items()]
+    return out
+
+
+def score_items(items_df, min_answered=None, reverse_epds=False):
+    '''Compute all scale scores from a frame of item columns in one pass.
+
+    The items are laid out as one contiguous float matrix and every score (totals, means and
+    subscales) is a column of a 0/1 item-membership matrix, so sums and answered-item counts for
+    all scores come out of two matrix products. Rows with too few answered items (see
+    default_min_answered) get NaN instead of a partial sum; `<scale>_prorated` rescales the
+    answered items to the full item count.'''
+    rules = {**default_min_answered, **(min_answered or {})}
+    item_cols = [c for spec in scales.values() for c in spec['items']]
+    position = {c: i for i, c in enumerate(item_cols)}
+
+    X = np.ascontiguousarray(items_df[item_cols].to_numpy(dtype='float64'))
+    if reverse_epds:
+        low, high = loader.item_ranges['epds_']
+        rev = [position[c] for c in epds_reversed_items]
+        X[:, rev] = (low + high) - X[:, rev]
+
+    answered = ~np.isnan(X)
+    X[~answered] = 0.0
+
+    outputs = _outputs()
+    membership = np.zeros((len(item_cols), len(outputs)))
+    for j, (_, _, items, _) in enumerate(outputs):
+        membership[[position[c] for c in items], j] = 1.0
+
+    sums = X @ membership
+    counts = answered.astype('float64') @ membership
+    n_items = membership.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    enough = counts >= np.array([max(rules[scale] * len(items), 1) for _, scale, items, _ in outputs])
+
+    scores = {}
+    for j, (name, scale, items, kind) in enumerate(outputs):
+        value = means[:, j] if kind == 'mean' else sums[:, j]
+        scores[name] = np.where(enough[:, j], value, np.nan)
+        if name == f'{scale}_{scales[scale]["score"]}':
+            scores[f'{scale}_prorated'] = np.where(enough[:, j], means[:, j] * n_items[j], np.nan)
+            scores[f'{scale}_n_answered'] = counts[:, j]
+
+    return pd.DataFrame(scores, index=items_df.index)[score_columns()]
+
+
+def _code_hash():
+    '''Hash of this file, so scores computed by older scoring code are not reused'''
+    if 'code' not in _code:
+        with open(__file__, 'rb') as f:
+            _code['code'] = hashlib.sha1(f.read()).hexdigest()
+    return _code['code']
+
+
+def _cache_key(min_answered, reverse_epds):
+    sources = [loader.file_fingerprint(loader._source(name)) for name in loader.tables]
+    rules = {**default_min_answered, **(min_answered or {})}
+    return json.dumps({'sources': sources, 'rules': rules, 'reverse_epds': reverse_epds, 'scales': scales,
+                       'code': _code_hash()}, sort_keys=True)
+
+
+def load_scores(min_answered=None, reverse_epds=False):
+    '''Scale scores per participant, read from CSV_files/scores.parquet when it matches the current data.
+
+    The file carries the hash of the ETL outputs, the scoring rules and this module's code it was computed
+    with; if any of them differs the scores are recomputed and the file is rewritten.'''
+    key = _cache_key(min_answered, reverse_epds)
+    if key in _cache:
+        return _cache[key].copy()
+
+    if os.path.exists(SCORES_PATH):
+        table = pq.read_table(SCORES_PATH)
+        if (table.schema.metadata or {}).get(b'scores_key', b'').decode() == key:
+            _cache[key] = table.to_pandas()
+            return _cache[key].copy()
+
+    item_cols = [c for spec in scales.values() for c in spec['items']]
+    items = loader.load_dyads(item_cols, compact=True)
+    scores = pd.concat([items[['participant_number']], score_items(items, min_answered, reverse_epds)], axis=1)
+
+    table = pa.Table.from_pandas(scores, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'scores_key': key.encode()})
+    # write then rename, so parallel processes never read a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(SCORES_PATH), suffix='.parquet.tmp')
+    os.close(fd)
+    pq.write_table(table, tmp)
+    os.replace(tmp, SCORES_PATH)
+    _cache[key] = scores
+    return scores.copy()
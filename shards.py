@@ -0,0 +1,277 @@
+import argparse
+import json
+import multiprocessing
+import operator
+import os
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+import pandas as pd
+import numpy as np
+
+import ETL
+import loader
+import online_stats
+
+
+# Sharded dataset for exports arriving per recruitment site and wave.
+# Each export goes through the ETL on its own and is written as dyad Parquet files (one per value of
+# `partition_by`, by default infant_age_category) under <directory>/<site>/<wave>/. manifest.json lists
+# every shard with its site, wave, row count and per-column stats: null count, min/max for numeric
+# columns and the values present for categoricals. Queries limited to a site, wave or category only
+# read the shards whose stats can match. The analyses are map-reduce jobs: each shard is reduced in a
+# worker process to the mergeable accumulators of online_stats (Counters of distinct values), which
+# are added up and turned into exactly the statistics scipy gives on the concatenated rows.
+# Run from the project root:
+#   python shards.py build --export site_a 1 site_a_wave1.csv --export site_b 1 site_b_wave1.csv
+#   python shards.py summary --site site_a --age-category '3-6 months'
+
+SHARDS_DIR = 'CSV_files/shards'
+MANIFEST_NAME = 'manifest.json'
+
+dyad_dtypes = {**ETL.participant_dtypes, **ETL.mental_health_dtypes}
+
+
+# Building the shards
+
+def dyad_frame(raw):
+    '''Raw export (one site and wave) -> consolidated, typed dyad frame'''
+    participant_df, mental_health_df = ETL.transform(raw)
+    participant_df = ETL.apply_schema(ETL.consolidate(participant_df), ETL.participant_dtypes)
+    mental_health_df = ETL.apply_schema(ETL.consolidate(mental_health_df), ETL.mental_health_dtypes)
+    loader.validate(participant_df, mental_health_df)
+    return loader.merge_tables(participant_df, mental_health_df)
+
+
+def column_stats(df):
+    '''{column: {'nulls', 'values'} for categoricals, {'nulls', 'min', 'max'} for numeric columns}'''
+    out = {}
+    for col in df.columns:
+        values = df[col]
+        entry = {'nulls': int(values.isna().sum())}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry['values'] = [str(v) for v in values.cat.remove_unused_categories().cat.categories]
+        else:
+            present = values.dropna()
+            entry['min'] = float(present.min()) if len(present) else None
+            entry['max'] = float(present.max()) if len(present) else None
+        out[col] = entry
+    return out
+
+
+def read_manifest(directory=SHARDS_DIR):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'partition_by': None, 'shards': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, directory=SHARDS_DIR):
+    '''Write the manifest to a temporary file and rename it, so readers never see a partial manifest'''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def add_export(raw_path, site, wave, directory=SHARDS_DIR, partition_by='infant_age_category'):
+    '''ETL one site/wave export into its shards and record them in the manifest, replacing the
+    shards of an earlier export of the same site and wave. Returns the new manifest entries.'''
+    manifest = read_manifest(directory)
+    if manifest['shards'] and manifest['partition_by'] != partition_by:
+        raise ValueError(f'{directory} is partitioned by {manifest["partition_by"]}, not {partition_by}')
+    site, wave = str(site), str(wave)
+
+    dyads = dyad_frame(pd.read_csv(raw_path, encoding='ISO-8859-1'))
+    os.makedirs(os.path.join(directory, site, wave), exist_ok=True)
+    parts = [(None, dyads)] if partition_by is None else dyads.groupby(partition_by, observed=True, dropna=False, sort=True)
+
+    # new files get a fresh name, so the shards they replace stay readable until the manifest switches over
+    batch = uuid.uuid4().hex[:12]
+    entries = []
+    for i, (_, part) in enumerate(parts):
+        path = os.path.join(site, wave, f'{batch}-part-{i:03d}.parquet')
+        part.to_parquet(os.path.join(directory, path), index=False)
+        entries.append({'path': path, 'site': site, 'wave': wave, 'rows': len(part), 'columns': column_stats(part)})
+
+    replaced = [shard for shard in manifest['shards'] if (shard['site'], shard['wave']) == (site, wave)]
+    kept = [shard for shard in manifest['shards'] if (shard['site'], shard['wave']) != (site, wave)]
+    write_manifest({'partition_by': partition_by, 'shards': kept + entries}, directory)
+    for shard in replaced:
+        try:
+            os.remove(os.path.join(directory, shard['path']))
+        except FileNotFoundError:
+            pass
+    return entries
+
+
+# Shard selection and reading
+
+def _wanted(value):
+    return [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+
+
+def may_match(shard, filters):
+    '''False when the manifest stats show that no row of `shard` satisfies `filters`
+    ({column: value or list of values}, 'site' and 'wave' included)'''
+    for col, value in (filters or {}).items():
+        wanted = _wanted(value)
+        if col in ('site', 'wave'):
+            if shard[col] not in wanted:
+                return False
+            continue
+        stats = shard['columns'][col]
+        if stats['nulls'] == shard['rows']:
+            return False
+        if 'values' in stats:
+            if not set(wanted) & set(stats['values']):
+                return False
+        elif not any(stats['min'] <= float(v) <= stats['max'] for v in wanted):
+            return False
+    return True
+
+
+def select(manifest, filters=None):
+    '''Shards of the manifest that may hold rows matching `filters`'''
+    return [shard for shard in manifest['shards'] if may_match(shard, filters)]
+
+
+def _matches(values, value):
+    '''Rows of a column equal to `value` (or one of a list of values): categorical and text columns are
+    compared as strings, as in the manifest, other columns with the values cast to the column dtype'''
+    wanted = value if isinstance(value, (list, tuple, set)) else [value]
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+        return values.astype(str).isin([str(v) for v in wanted]) & values.notna()
+    return values.isin(pd.Series(list(wanted)).astype(values.dtype)) & values.notna()
+
+
+def read_shard(shard, columns, filters=None, directory=SHARDS_DIR):
+    '''Rows of one shard matching `filters`, with `columns` (which may include scale scores, e.g. 'epds_total',
+    computed from the shard's items, and 'site' / 'wave')'''
+    import scoring
+    filters = {col: value for col, value in (filters or {}).items() if col not in ('site', 'wave')}
+    wanted = [c for c in dict.fromkeys([*columns, *filters]) if c not in ('site', 'wave')]
+    score_cols = [c for c in wanted if c not in dyad_dtypes]
+    item_cols = [c for spec in scoring.scales.values() for c in spec['items']] if score_cols else []
+    stored = list(dict.fromkeys([c for c in wanted if c in dyad_dtypes] + item_cols))
+
+    frame = pd.read_parquet(os.path.join(directory, shard['path']), columns=stored)
+    frame = frame.astype({c: dyad_dtypes[c] for c in stored})
+    for col, value in filters.items():
+        frame = frame[_matches(frame[col], value)]
+    if score_cols:
+        frame = pd.concat([frame, scoring.score_items(frame)[score_cols]], axis=1)
+    for col in ('site', 'wave'):
+        if col in columns:
+            frame[col] = shard[col]
+    return frame[list(columns)]
+
+
+# Map-reduce
+
+def _map_shard(mapper, columns, filters, directory, shard):
+    return mapper(read_shard(shard, columns, filters, directory))
+
+
+def map_reduce(mapper, columns, filters=None, reducer=operator.add, initial=None, directory=SHARDS_DIR, processes=None):
+    '''reducer-fold of mapper(frame) over the selected shards, mapped in a process pool.
+    `mapper` must be picklable (a module-level function or a partial of one).'''
+    shards = select(read_manifest(directory), filters)
+    task = partial(_map_shard, mapper, list(columns), filters, directory)
+    processes = min(processes or os.cpu_count() or 1, max(len(shards), 1))
+    if processes == 1:
+        parts = [task(shard) for shard in shards]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            parts = list(pool.map(task, shards))
+    return reduce(reducer, parts, initial) if initial is not None else reduce(reducer, parts)
+
+
+def pair_counts(x, y, frame):
+    '''Counter of the distinct (x, y) pairs of a shard'''
+    return online_stats.counts(frame[x], frame[y])
+
+
+def _counts(x, y, filters, **kwargs):
+    return map_reduce(partial(pair_counts, x, y), [x, y], filters, initial=Counter(), **kwargs)
+
+
+def group_medians(value, group, filters=None, **kwargs):
+    '''n and median of `value` per level of `group`, from the merged value counts of every shard'''
+    counter = _counts(group, value, filters, **kwargs)
+    groups, values, T = online_stats.table(counter)
+    rows = []
+    for g, counts in zip(groups, T):
+        cum = np.cumsum(counts)
+        n = int(cum[-1])
+        middle = np.searchsorted(cum, [(n - 1) // 2, n // 2], side='right')
+        rows.append({group: g, 'n': n, 'median': float(np.mean(np.asarray(values)[middle]))})
+    return pd.DataFrame(rows)
+
+
+def kruskal(value, group, filters=None, **kwargs):
+    '''Kruskal-Wallis H of `value` across the levels of `group`'''
+    return online_stats.kruskal(_counts(group, value, filters, **kwargs))
+
+
+def mannwhitneyu(value, group, x, y, filters=None, alternative='two-sided', **kwargs):
+    '''Mann-Whitney U of `value` between levels `x` and `y` of `group`'''
+    return online_stats.mannwhitneyu(_counts(group, value, filters, **kwargs), x, y, alternative)
+
+
+def contingency(row, col, filters=None, correction=True, **kwargs):
+    '''(contingency table, chi-square test) of two categorical columns'''
+    counter = _counts(row, col, filters, **kwargs)
+    rows, cols, matrix = online_stats.table(counter)
+    table = pd.DataFrame(matrix.astype(np.int64), index=pd.Index(rows, name=row), columns=pd.Index(cols, name=col))
+    return table, online_stats.chi2(counter, correction)
+
+
+def correlation(x, y, filters=None, **kwargs):
+    '''Spearman rho between two columns'''
+    return online_stats.spearman(_counts(x, y, filters, **kwargs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a sharded multi-site dataset and run the question statistics over it')
+    parser.add_argument('--dir', default=SHARDS_DIR, help='shard directory (holds manifest.json)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='ETL raw exports into shards')
+    build.add_argument('--export', nargs=3, action='append', required=True, metavar=('SITE', 'WAVE', 'RAW_PATH'))
+    build.add_argument('--partition-by', default='infant_age_category', help="column to split each export by ('' for none)")
+
+    summary = commands.add_parser('summary', help='question statistics over the (selected) shards')
+    summary.add_argument('--site', nargs='*')
+    summary.add_argument('--wave', nargs='*')
+    summary.add_argument('--age-category', nargs='*')
+    summary.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for site, wave, raw_path in args.export:
+            entries = add_export(raw_path, site, wave, args.dir, args.partition_by or None)
+            print(f'{site}/{wave}: {sum(e["rows"] for e in entries)} dyads in {len(entries)} shards')
+    else:
+        filters = {col: values for col, values in
+                   [('site', args.site), ('wave', args.wave), ('infant_age_category', args.age_category)] if values}
+        manifest = read_manifest(args.dir)
+        selected = select(manifest, filters)
+        print(f'{len(selected)} of {len(manifest["shards"])} shards, {sum(s["rows"] for s in selected)} dyads')
+        kw = {'filters': filters, 'directory': args.dir, 'processes': args.processes}
+
+        print(group_medians('infant_wakes_per_night', 'infant_sleeping_method', **kw).to_string(index=False))
+        tests = [('Q1 wakes ~ sleeping method, Kruskal-Wallis', kruskal('infant_wakes_per_night', 'infant_sleeping_method', **kw))]
+        if not args.age_category or len(args.age_category) > 1:
+            tests.append(('Q3 wakes ~ infant age, Kruskal-Wallis', kruskal('infant_wakes_per_night', 'infant_age_category', **kw)))
+        for label, result in tests + [
+            ('Q7 sleep duration ~ infant sex, Mann-Whitney U', mannwhitneyu('infant_nightly_sleep_duration', 'infant_sex', 'Female', 'Male', **kw)),
+            ('Q10 wakes ~ EPDS total, Spearman', correlation('infant_wakes_per_night', 'epds_total', **kw)),
+            ('Q6 education x sleeping method, chi-square', contingency('education', 'infant_sleeping_method', **kw)[1])
+        ]:
+            print(f'{label:<50} statistic={result.statistic:.4f} p={result.pvalue:.4g} n={result.n}')
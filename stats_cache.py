@@ -0,0 +1,146 @@
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import tempfile
+from importlib.metadata import version
+import pandas as pd
+import numpy as np
+
+import rank_index
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Persistent cache for the statistical tests used by the analysis scripts.
+# A result is stored under the hash of the test name, its parameters, the library versions, the source of
+# the modules implementing the tests and the exact values (and dtypes) of the columns it was given, so a
+# rerun only recomputes tests whose inputs or code changed.
+# Entries live as one pickle per key in CACHE_DIR; reads refresh an entry's mtime and writes evict the
+# least recently used entries once the directory exceeds MAX_BYTES.
+
+CACHE_DIR = os.path.join('CSV_files', '.stats_cache')
+MAX_BYTES = 64 * 1024 * 1024
+
+# set to False (or STATS_CACHE=0 in the environment) to always recompute
+enabled = os.environ.get('STATS_CACHE', '1') != '0'
+
+# modules whose code computes the cached results: editing any of them invalidates the existing entries
+implementation_modules = ['stats_cache', 'rank_index', 'posthoc', 'multitest']
+_versions = {}
+
+
+def _hash_input(value, digest):
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        digest.update(repr([(str(c), repr(t)) for c, t in frame.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'sequence{len(value)}'.encode())
+        for item in value:
+            _hash_input(item, digest)
+    else:
+        array = np.ascontiguousarray(value)
+        digest.update(f'{array.dtype}{array.shape}'.encode())
+        digest.update(array.tobytes() if array.dtype != object else repr(array.tolist()).encode())
+
+
+def implementation_version():
+    '''Hash of the source of implementation_modules, computed once per process'''
+    if 'implementation' not in _versions:
+        digest = hashlib.sha1()
+        for name in implementation_modules:
+            with open(importlib.util.find_spec(name).origin, 'rb') as f:
+                digest.update(f.read())
+        _versions['implementation'] = digest.hexdigest()
+    return _versions['implementation']
+
+
+def cache_key(test, inputs, params):
+    '''Hash of the test name, its parameters, the library versions, the implementation and the input values'''
+    digest = hashlib.sha1()
+    # read from the package metadata, so that hashing a key never imports scipy
+    versions = {'scipy': version('scipy'), 'pandas': pd.__version__, 'implementation': implementation_version()}
+    digest.update(json.dumps({'test': test, 'params': params, 'versions': versions}, sort_keys=True, default=repr).encode())
+    _hash_input(list(inputs), digest)
+    return digest.hexdigest()
+
+
+def _evict(max_bytes):
+    '''Delete least recently used entries until the cache fits in max_bytes'''
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # already evicted by a concurrent run
+        total -= size
+
+
+def cached(test, compute, inputs, params, max_bytes=None):
+    '''Return compute() for (test, inputs, params), from the disk cache when it has been computed before'''
+    if not enabled:
+        return compute()
+
+    path = os.path.join(CACHE_DIR, cache_key(test, inputs, params) + '.pkl')
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        os.utime(path)
+        return result
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    result = compute()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # write then rename, so parallel runs never read a partial entry
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp, path)
+    _evict(MAX_BYTES if max_bytes is None else max_bytes)
+    return result
+
+
+def clear():
+    '''Remove every cached result'''
+    if os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            os.remove(os.path.join(CACHE_DIR, name))
+
+
+# Cached versions of the tests, with the same signatures and return values as the originals.
+# Kruskal-Wallis and Mann-Whitney U rank Series of the dyad data through rank_index instead of sorting them.
+
+def kruskal(*samples, **params):
+    return cached('scipy.stats.kruskal', lambda: rank_index.kruskal(*samples, **params), samples, params)
+
+
+def mannwhitneyu(x, y, **params):
+    return cached('scipy.stats.mannwhitneyu', lambda: rank_index.mannwhitneyu(x, y, **params), [x, y], params)
+
+
+def chi2_contingency(observed, **params):
+    return cached('scipy.stats.chi2_contingency', lambda: stats.chi2_contingency(observed, **params), [observed], params)
+
+
+def pairwise_rank_tests(data, dv, between, **params):
+    '''posthoc.pairwise_rank_tests, keyed on only the columns it uses (dv and between)'''
+    import posthoc
+    return cached('posthoc.pairwise_rank_tests', lambda: posthoc.pairwise_rank_tests(data, dv, between, **params),
+                  [data[[dv, between]]], {'dv': dv, 'between': between, **params})
@@ -0,0 +1,388 @@
+import argparse
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+
+import loader
+import query
+import rank_index
+import scoring
+from association import chi2_tables
+from correlation import _p_values
+from multitest import add_adjusted
+from posthoc import _mwu_p
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+
+# Stratified execution of the question tests, e.g. Q10's wakes-vs-EPDS correlation within every
+# infant age category x infant sex x pregnancy type cell, and the stratum-adjusted test across them.
+# The dyads are partitioned once: rows are sorted by their stratum code, so each stratum is a contiguous
+# slice of one (columns x rows) float64 matrix (categoricals as their codes). The matrix is placed in
+# shared memory and worker processes reduce their strata to the summaries the tests need, without
+# copying the data: rank sums, group sizes and the tie term (Kruskal-Wallis, Mann-Whitney U), rho and n
+# (Spearman), contingency tables (chi-square). The parent turns the summaries into the per-stratum tests
+# and combines them: van Elteren's stratified rank test (the k-sample form for Kruskal-Wallis questions),
+# the generalised Cochran-Mantel-Haenszel test (with the Mantel-Haenszel odds ratio for 2x2 tables) and
+# an inverse-variance pooled Fisher z for correlations. Rank-test p-values are the asymptotic ones.
+# Run from the project root:
+#   python strata.py Q1 Q10 --by infant_age_category infant_sex
+
+default_by = ['infant_age_category', 'infant_sex', 'pregnancy_type']
+
+StratifiedTest = namedtuple('StratifiedTest', ['kind', 'x', 'y', 'levels'], defaults=[None])
+Comparison = namedtuple('Comparison', ['question', 'kind', 'x', 'y', 'rows', 'k'])
+Partition = namedtuple('Partition', ['order', 'bounds', 'labels'])
+CombinedResult = namedtuple('CombinedResult', ['method', 'statistic', 'dof', 'pvalue', 'estimate', 'n', 'strata'])
+StratifiedResult = namedtuple('StratifiedResult', ['strata', 'combined'])
+
+ibq_items = scoring.scales['ibq']['items']
+
+# question -> its test: kruskal (x by the levels of y), mannwhitneyu (x between levels[0] and levels[1]
+# of y; None = every other level), spearman (every x against every y) or chi2 (x by y)
+tests = {
+    'Q1': StratifiedTest('kruskal', 'infant_wakes_per_night', 'infant_sleeping_method'),
+    'Q2': StratifiedTest('mannwhitneyu', 'cbts_total', 'marital_status', (['In a relationship'], None)),
+    'Q3': StratifiedTest('kruskal', 'infant_wakes_per_night', 'infant_age_category'),
+    'Q4': StratifiedTest('kruskal', 'infant_nightly_sleep_duration', 'infant_sleeping_method'),
+    'Q5': StratifiedTest('spearman', ['infant_gestational_age'], ibq_items),
+    'Q6': StratifiedTest('chi2', 'education', 'infant_sleeping_method'),
+    'Q7': StratifiedTest('mannwhitneyu', 'infant_nightly_sleep_duration', 'infant_sex', (['Female'], ['Male'])),
+    'Q8': StratifiedTest('spearman', ['infant_wakes_per_night'], ibq_items),
+    'Q9': StratifiedTest('spearman', ['age'], ['cbts_total', 'epds_total']),
+    'Q10': StratifiedTest('spearman', ['infant_wakes_per_night'], ['cbts_total', 'epds_total', 'hads_total']),
+    'Q11': StratifiedTest('mannwhitneyu', 'ibq_mean', 'infant_sleeping_method', (['Alone in the crib'], None)),
+    'Q12': StratifiedTest('spearman', ['cbts_total', 'epds_total'], ['ibq_mean'])
+}
+
+
+def test_columns(test):
+    x = test.x if isinstance(test.x, list) else [test.x]
+    y = test.y if isinstance(test.y, list) else [test.y]
+    return list(dict.fromkeys(x + y))
+
+
+# Partitioning and the shared column matrix
+
+def partition(frame, by):
+    '''Row order that makes every stratum of the `by` columns contiguous, the stratum bounds in that
+    order and the stratum labels. Rows missing a stratifier are left out.'''
+    groups = query.group_codes(frame, by)
+    keep = np.flatnonzero(groups.codes >= 0)
+    order = keep[np.argsort(groups.codes[keep], kind='stable')]
+    counts = np.bincount(groups.codes[keep], minlength=len(groups.labels))
+    return Partition(order, np.concatenate([[0], np.cumsum(counts)]), groups.labels)
+
+
+def _codes(values, levels=None):
+    '''Integer codes (-1 = missing) of a categorical column over its observed levels, or 0/1 for the two
+    level lists of a Mann-Whitney comparison'''
+    values = values.astype(object)
+    if levels is None:
+        codes, labels = pd.factorize(values, sort=True)
+        return codes, len(labels)
+    first, second = levels
+    other = values.notna() if second is None else values.isin(second)
+    return np.where(values.isin(first), 0, np.where(other, 1, -1)), 2
+
+
+def comparisons(frame, names):
+    '''The comparisons of the questions `names` and the (columns x rows) float64 matrix they read'''
+    arrays, keys, out = [], {}, []
+
+    def row(key, values):
+        if key not in keys:
+            keys[key] = len(arrays)
+            arrays.append(np.asarray(values, dtype=np.float64))
+        return keys[key]
+
+    def numeric(column):
+        return row(column, frame[column].to_numpy(dtype=np.float64, na_value=np.nan))
+
+    for name in names:
+        test = tests[name]
+        if test.kind == 'spearman':
+            out += [Comparison(name, test.kind, x, y, (numeric(x), numeric(y)), None) for x in test.x for y in test.y]
+        elif test.kind == 'chi2':
+            (a, k_a), (b, k_b) = _codes(frame[test.x]), _codes(frame[test.y])
+            out.append(Comparison(name, test.kind, test.x, test.y, (row(test.x, a), row(test.y, b)), (k_a, k_b)))
+        else:
+            codes, k = _codes(frame[test.y], test.levels)
+            key = test.y if test.levels is None else (test.y, str(test.levels))
+            out.append(Comparison(name, test.kind, test.x, test.y, (numeric(test.x), row(key, codes)), k))
+    return out, np.vstack(arrays)
+
+
+# Per-stratum summaries (run in the workers)
+
+def _spearman(x, y):
+    keep = ~np.isnan(x) & ~np.isnan(y)
+    n = int(keep.sum())
+    if n < 3:
+        return np.nan, n
+    rx, _ = rank_index.ranks(x[keep])
+    ry, _ = rank_index.ranks(y[keep])
+    rx, ry = rx - rx.mean(), ry - ry.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (rx @ ry) / np.sqrt((rx @ rx) * (ry @ ry)), n
+
+
+def summary(comparison, block):
+    '''Sufficient summary of one comparison on the rows of one stratum'''
+    a, b = (block[i] for i in comparison.rows)
+    if comparison.kind == 'spearman':
+        return _spearman(a, b)
+    if comparison.kind == 'chi2':
+        (k_a, k_b), a, b = comparison.k, a.astype(np.int64), b.astype(np.int64)
+        keep = (a >= 0) & (b >= 0)
+        return np.bincount(a[keep] * k_b + b[keep], minlength=k_a * k_b).reshape(k_a, k_b)
+    return query.group_rank_sums(b.astype(np.int64), a, comparison.k)
+
+
+def _summarise(block, comparisons, strata):
+    return [[summary(c, block[:, start:stop]) for c in comparisons] for start, stop in strata]
+
+
+def _summarise_shared(name, shape, comparisons, strata):
+    '''_summarise on the matrix in the shared memory block `name`'''
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        out = _summarise(block, comparisons, strata)
+        del block
+        return out
+    finally:
+        shm.close()
+
+
+def summarise(matrix, comparisons, bounds, processes=None):
+    '''Summaries of every comparison (inner lists) in every stratum (outer list) of the sorted `matrix`,
+    with the strata split over a process pool that reads the matrix from shared memory'''
+    strata = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    processes = min(processes or os.cpu_count() or 1, max(len(strata), 1))
+    if processes == 1:
+        return _summarise(matrix, comparisons, strata)
+
+    chunks = [c for c in np.array_split(np.arange(len(strata)), processes * 4) if len(c)]
+    shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        shared = np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = matrix
+        del shared
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            task = partial(_summarise_shared, shm.name, matrix.shape, comparisons)
+            parts = list(pool.map(task, [[strata[i] for i in chunk] for chunk in chunks]))
+    finally:
+        shm.close()
+        shm.unlink()
+    return [stratum for part in parts for stratum in part]
+
+
+# Tests within a stratum
+
+def kruskal_wallis(rank_sums):
+    '''(H, p, n) of one stratum from its RankSums, as scipy.stats.kruskal; NaN with fewer than two groups'''
+    R, n, tie_term = rank_sums
+    present = n > 0
+    N = n.sum()
+    if present.sum() < 2:
+        return np.nan, np.nan, int(N)
+    H = 12 / (N * (N + 1)) * (R[present] ** 2 / n[present]).sum() - 3 * (N + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        H /= 1 - tie_term / (N ** 3 - N)
+    return H, stats.chi2.sf(H, present.sum() - 1), int(N)
+
+
+def mann_whitney(rank_sums):
+    '''(U of the first group, two-sided asymptotic p, n) of one stratum from its RankSums'''
+    R, (n1, n2), tie_term = rank_sums
+    if not n1 or not n2:
+        return np.nan, np.nan, int(n1 + n2)
+    U1 = R[0] - n1 * (n1 + 1) / 2
+    return U1, float(_mwu_p(U1, n1, n2, tie_term, 'two-sided')), int(n1 + n2)
+
+
+# Combining the strata
+
+def _quadratic(U, V):
+    '''U' V^- U and the rank of V (the degrees of freedom), with a pseudo-inverse for groups or levels that never occur'''
+    dof = np.linalg.matrix_rank(V) if V.any() else 0
+    return (float(U @ np.linalg.pinv(V) @ U), int(dof)) if dof else (np.nan, 0)
+
+
+def van_elteren(rank_sums):
+    '''van Elteren's stratified rank test from the RankSums of every stratum: rank-sum deviations are
+    weighted by 1 / (n_h + 1) and summed, so larger strata do not dominate. With two groups the statistic
+    is the signed z of the first group (two-sided p); with k groups the chi-square on k - 1 df of the
+    k-sample generalisation (which is the Kruskal-Wallis H for a single stratum).'''
+    R = np.array([r.rank_sums for r in rank_sums], dtype=np.float64)
+    n = np.array([r.counts for r in rank_sums], dtype=np.float64)
+    ties = np.array([r.tie_term for r in rank_sums], dtype=np.float64)
+    N = n.sum(axis=1)
+    used = N > 1
+    R, n, ties, N = R[used], n[used], ties[used], N[used]
+
+    w = 1 / (N + 1)
+    U = (w[:, None] * (R - n * (N[:, None] + 1) / 2)).sum(axis=0)
+    # covariance of the rank sums when ranks are drawn without replacement, ties averaged
+    s2 = (N ** 2 - 1) / 12 - ties / (12 * N)
+    scale = w ** 2 * s2 * N / (N - 1)
+    V = np.einsum('h,hj,jl->jl', scale, n, np.eye(n.shape[1])) - np.einsum('h,hj,hl->jl', scale / N, n, n)
+    total = int(N.sum())
+
+    if n.shape[1] == 2:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = U[0] / np.sqrt(V[0, 0])
+        return CombinedResult('van Elteren', z, 1, 2 * stats.norm.sf(abs(z)), np.nan, total, int(used.sum()))
+    H, dof = _quadratic(U[:-1], V[:-1, :-1])
+    p = stats.chi2.sf(H, dof) if dof else np.nan
+    return CombinedResult('van Elteren (k-sample)', H, dof, p, np.nan, total, int(used.sum()))
+
+
+def mantel_haenszel_odds_ratio(tables):
+    '''Mantel-Haenszel common odds ratio of a stack of 2x2 tables'''
+    T = np.asarray(tables, dtype=np.float64)
+    n = T.sum(axis=(1, 2))
+    used = n > 0
+    T, n = T[used], n[used]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (T[:, 0, 0] * T[:, 1, 1] / n).sum() / (T[:, 0, 1] * T[:, 1, 0] / n).sum()
+
+
+def cochran_mantel_haenszel(tables):
+    '''Generalised Cochran-Mantel-Haenszel test of general association for a stack of r x c tables
+    (one per stratum), chi-square on (r - 1)(c - 1) df, and the Mantel-Haenszel odds ratio for 2x2 tables'''
+    T = np.asarray(tables, dtype=np.float64)
+    n = T.sum(axis=(1, 2))
+    used = n > 1
+    T, n = T[used], n[used]
+    r, c = T.sum(axis=2), T.sum(axis=1)
+    expected = r[:, :, None] * c[:, None, :] / n[:, None, None]
+    U = (T - expected)[:, :-1, :-1].sum(axis=0).ravel()
+
+    # covariance of the cells under the product multivariate hypergeometric distribution
+    def margin(m):
+        m = m[:, :-1]
+        return n[:, None, None] * (m[:, :, None] * np.eye(m.shape[1])) - m[:, :, None] * m[:, None, :]
+    Vr, Vc = margin(r), margin(c)
+    V = np.zeros((len(U), len(U)))
+    if len(n):
+        V = np.einsum('hab,hcd,h->acbd', Vr, Vc, 1 / (n ** 2 * (n - 1))).reshape(len(U), len(U))
+
+    Q, dof = _quadratic(U, V)
+    p = stats.chi2.sf(Q, dof) if dof else np.nan
+    odds_ratio = mantel_haenszel_odds_ratio(T) if T.shape[1:] == (2, 2) else np.nan
+    return CombinedResult('Cochran-Mantel-Haenszel', Q, dof, p, odds_ratio, int(n.sum()), int(used.sum()))
+
+
+def fisher_z(rho, n):
+    '''Spearman rho pooled over strata on the Fisher z scale, weighted by the inverse of the Fieller
+    variance 1.06 / (n - 3); the statistic is the pooled z over its standard error'''
+    rho, n = np.asarray(rho, dtype=np.float64), np.asarray(n, dtype=np.float64)
+    used = (n > 3) & (np.abs(rho) < 1)
+    w = (n[used] - 3) / 1.06
+    if not used.any():
+        return CombinedResult('Fisher z', np.nan, np.nan, np.nan, np.nan, int(n.sum()), 0)
+    z = (w * np.arctanh(rho[used])).sum() / w.sum()
+    statistic = z * np.sqrt(w.sum())
+    return CombinedResult('Fisher z', statistic, np.nan, 2 * stats.norm.sf(abs(statistic)), np.tanh(z), int(n[used].sum()), int(used.sum()))
+
+
+def within(comparison, summaries):
+    '''(statistic, p, n) per stratum'''
+    if comparison.kind == 'spearman':
+        rho = np.array([s[0] for s in summaries], dtype=np.float64)
+        n = np.array([s[1] for s in summaries])
+        return rho, _p_values(rho, n), n
+    if comparison.kind == 'chi2':
+        chi2, _, p, _, n = chi2_tables(np.array(summaries))
+        return chi2, p, n.astype(np.int64)
+    test = kruskal_wallis if comparison.kind == 'kruskal' else mann_whitney
+    return tuple(np.array(v) for v in zip(*(test(s) for s in summaries)))
+
+
+def combine(comparison, summaries):
+    '''CombinedResult of one comparison over the strata'''
+    if comparison.kind == 'spearman':
+        return fisher_z(*within(comparison, summaries)[::2])
+    if comparison.kind == 'chi2':
+        return cochran_mantel_haenszel(np.array(summaries))
+    return van_elteren(summaries)
+
+
+# Stratified analysis
+
+def applicable(names, by):
+    '''Questions that can be stratified by `by` (their test does not use a stratifier itself)'''
+    return [name for name in names if not set(test_columns(tests[name])) & set(by)]
+
+
+def analyse(frame, names=None, by=default_by, processes=None):
+    '''{question: StratifiedResult} for the questions `names` (default: every one applicable) on `frame`,
+    from one partition of its rows by the `by` columns.
+
+    `strata` has one row per stratum and comparison (x, y) with the stratifier values, n, the test
+    statistic (H, U of the first group, rho or chi-square), p and the Holm-adjusted p across strata;
+    `combined` one row per comparison with the stratum-adjusted test and its Holm-adjusted p across the
+    question's comparisons.'''
+    by = [by] if isinstance(by, str) else list(by)
+    names = applicable(list(tests) if names is None else names, by)
+    if not names:
+        return {}
+    parts = partition(frame, by)
+    compared, matrix = comparisons(frame, names)
+    summaries = summarise(matrix[:, parts.order], compared, parts.bounds, processes)
+
+    labels = parts.labels.to_frame(index=False) if isinstance(parts.labels, pd.MultiIndex) else pd.DataFrame({by[0]: parts.labels})
+    results = {}
+    for name in names:
+        strata_rows, combined_rows = [], []
+        for j, comparison in enumerate(compared):
+            if comparison.question != name:
+                continue
+            per_stratum = [stratum[j] for stratum in summaries]
+            statistic, p, n = within(comparison, per_stratum)
+            strata_rows.append(labels.assign(x=comparison.x, y=comparison.y, n=n, statistic=statistic, p=p))
+            combined_rows.append({'x': comparison.x, 'y': comparison.y, **combine(comparison, per_stratum)._asdict()})
+        strata_table = add_adjusted(pd.concat(strata_rows, ignore_index=True), by=['x', 'y'])
+        combined = add_adjusted(pd.DataFrame(combined_rows).rename(columns={'pvalue': 'p'}))
+        results[name] = StratifiedResult(strata_table, combined)
+    return results
+
+
+def run(names=None, by=default_by, processes=None):
+    '''analyse() on the dyads, loading only the columns the questions and stratifiers need'''
+    by = [by] if isinstance(by, str) else list(by)
+    names = applicable(list(tests) if names is None else names, by)
+    if not names:
+        return {}
+    columns = list(dict.fromkeys(by + [c for name in names for c in test_columns(tests[name])]))
+    return analyse(loader.load_dyads(columns), names, by, processes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the question tests within strata and combine them across strata')
+    parser.add_argument('questions', nargs='*', help=f'questions to run (default: all of {", ".join(tests)})')
+    parser.add_argument('--by', nargs='+', default=default_by, help='stratifying columns')
+    parser.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+    unknown = [q for q in args.questions if q not in tests]
+    if unknown:
+        parser.error(f'unknown questions: {unknown}')
+
+    selected = args.questions or list(tests)
+    for name in selected:
+        if name not in applicable([name], args.by):
+            print(f'{name}: skipped, its test uses a stratifier')
+    for name, result in run(selected, args.by, args.processes).items():
+        print(f'\n{name}')
+        print(result.strata.to_string(index=False))
+        print(result.combined.to_string(index=False))